@@ -0,0 +1,309 @@
+#!/usr/bin/env node
+
+// Production build of the web page.
+//
+//   ./build.js [--out dist]
+//
+// During development www/ is served as it is: the browser loads the full Vue build,
+// compiles the x-templates of index.html at every startup and fetches vue,
+// config.js, search.js, vaultdata.js and pwmgr.js one by one. This writes a copy of
+// the page to --out (default dist/) where instead
+//
+//   - the templates are compiled to render functions with the compiler of www/vue,
+//     and the page loads the runtime-only part of that Vue build in production mode
+//   - Vue, config.js, search.js, vaultdata.js and pwmgr.js are one minified script,
+//     app.<hash>.js, named after a hash of its content. httpd.py lets browsers cache
+//     it for good (see HASHED_FILE), a new build has a new name in index.html.
+//   - dataworker.js holds config.js and vaultdata.js too, so the worker does not
+//     load them separately.
+//
+// Both scripts are also written compressed (.gz and .br) for httpd.py. Serve the
+// result with 'cd dist; ../httpd.py'. config.js is built in, so rebuild after
+// changing www/config/config.js.
+//
+// The minifier is a conservative one: comments, indentation and blank lines are
+// dropped, but line breaks are kept so that automatic semicolon insertion is not
+// affected. Needs only node.js, no packages.
+
+var crypto = require("crypto")
+var fs = require("fs")
+var path = require("path")
+var vm = require("vm")
+var zlib = require("zlib")
+
+var WWW = path.join(__dirname, "www")
+
+// The scripts of the page in the order index.html loads them, after vue
+var SCRIPTS = ["config/config.js", "search.js", "vaultdata.js", "pwmgr.js"]
+
+// Files copied to the output as they are
+var ASSETS = ["images"]
+
+// Where the compiler part of the Vue full build starts and ends (Vue 2.5)
+var COMPILER_START = "\n/*  */\n\nvar defaultTagRE"
+var COMPILER_END = "\nreturn Vue;"
+
+// Character references the template compiler may come across in template text
+var ENTITIES = {amp: "&", lt: "<", gt: ">", quot: '"', apos: "'", nbsp: "\u00a0"}
+
+/* Characters of identifiers, keywords and numbers, between which whitespace stays */
+var WORD = /[A-Za-z0-9_$\u0080-\uffff]/
+
+/* Keywords after which a '/' starts a regular expression rather than a division */
+var REGEX_AFTER = ["return", "typeof", "instanceof", "in", "of", "new", "delete",
+                   "void", "throw", "case", "do", "else"]
+
+function fail(message) {
+    console.error("build.js: "+ message)
+    process.exit(1)
+}
+
+function read(name) {
+    return fs.readFileSync(path.join(WWW, name), "utf8")
+}
+
+/* Decode the character references of template text, in place of the element the
+compiler uses for it in the browser */
+function decodeEntities(text) {
+    return text.replace(/&(#x[0-9a-f]+|#[0-9]+|\w+);/gi, function (ref, name) {
+        if (name[0] === "#") {
+            return String.fromCodePoint(name[1] === "x" || name[1] === "X" ?
+                                        parseInt(name.slice(2), 16) : parseInt(name.slice(1), 10))
+        }
+        if (!(name in ENTITIES)) fail("unknown character reference "+ ref +" in a template")
+        return ENTITIES[name]
+    })
+}
+
+/* Return the full Vue build of www/vue for running its template compiler here. */
+function loadVue(source) {
+    var decoder = {
+        set innerHTML(html) { this.textContent = decodeEntities(html) },
+    }
+    var sandbox = {console: console, document: {createElement: function () { return decoder }}}
+    vm.runInNewContext(source, sandbox, {filename: "www/vue"})
+    var Vue = sandbox.Vue
+    Vue.config.warnHandler = function (msg) { throw new Error(msg) }
+    return Vue
+}
+
+/* Return the runtime-only part of the Vue full build in production mode, as the
+vue.runtime.min.js of the same release would behave. */
+function vueRuntime(source) {
+    var start = source.indexOf(COMPILER_START)
+    var end = source.lastIndexOf(COMPILER_END)
+    if (start < 0 || end < start) fail("www/vue is not a Vue 2.5 full build")
+    return (source.slice(0, start) + source.slice(end)).replace(/"development"/g, '"production"')
+}
+
+/* Return the x-templates of index.html keyed by id */
+function xTemplates(html) {
+    var templates = {}
+    var re = /<script type="text\/x-template" id="([\w-]+)">([\s\S]*?)<\/script>/g
+    var match
+    while ((match = re.exec(html)) !== null) templates[match[1]] = match[2]
+    return templates
+}
+
+/* Return the source of a function made by the Vue compiler as an anonymous function */
+function functionSource(fn) {
+    var source = String(fn)
+    return "function () {"+ source.slice(source.indexOf("{") + 1, source.lastIndexOf("}")) +"}"
+}
+
+/* Replace the template: "#<id>" options of the components in a script with the
+render functions compiled from the templates. All templates have to be used. */
+function compileTemplates(Vue, script, templates) {
+    var used = {}
+    script = script.replace(/template: (["'])#([\w-]+)\1/g, function (option, quote, id) {
+        if (!(id in templates)) fail("no template #"+ id +" in index.html")
+        used[id] = true
+        var compiled
+        try {
+            compiled = Vue.compile(templates[id])
+        } catch (e) {
+            fail("template #"+ id +": "+ e.message)
+        }
+        return "render: "+ functionSource(compiled.render) +",\n    staticRenderFns: ["+
+            compiled.staticRenderFns.map(functionSource).join(",\n") +"]"
+    })
+    for (var id in templates) {
+        if (!used[id]) fail("template #"+ id +" is not used by any component")
+    }
+    return script
+}
+
+/* True if a '/' after the token last starts a regular expression */
+function regexAllowed(last) {
+    if (last === "") return true
+    if (WORD.test(last[0])) return REGEX_AFTER.indexOf(last) >= 0
+    return [")", "]", "}", "string", "regex"].indexOf(last) < 0
+}
+
+/* Return a script without comments (except /*! licence comments), indentation and
+blank lines. name is used in error messages. */
+function minify(source, name) {
+    var lines = []
+    var line = ""
+    var last = ""       // last token: a word, a punctuation character, "string" or "regex"
+    var space = false   // whitespace since the last token
+    var i = 0, n = source.length
+
+    function emit(text) {
+        if (space && line) {
+            var prev = line[line.length - 1], next = text[0]
+            if ((WORD.test(prev) && WORD.test(next)) ||
+                ((prev === "+" || prev === "-") && prev === next) ||
+                (/[0-9]/.test(prev) && next === "."))
+                line += " "
+        }
+        line += text
+        space = false
+    }
+    function newline() {
+        if (line) lines.push(line)
+        line = ""
+        space = false
+    }
+    function lineNumber() {
+        return name +":"+ source.slice(0, i).split("\n").length
+    }
+
+    while (i < n) {
+        var c = source[i], j
+        if (c === "\n") {
+            newline()
+            i++
+        } else if (c === " " || c === "\t" || c === "\r") {
+            space = true
+            i++
+        } else if (c === "/" && source[i + 1] === "/") {
+            while (i < n && source[i] !== "\n") i++
+        } else if (c === "/" && source[i + 1] === "*") {
+            j = source.indexOf("*/", i + 2)
+            if (j < 0) fail("unterminated comment at "+ lineNumber())
+            var comment = source.slice(i, j + 2)
+            if (comment[2] === "!") emit(comment)
+            else if (comment.indexOf("\n") >= 0) newline()
+            else space = true
+            i = j + 2
+        } else if (c === '"' || c === "'" || c === "`") {
+            for (j = i + 1; j < n && source[j] !== c; j++) {
+                if (source[j] === "\\") j++
+            }
+            if (j >= n) fail("unterminated string at "+ lineNumber())
+            emit(source.slice(i, j + 1))
+            last = "string"
+            i = j + 1
+        } else if (c === "/" && regexAllowed(last)) {
+            var inClass = false
+            for (j = i + 1; j < n; j++) {
+                var d = source[j]
+                if (d === "\\") j++
+                else if (d === "[") inClass = true
+                else if (d === "]") inClass = false
+                else if (d === "/" && !inClass) break
+                else if (d === "\n") fail("unterminated regular expression at "+ lineNumber())
+            }
+            for (j++; j < n && /[a-z]/.test(source[j]); j++) {}
+            emit(source.slice(i, j))
+            last = "regex"
+            i = j
+        } else if (WORD.test(c)) {
+            for (j = i + 1; j < n && WORD.test(source[j]); j++) {}
+            last = source.slice(i, j)
+            emit(last)
+            i = j
+        } else {
+            emit(c)
+            last = c
+            i++
+        }
+    }
+    newline()
+    var result = lines.join("\n") +"\n"
+    try {
+        new vm.Script(result, {filename: name})
+    } catch (e) {
+        fail("minified "+ name +" does not parse: "+ e.message)
+    }
+    return result
+}
+
+/* Write a file along with its .gz and .br versions for httpd.py */
+function writeCompressed(file, data) {
+    fs.writeFileSync(file, data)
+    fs.writeFileSync(file +".gz", zlib.gzipSync(data, {level: 9}))
+    fs.writeFileSync(file +".br", zlib.brotliCompressSync(data, {
+        params: {[zlib.constants.BROTLI_PARAM_QUALITY]: 11}}))
+}
+
+/* Copy a file or directory tree */
+function copy(from, to) {
+    if (fs.statSync(from).isDirectory()) {
+        fs.mkdirSync(to, {recursive: true})
+        fs.readdirSync(from).forEach(function (name) {
+            copy(path.join(from, name), path.join(to, name))
+        })
+    } else {
+        fs.copyFileSync(from, to)
+    }
+}
+
+/* Return index.html without the x-templates and comments, loading the bundle in
+place of the separate scripts. */
+function productionHtml(html, bundle) {
+    html = html.replace(/[ \t]*<!--[\s\S]*?-->[ \t]*\n/g, "")
+    html = html.replace(/<script type="text\/x-template"[\s\S]*?<\/script>\n*/g, "")
+    html = html.replace(/[ \t]*<script src="vue"><\/script>\n/, "")
+    var scripts = SCRIPTS.map(function (name) { return '<script src="'+ name +'"></script>\n' })
+    if (html.indexOf(scripts.join("")) < 0) fail("index.html does not load "+ SCRIPTS.join(", ") +" in order")
+    return html.replace(scripts.join(""), '<script src="'+ bundle +'"></script>\n')
+}
+
+/* Return dataworker.js with config.js and vaultdata.js in place of importScripts */
+function workerScript() {
+    var worker = read("dataworker.js")
+    var imports = 'importScripts("config/config.js", "vaultdata.js")\n'
+    if (worker.indexOf(imports) < 0) fail("dataworker.js does not import config.js and vaultdata.js")
+    return worker.replace(imports, function () {
+        return read("config/config.js") +";\n"+ read("vaultdata.js") +";\n"
+    })
+}
+
+function main(argv) {
+    var out = path.join(__dirname, "dist")
+    for (var i = 0; i < argv.length; i++) {
+        if (argv[i] === "--out" && i + 1 < argv.length) out = path.resolve(argv[++i])
+        else fail("usage: build.js [--out DIR]")
+    }
+
+    var vue = read("vue")
+    var html = read("index.html")
+    var templates = xTemplates(html)
+    var Vue = loadVue(vue)
+    var sources = [minify(vueRuntime(vue), "vue")].concat(SCRIPTS.map(function (name) {
+        var script = read(name)
+        if (name === "pwmgr.js") script = compileTemplates(Vue, script, templates)
+        return minify(script, name)
+    }))
+    var bundle = sources.join(";\n")
+    var hash = crypto.createHash("sha256").update(bundle).digest("hex").slice(0, 12)
+    var bundleName = "app."+ hash +".js"
+
+    fs.rmSync(out, {recursive: true, force: true})
+    fs.mkdirSync(out, {recursive: true})
+    writeCompressed(path.join(out, bundleName), bundle)
+    writeCompressed(path.join(out, "dataworker.js"), minify(workerScript(), "dataworker.js"))
+    fs.writeFileSync(path.join(out, "index.html"), productionHtml(html, bundleName))
+    ASSETS.forEach(function (name) { copy(path.join(WWW, name), path.join(out, name)) })
+
+    var size = 0
+    SCRIPTS.concat(["vue"]).forEach(function (name) { size += fs.statSync(path.join(WWW, name)).size })
+    console.log("%s: %d bytes (%d gzip, %d brotli), the scripts were %d bytes",
+                path.join(out, bundleName), bundle.length,
+                fs.statSync(path.join(out, bundleName +".gz")).size,
+                fs.statSync(path.join(out, bundleName +".br")).size, size)
+}
+
+main(process.argv.slice(2))
@@ -3,76 +3,705 @@
 # Paul T Sparks 2015-03-04
 
 import BaseHTTPServer
+import Queue
 import SocketServer
+import argparse
+import email.utils
+import gzip
+import httplib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import signal
 import socket
 import string
 import sys
 import threading
 import time
+import urllib
 import urlparse
+from cStringIO import StringIO
+
+import vaultpool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 HOST_NAME = 'localhost'
 PORT_NUMBER = 7080
 
+# Vault server that requests for /v1/... are passed to and the number of
+# persistent connections kept to it.
+VAULT_ADDR = os.environ.get('VAULT_ADDR', 'http://127.0.0.1:8200')
+VAULT_CONNECTIONS = 8
+
+# Path within Vault where the password manager data is kept (VPWMGR in config.js)
+VPWMGR_PATH = '/v1/secret/vpwmgr/'
+
+# Group of archived entries, with a sub-group per period (HISTGROUP in vaultdata.js)
+ARCHIVE_GROUP = 'Archive/'
+
+# Number of Vault list requests run at once for one /pwmgr/tree request
+TREE_WORKERS = 8
+
+# Pooled mode: worker threads per process, which is also the number of connections
+# open at once, since a connection keeps its thread while open. An idle keep-alive
+# connection is closed after KEEPALIVE_TIMEOUT seconds without a request, so a browser
+# (up to 6 connections) only holds threads while it is loading. Once a request has
+# started, reading and writing may take up to REQUEST_TIMEOUT seconds per operation.
+POOL_THREADS = 64
+KEEPALIVE_TIMEOUT = 2
+REQUEST_TIMEOUT = 30
+
+# Linux value, the Python 2 socket module does not define it
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+# Upper bounds in seconds of the request latency histogram buckets on /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Methods and Vault mounts counted by name on /metrics, others are counted as
+# "other" so that clients cannot add label values. Add the KV version 2 mount
+# (KV_MOUNT in config.js) if it is not secret.
+METRICS_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'LIST')
+METRICS_MOUNTS = ('auth', 'sys', 'secret')
+
 
 debugFlag = True
 def setDebug(flag):
     global debugFlag
     debugFlag= flag
 
+# When set, log lines are handed to a writer thread instead of written directly
+logQueue = None
+
+def startLogWriter():
+    """ Write log output from a background thread so request threads do not wait
+    on stderr. """
+    global logQueue
+    logQueue = Queue.Queue()
+    def writer():
+        while True:
+            sys.stderr.write(logQueue.get())
+    thread = threading.Thread(target=writer)
+    thread.daemon = True
+    thread.start()
+
 def debug(*args):
     if debugFlag:
-        sys.stderr.write(' '.join(map(str,args))+'\n')
+        log(*args)
 
 def log(*args):
-    sys.stderr.write(' '.join(map(str,args))+'\n')
+    line = ' '.join(map(str,args))+'\n'
+    if logQueue is not None:
+        logQueue.put(line)
+    else:
+        sys.stderr.write(line)
+
+
+# Files are sent in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+# Content types for files without a useful extension
+CONTENT_TYPES = {
+    'vue': 'application/javascript',
+}
+
+# Content types worth compressing
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+# Files smaller than this are sent as is
+MIN_COMPRESS_SIZE = 1024
+
+# Files named after a hash of their content (e.g. app.2401d3935eaa.js from build.js)
+# never change, browsers may keep them for a year without asking again. Everything
+# else is revalidated on each use.
+HASHED_FILE = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Preferred order of content encodings and the suffix of pre-built files for each.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Headers that apply to a single connection and are not passed through the proxy.
+# Date and Server are set by this server.
+HOP_HEADERS = frozenset(('connection', 'keep-alive', 'proxy-authenticate',
+                         'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
+                         'upgrade', 'host', 'content-length', 'date', 'server'))
+
+# Compressed file contents built on first request, keyed by (path, encoding), with
+# the mtime of the file they were built from. An edited file replaces its entry.
+compressed = {}
+compressedLock = threading.Lock()
+
+
+def content_type(path):
+    """ Return the MIME type for a file path. """
+    name = os.path.basename(path)
+    if name in CONTENT_TYPES:
+        return CONTENT_TYPES[name]
+    ctype, encoding = mimetypes.guess_type(name)
+    return ctype or 'application/octet-stream'
+
+def accepted_encodings(header):
+    """ Return the set of content codings accepted in an Accept-Encoding header. """
+    accepted = set()
+    for item in (header or '').split(','):
+        parts = [p.strip() for p in item.split(';')]
+        if not parts[0]:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(parts[0].lower())
+    return accepted
+
+def compress(data, encoding):
+    """ Return data compressed with the given content coding. """
+    if encoding == 'br':
+        return brotli.compress(data)
+    buf = StringIO()
+    zfile = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+    zfile.write(data)
+    zfile.close()
+    return buf.getvalue()
+
+def compressed_variant(path, stat, ctype, accept):
+    """ Pick the encoding to send for a file. Returns (encoding, path, data) where
+    only one of path (a pre-built file such as pwmgr.js.gz) or data (built here and
+    kept in memory) is set. Returns None if the file should be sent as is. """
+    if not ctype.startswith(COMPRESSIBLE) or stat.st_size < MIN_COMPRESS_SIZE:
+        return None
+    for encoding, suffix in ENCODINGS:
+        if encoding not in accept:
+            continue
+        prebuilt = path + suffix
+        try:
+            if os.stat(prebuilt).st_mtime >= stat.st_mtime:
+                return encoding, prebuilt, None
+        except OSError:
+            pass
+        if encoding == 'br' and brotli is None:
+            continue
+        key = (path, encoding)
+        with compressedLock:
+            mtime, data = compressed.get(key, (None, None))
+        if mtime != stat.st_mtime:
+            with open(path, 'rb') as f:
+                data = compress(f.read(), encoding)
+            debug('compressed', path, encoding, stat.st_size, '->', len(data))
+            with compressedLock:
+                compressed[key] = (stat.st_mtime, data)
+        return encoding, None, data
+    return None
+
+def etag(stat, encoding=None):
+    """ Return an entity tag for a file version and encoding. """
+    tag = '%x-%x' % (int(stat.st_mtime), stat.st_size)
+    if encoding:
+        tag += '-' + encoding
+    return '"%s"' % tag
+
+def not_modified(headers, tag, mtime):
+    """ True if the request's conditional headers match the current file version. """
+    inm = headers.getheader('If-None-Match')
+    if inm is not None:
+        tags = [t.strip() for t in inm.split(',')]
+        return '*' in tags or tag in tags or ('W/' + tag) in tags
+    ims = headers.getheader('If-Modified-Since')
+    if ims is not None:
+        parsed = email.utils.parsedate_tz(ims)
+        if parsed is not None:
+            return int(mtime) <= email.utils.mktime_tz(parsed)
+    return False
+
+
+
+class Metrics(object):
+    """ Request counters by method, path and status, and latency histograms by
+    method and path, shown in the Prometheus text format on /metrics. Each server
+    process keeps its own. """
+
+    def __init__(s, buckets=LATENCY_BUCKETS):
+        s.buckets = buckets
+        s.lock = threading.Lock()
+        s.counts = {}       # (method, path, status) -> requests
+        s.latency = {}      # (method, path) -> [count per bucket..., sum, count]
+
+    def record(s, method, path, status, seconds):
+        with s.lock:
+            key = (method, path, status)
+            s.counts[key] = s.counts.get(key, 0) + 1
+            hist = s.latency.get((method, path))
+            if hist is None:
+                hist = s.latency[(method, path)] = [0] * len(s.buckets) + [0.0, 0]
+            for i, bound in enumerate(s.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    def render(s):
+        """ Return the metrics as text/plain; version=0.0.4 """
+        with s.lock:
+            counts = sorted(s.counts.items())
+            latency = sorted((k, list(v)) for k, v in s.latency.items())
+        lines = ['# HELP pwmgr_http_requests_total Requests answered by method, path and status.',
+                 '# TYPE pwmgr_http_requests_total counter']
+        for (method, path, status), count in counts:
+            lines.append('pwmgr_http_requests_total{method="%s",path="%s",status="%s"} %d'
+                         % (label_value(method), label_value(path), status, count))
+        lines += ['# HELP pwmgr_http_request_duration_seconds Request latency by method and path.',
+                  '# TYPE pwmgr_http_request_duration_seconds histogram']
+        for (method, path), hist in latency:
+            labels = 'method="%s",path="%s"' % (label_value(method), label_value(path))
+            for bound, count in zip(s.buckets, hist):
+                lines.append('pwmgr_http_request_duration_seconds_bucket{%s,le="%g"} %d'
+                             % (labels, bound, count))
+            lines.append('pwmgr_http_request_duration_seconds_bucket{%s,le="+Inf"} %d'
+                         % (labels, hist[-1]))
+            lines.append('pwmgr_http_request_duration_seconds_sum{%s} %.6f' % (labels, hist[-2]))
+            lines.append('pwmgr_http_request_duration_seconds_count{%s} %d' % (labels, hist[-1]))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def label_value(value):
+    """ Escape a label value for the Prometheus text format """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def metrics_path(method, path):
+    """ Return the (method, path) labels a request is counted under. Vault API paths
+    are cut to their first three segments (e.g. /v1/secret/vpwmgr) and Vault lists
+    are counted as LIST, so the number of label values stays small. Paths on other
+    mounts than METRICS_MOUNTS are counted as /v1/other, methods other than
+    METRICS_METHODS as other. All files are counted as /static. """
+    if method not in METRICS_METHODS:
+        method = 'other'
+    ppath = urlparse.urlparse(path)
+    if ppath.path.startswith('/v1/'):
+        if 'list=true' in ppath.query.split('&'):
+            method = 'LIST'
+        segments = ppath.path.split('/')
+        if segments[2] not in METRICS_MOUNTS:
+            return method, '/v1/other'
+        return method, '/'.join(segments[:4])
+    if ppath.path in ('/pwmgr/tree', '/metrics'):
+        return method, ppath.path
+    return method, '/static'
+
+
+def vault_list(pool, token, path):
+    """ List the keys under a Vault path with the caller's token.
+    Returns (status, keys). keys is empty unless the status is 200. """
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    status, reason, headers, data = pool.request(
+        'GET', urllib.quote(path) + '?list=true', None, {'X-Vault-Token': token})
+    if status != 200:
+        return status, []
+    return status, json.loads(data)['data']['keys']
+
+def accessible_teams(pool, token, teams):
+    """ Return the team names that the token can list, asking Vault for all of
+    them in one sys/capabilities-self request. All names are returned if Vault
+    cannot answer that. """
+    if not teams:
+        return teams
+    paths = [VPWMGR_PATH[len('/v1/'):] + 'team/' + t for t in teams]
+    body = json.dumps({'paths': paths})
+    status, reason, headers, data = pool.request(
+        'POST', '/v1/sys/capabilities-self', body,
+        {'X-Vault-Token': token, 'Content-Type': 'application/json'})
+    if status != 200:
+        return teams
+    answers = json.loads(data)
+    answers = answers.get('data') or answers
+    if not all(p in answers for p in paths):
+        return teams
+    return [t for t, p in zip(teams, paths)
+            if 'list' in answers[p] or 'root' in answers[p]]
+
+def build_tree(pool, token, vaultid):
+    """ Return the navigation tree for a user as built by getCollections() in
+    pwmgr.js: a list of {name, entries} collections each holding a list of
+    {name, entries} groups with their entry titles. The lists for all collections
+    and then for all groups are requested in parallel. Collections the token
+    cannot list are left out. Other failures are reported in an 'error' field
+    of the collection. Only teams the token can list are fetched. Archive periods
+    are listed as groups of their own with 'entries' set to None, the client loads
+    them when they are opened. """
+    status, teams = vault_list(pool, token, VPWMGR_PATH + 'team/')
+    teams = accessible_teams(pool, token, sorted(teams))
+    names = ['user/%s/' % vaultid] + ['team/' + t for t in teams]
+    listed = vaultpool.parallel(
+        lambda name: vault_list(pool, token, VPWMGR_PATH + name), names, TREE_WORKERS)
+
+    collections = []
+    groups = []
+    for name, (status, keys) in zip(names, listed):
+        if status in (403, 404):
+            continue
+        collection = {'name': name, 'entries': []}
+        if status != 200:
+            collection['error'] = 'Vault error %d' % status
+        collections.append(collection)
+        for key in keys:
+            group = {'name': key, 'entries': []}
+            collection['entries'].append(group)
+            groups.append((collection, group))
 
+    listed = vaultpool.parallel(
+        lambda (collection, group): vault_list(pool, token,
+                                               VPWMGR_PATH + collection['name'] + group['name']),
+        groups, TREE_WORKERS)
+    for (collection, group), (status, keys) in zip(groups, listed):
+        if status == 200:
+            group['entries'] = keys
+        elif status != 404:
+            collection['error'] = 'Vault error %d' % status
+    for collection in collections:
+        expand_archive(collection)
+    return collections
+
+def expand_archive(collection):
+    """ Replace the archive group of a tree collection by one group per archive
+    period, as expandArchive() in vaultdata.js does. The archive group itself is kept
+    if it holds entries from before the archive was split up. """
+    groups = collection['entries']
+    names = [group['name'] for group in groups]
+    if ARCHIVE_GROUP not in names:
+        return
+    i = names.index(ARCHIVE_GROUP)
+    archive = groups[i]
+    periods = [{'name': ARCHIVE_GROUP + key, 'entries': None}
+               for key in archive['entries'] if key.endswith('/')]
+    archive['entries'] = [key for key in archive['entries'] if not key.endswith('/')]
+    groups[i:i+1] = ([archive] if archive['entries'] else []) + periods
 
 
 class MyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Connection pool for the Vault proxy, set up at startup
+    vault = None
+    # Headers and body are written separately. With Nagle's algorithm the later
+    # writes wait for the client's delayed ACK, about 40ms on kept-alive connections.
+    disable_nagle_algorithm = True
+
+    def handle_one_request(s):
+        """ Handle a request and record its status and latency in the metrics. The
+        time runs from the parsed request line to the end of the response. """
+        s.started = None
+        s.status = None
+        s.command = s.path = None
+        BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(s)
+        # Requests without a valid request line are answered but not counted
+        if s.started is not None and s.status is not None and s.command and s.path:
+            method, path = metrics_path(s.command, s.path)
+            metrics.record(method, path, s.status, time.time() - s.started)
+
+    def parse_request(s):
+        s.started = time.time()
+        return BaseHTTPServer.BaseHTTPRequestHandler.parse_request(s)
+
+    def send_response(s, code, message=None):
+        s.status = code
+        BaseHTTPServer.BaseHTTPRequestHandler.send_response(s, code, message)
+
     def do_HEAD(s):
-        s.send_response(200)
-        s.send_header("Content-type", "text/html")
-        s.end_headers()
+        """Respond to a HEAD request."""
+        debug('got HEAD')
+        if s.is_vault_path():
+            s.proxy()
+            return
+        s.send_file(urlparse.urlparse(s.path).path, False)
 
 
     def do_GET(s):
         """Respond to a GET request."""
         debug('got GET')
+        if s.is_vault_path():
+            s.proxy()
+            return
         ppath = urlparse.urlparse(s.path)
         params = urlparse.parse_qs(ppath.query)
         debug('GET request ppath:', ppath,' params:', params)
+        if ppath.path == '/pwmgr/tree':
+            s.send_tree(params)
+            return
+        if ppath.path == '/metrics':
+            s.send_metrics()
+            return
+        s.send_file(ppath.path, True)
+
+    def send_metrics(s):
+        """ Answer /metrics with the request counters and latency histograms of
+        this server process. """
+        data = metrics.render()
         s.send_response(200)
-        s.send_header('Content-type', 'text/html')
-        s.send_header('Access-Control-Allow-Origin', '*')
+        s.send_header('Content-type', 'text/plain; version=0.0.4')
+        s.send_header('Cache-Control', 'no-store')
+        s.send_header('Content-Length', str(len(data)))
         s.end_headers()
-        
+        s.wfile.write(data)
 
-        if ppath.path == '/':
-            s.wfile.write(open('index.html','r').read())
+    def send_tree(s, params):
+        """ Answer /pwmgr/tree?vaultid=<vaultid> with the caller's whole navigation
+        tree in one response. The caller's X-Vault-Token is used for the Vault
+        requests, so Vault policies apply as usual. """
+        token = s.headers.getheader('X-Vault-Token')
+        vaultid = params.get('vaultid', [''])[0]
+        if s.vault is None:
+            s.send_error(404)
+            return
+        if not token or not vaultid:
+            s.send_error(400, 'Missing token or vaultid')
+            return
+        try:
+            tree = build_tree(s.vault, token, vaultid)
+        except (httplib.HTTPException, socket.error) as e:
+            log('Vault request failed:', s.path, e)
+            s.send_error(502, 'Vault not reachable')
+            return
+        data = json.dumps({'collections': tree})
+        s.send_response(200)
+        s.send_header('Content-type', 'application/json')
+        s.send_header('Cache-Control', 'no-store')
+        s.send_header('Content-Length', str(len(data)))
+        s.end_headers()
+        s.wfile.write(data)
+
+    def is_vault_path(s):
+        """ True for requests that belong to the Vault API """
+        return s.vault is not None and s.path.startswith('/v1/')
+
+    def proxy(s):
+        """ Pass the request on to Vault over a pooled connection and relay the
+        response status, headers and body as they are. """
+        debug('proxy', s.command, s.path)
+        length = int(s.headers.getheader('Content-Length') or 0)
+        body = s.rfile.read(length) if length else None
+        headers = {}
+        for name in s.headers.keys():
+            if name not in HOP_HEADERS:
+                headers[name] = s.headers.getheader(name)
+        try:
+            status, reason, rheaders, data = s.vault.request(s.command, s.path, body, headers)
+        except (httplib.HTTPException, socket.error) as e:
+            log('Vault request failed:', s.command, s.path, e)
+            s.send_error(502, 'Vault not reachable')
+            return
+        s.send_response(status, reason)
+        for name, value in rheaders:
+            if name not in HOP_HEADERS:
+                s.send_header(name, value)
+        s.send_header('Content-Length', str(len(data)))
+        s.end_headers()
+        if s.command != 'HEAD':
+            s.wfile.write(data)
+
+    def send_file(s, urlpath, withBody):
+        """ Send a static file relative to the current directory. Conditional
+        requests are answered with 304 and compressed versions are sent to clients
+        that accept them. """
+        if urlpath == '/':
+            urlpath = '/index.html'
+        path = os.path.normpath(urlpath[1:])
+        if path.startswith('..') or os.path.isabs(path) or not os.path.isfile(path):
+            s.send_error(404)
+            return
+        stat = os.stat(path)
+        ctype = content_type(path)
+        variant = compressed_variant(path, stat, ctype,
+                                     accepted_encodings(s.headers.getheader('Accept-Encoding')))
+        encoding = variant[0] if variant else None
+        tag = etag(stat, encoding)
+
+        if not_modified(s.headers, tag, stat.st_mtime):
+            s.send_response(304)
+            s.send_header('ETag', tag)
+            s.send_header('Vary', 'Accept-Encoding')
+            s.end_headers()
+            return
+
+        s.send_response(200)
+        s.send_header('Content-type', ctype)
+        s.send_header('Access-Control-Allow-Origin', '*')
+        s.send_header('ETag', tag)
+        s.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        s.send_header('Cache-Control', IMMUTABLE if HASHED_FILE.search(path) else 'no-cache')
+        s.send_header('Vary', 'Accept-Encoding')
+        if variant:
+            encoding, vpath, data = variant
+            s.send_header('Content-Encoding', encoding)
+            if data is None:
+                s.send_header('Content-Length', str(os.stat(vpath).st_size))
+            else:
+                s.send_header('Content-Length', str(len(data)))
         else:
-            s.wfile.write(open(ppath.path[1:],'r').read())
+            vpath, data = path, None
+            s.send_header('Content-Length', str(stat.st_size))
+        s.end_headers()
+        if not withBody:
+            return
+
+        if data is not None:
+            s.wfile.write(data)
+            return
+        with open(vpath, 'rb') as f:
+            shutil.copyfileobj(f, s.wfile, CHUNK_SIZE)
 
         
     def do_POST(s):
         """Respond to a POST request."""
         debug('got POST')
+        if s.is_vault_path():
+            s.proxy()
+            return
+        length = int(s.headers.getheader('Content-Length') or 0)
+        if length:
+            s.rfile.read(length)
         s.send_response(200)
         s.send_header("Content-type", "text/html")
+        s.send_header('Content-Length', '0')
         s.end_headers()
         return 'content'
 
+    def do_PUT(s):
+        """ PUT, DELETE and LIST are only used by the Vault API """
+        if s.is_vault_path():
+            s.proxy()
+            return
+        s.send_error(501)
+
+    do_DELETE = do_PUT
+    do_LIST = do_PUT
+
+    def log_message(s, format, *args):
+        """ Access log lines are debug output """
+        debug(s.address_string(), '-', format % args)
+
+class KeepAliveHandler(MyHandler):
+    """ HTTP/1.1 handler. Connections stay open for further (or pipelined)
+    requests, which are answered in order. Every response carries a
+    Content-Length or closes the connection. """
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+
+    def handle_one_request(s):
+        # Waiting for the next request, give the thread up soon
+        s.connection.settimeout(KEEPALIVE_TIMEOUT)
+        MyHandler.handle_one_request(s)
+
+    def parse_request(s):
+        # The request line is in, allow for slow clients from here on
+        s.connection.settimeout(REQUEST_TIMEOUT)
+        return MyHandler.parse_request(s)
+
 class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
     """ Handle requests in a seperate thread. """
 
+class PooledHTTPServer(BaseHTTPServer.HTTPServer):
+    """ Serve connections from a fixed pool of worker threads rather than a new
+    thread per connection. At most 'threads' connections are open at once, idle ones
+    are closed after KEEPALIVE_TIMEOUT. Further connections wait in a short queue and
+    then in the listen backlog. With reuse_port several processes can listen on the
+    same port. """
+    allow_reuse_address = True
+    request_queue_size = 128
 
-if __name__ == '__main__':
-    setDebug(True)
-    httpd = ThreadedHTTPServer((HOST_NAME, PORT_NUMBER), MyHandler)
-    print time.asctime(), "Server Starts - %s:%s" % (HOST_NAME, PORT_NUMBER)
+    def __init__(s, address, handler, threads=POOL_THREADS, reuse_port=False):
+        s.reuse_port = reuse_port
+        BaseHTTPServer.HTTPServer.__init__(s, address, handler)
+        s.connections = Queue.Queue(threads)
+        for i in range(threads):
+            thread = threading.Thread(target=s.worker)
+            thread.daemon = True
+            thread.start()
+
+    def server_bind(s):
+        if s.reuse_port:
+            s.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        BaseHTTPServer.HTTPServer.server_bind(s)
+
+    def process_request(s, request, client_address):
+        # Blocks the accept loop while all workers are busy
+        s.connections.put((request, client_address))
+
+    def worker(s):
+        while True:
+            request, client_address = s.connections.get()
+            try:
+                s.finish_request(request, client_address)
+            except Exception:
+                s.handle_error(request, client_address)
+            finally:
+                s.shutdown_request(request)
+
+
+def serve(args):
+    """ Run one server process until interrupted. """
+    MyHandler.vault = vaultpool.ConnectionPool(VAULT_ADDR, VAULT_CONNECTIONS)
+    if args.mode == 'pooled':
+        startLogWriter()
+        httpd = PooledHTTPServer((args.host, args.port), KeepAliveHandler,
+                                 args.threads, args.workers > 1)
+    else:
+        httpd = ThreadedHTTPServer((args.host, args.port), MyHandler)
+    print time.asctime(), "Server Starts - %s:%s (pid %d)" % (args.host, args.port, os.getpid())
     try:
         httpd.serve_forever()
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, SystemExit):
         pass
     httpd.server_close()
-    print time.asctime(), "Server Stops - %s:%s" % (HOST_NAME, PORT_NUMBER)
+    print time.asctime(), "Server Stops - %s:%s" % (args.host, args.port)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Development web server for vault-pwmgr. '
+                                     'Serves the current directory and proxies /v1/ to Vault.')
+    parser.add_argument('--host', default=HOST_NAME)
+    parser.add_argument('--port', type=int, default=PORT_NUMBER)
+    parser.add_argument('--mode', choices=('threaded', 'pooled'), default='threaded',
+                        help='threaded: HTTP/1.0 with a thread per connection. '
+                        'pooled: HTTP/1.1 keep-alive served by a fixed pool of threads.')
+    parser.add_argument('--threads', type=int, default=POOL_THREADS,
+                        help='Connections open at once per process (pooled mode). '
+                        'Idle ones are closed after %d seconds.' % KEEPALIVE_TIMEOUT)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Server processes sharing the port with SO_REUSEPORT (pooled mode)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='No debug or request logging')
+    args = parser.parse_args(argv)
+
+    setDebug(not args.quiet)
+    if args.mode != 'pooled':
+        args.workers = 1
+
+    # Stop with cleanup on SIGTERM (e.g. from stopdev.sh) as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    children = []
+    for i in range(args.workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            serve(args)
+            os._exit(0)
+        children.append(pid)
+    try:
+        serve(args)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,366 @@
+#!/usr/bin/python
+
+# Load generator for sizing Vault and the front-end server.
+#
+#   loadgen.py --fake --users 20 --duration 60 > run.json
+#   loadgen.py --setup --users 200 --groups 10 --entries 20 --teams 5
+#   loadgen.py --users 200 --think 2 --url http://127.0.0.1:7080 --tree > run.json
+#
+# Each virtual user replays the requests pwmgr.js makes in a session: the
+# passwordAuthenticate() login, the getCollections() crawl of the navigation tree
+# (team list, sys/capabilities-self, then every collection and group listed with
+# at most MAXREQUESTS in flight, or one pwmgr/tree request with --tree), then a
+# mix of getDetails() reads and saveEntry() updates with random think time in
+# between. An update reads the new path first for a rename, writes the archive copy
+# and the entry in parallel and, for a rename, then deletes the old path. Users only update entries of their own
+# collection, team entries are read. Sessions are repeated until --duration is up.
+#
+# The report on stdout is JSON with the throughput and the p50, p95, p99 and max
+# latency in milliseconds of each operation, named as by requestOp() in
+# vaultdata.js, so runs can be compared. KV version 1 only.
+#
+# --setup (or --fake) first creates the users load<N> with password load<N>pw, a
+# policy for each and their data: --groups groups of --entries entries per user and
+# the same per team, with every user in all --teams teams. It needs a root token
+# (VAULT_TOKEN or --token). --fake runs the in-memory Vault stand-in of
+# tests/fakevault.py in this process, with --latency and --jitter. As it shares
+# the interpreter with the virtual users it is for trying out the tool; start
+# tests/fakevault.py separately for measurements.
+#
+# Requests go to Vault directly unless --url names the front-end server (e.g.
+# httpd.py, which proxies /v1/ to Vault). --setup always writes to Vault.
+
+import argparse
+import httplib
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import urllib
+
+import pwdata
+import vaultpool
+
+# Requests a browser sends at once (MAXREQUESTS in config.js)
+MAXREQUESTS = 6
+
+# Archive group and title format of archiveName() in pwmgr.js
+ARCHIVE_TITLE = '%s|%s|%s'
+
+# Policy of a load test user, as tests/data/user1.hcl
+POLICY = '''path "secret/vpwmgr/user/%(user)s/*" {
+  capabilities = ["create", "read", "update", "delete", "list"]
+}
+%(teams)s
+path "secret/vpwmgr/team/" {
+  capabilities = ["list"]
+}
+'''
+TEAM_POLICY = '''path "secret/vpwmgr/team/%s/*" {
+  capabilities = ["create", "read", "update", "delete", "list"]
+}
+'''
+
+
+def user_name(n):
+    return 'load%d' % n
+
+def team_name(n):
+    return 'loadteam%d' % n
+
+def entry_data(user, group, title):
+    """ Entry fields as written by writeEntry() in pwmgr.js """
+    now = pwdata.current_time()
+    return {'url': 'https://%s.example.com/' % title, 'userid': user,
+            'password': 'pw-%s-%s' % (group, title), 'notes': 'Load test entry',
+            'changed': now, 'pwChanged': now}
+
+def setup(client, users, teams, groups, entries, concurrency):
+    """ Create the users, their policies and the dataset. """
+    teamnames = [team_name(t) for t in range(teams)]
+    teampolicy = ''.join(TEAM_POLICY % t for t in teamnames)
+    def add_user(n):
+        user = user_name(n)
+        status, body = client.call('PUT', 'sys/policy/user-' + user,
+                                   {'policy': POLICY % {'user': user, 'teams': teampolicy}})
+        if status not in (200, 204):
+            raise pwdata.VaultError('Adding policy for %s: %d' % (user, status))
+        status, body = client.call('POST', 'auth/userpass/users/' + user,
+                                   {'password': user + 'pw', 'policies': 'user-' + user})
+        if status not in (200, 204):
+            raise pwdata.VaultError('Adding user %s: %d' % (user, status))
+    vaultpool.parallel(add_user, range(users), concurrency)
+
+    collections = ['user/' + user_name(n) for n in range(users)] + ['team/' + t for t in teamnames]
+    writes = [(pwdata.entry_path(c, 'group%d' % g, 'entry%d' % e),
+               entry_data(c.split('/')[1], 'group%d' % g, 'entry%d' % e))
+              for c in collections for g in range(groups) for e in range(entries)]
+    vaultpool.parallel(lambda (path, data): client.write(path, data), writes, concurrency)
+    print >>sys.stderr, '%d users, %d teams, %d entries' % (users, teams, len(writes))
+
+
+class Recorder(object):
+    """ Latencies and errors by operation, shared by all virtual users. """
+
+    def __init__(s):
+        s.lock = threading.Lock()
+        s.latency = {}      # operation -> [seconds, ...]
+        s.errors = {}       # operation -> count
+        s.sessions = 0
+
+    def record(s, op, seconds, ok):
+        with s.lock:
+            s.latency.setdefault(op, []).append(seconds)
+            if not ok:
+                s.errors[op] = s.errors.get(op, 0) + 1
+
+    def error(s, op):
+        with s.lock:
+            s.errors[op] = s.errors.get(op, 0) + 1
+
+    def report(s, elapsed):
+        """ Return the results as a dictionary. Latencies are in milliseconds. """
+        with s.lock:
+            ops = sorted(set(s.latency) | set(s.errors))
+            operations = {}
+            for op in ops:
+                samples = sorted(s.latency.get(op, []))
+                summary = {'count': len(samples), 'errors': s.errors.get(op, 0),
+                           'throughput': round(len(samples) / elapsed, 2)}
+                if samples:
+                    summary.update(mean=round(1000 * sum(samples) / len(samples), 1),
+                                   p50=percentile(samples, 50), p95=percentile(samples, 95),
+                                   p99=percentile(samples, 99), max=round(1000 * samples[-1], 1))
+                operations[op] = summary
+            total = sum(len(v) for v in s.latency.values())
+            return {'elapsed': round(elapsed, 2), 'sessions': s.sessions, 'requests': total,
+                    'errors': sum(s.errors.values()),
+                    'throughput': round(total / elapsed, 2), 'operations': operations}
+
+def percentile(samples, p):
+    """ Nearest-rank percentile in milliseconds of sorted samples in seconds """
+    return round(1000 * samples[max(0, -(-p * len(samples) // 100) - 1)], 1)
+
+
+class VirtualUser(object):
+    """
+    One simulated browser session after another for a user, with its own
+    connections. Requests are timed under the operation names of requestOp() in
+    vaultdata.js.
+    """
+    def __init__(s, n, args, recorder):
+        s.user = user_name(n)
+        s.args = args
+        s.recorder = recorder
+        s.pool = vaultpool.ConnectionPool(args.url, MAXREQUESTS)
+        s.random = random.Random(n)
+        s.token = None
+
+    def request(s, op, method, path, data=None, missing_ok=False):
+        """ Make a timed request for a path below /v1/ (or another path of the
+        server with a leading '/'). Returns (status, parsed body) or (0, None) when
+        the server could not be reached. A 404 counts as an error unless
+        missing_ok is set. """
+        url = path if path.startswith('/') else '/v1/' + urllib.quote(path.encode('utf-8'))
+        if method == 'LIST':
+            method, url = 'GET', url + '?list=true'
+        headers = {'Content-Type': 'application/json'}
+        if s.token:
+            headers['X-Vault-Token'] = s.token
+        start = time.time()
+        try:
+            status, reason, rheaders, body = s.pool.request(
+                method, url, json.dumps(data) if data is not None else None, headers)
+        except (httplib.HTTPException, socket.error):
+            s.recorder.error(op)
+            return 0, None
+        s.recorder.record(op, time.time() - start, status < 400 or (missing_ok and status == 404))
+        try:
+            return status, json.loads(body) if body else None
+        except ValueError:
+            return status, None
+
+    def run(s, deadline):
+        while time.time() < deadline:
+            s.session(deadline)
+            with s.recorder.lock:
+                s.recorder.sessions += 1
+
+    def think(s):
+        if s.args.think > 0:
+            time.sleep(s.random.expovariate(1.0 / s.args.think))
+
+    def session(s, deadline):
+        s.token = None
+        status, body = s.request('login', 'POST', 'auth/userpass/login/' + s.user,
+                                 {'password': s.user + 'pw'})
+        if status != 200:
+            s.think()
+            return
+        s.token = body['auth']['client_token']
+        entries = s.tree()
+        own = [i for i, e in enumerate(entries) if e[0] == 'user/%s/' % s.user]
+        for i in range(s.args.actions):
+            if time.time() >= deadline or not entries:
+                return
+            s.think()
+            if own and s.random.random() < s.args.write_ratio:
+                s.update(entries, s.random.choice(own))
+            else:
+                collection, group, title = s.random.choice(entries)
+                s.request('read entry', 'GET', pwdata.PREFIX + collection + group + title)
+
+    def tree(s):
+        """ List the navigation tree as refreshCollections() does. Returns the
+        entries as (collection, group, title) tuples, without archived ones. """
+        if s.args.tree:
+            status, body = s.request('tree', 'GET', '/pwmgr/tree?vaultid=' + s.user)
+            if status != 200:
+                return []
+            return [(c['name'], g['name'], t) for c in body['collections']
+                    for g in c['entries'] if g['entries'] and not is_archive(g['name'])
+                    for t in g['entries']]
+
+        status, body = s.request('list team', 'LIST', pwdata.PREFIX + 'team/')
+        teams = ['team/' + t for t in sorted(body['data']['keys'])] if status == 200 else []
+        if teams:
+            paths = [pwdata.PREFIX + t for t in teams]
+            status, body = s.request('capabilities', 'POST', 'sys/capabilities-self',
+                                     {'paths': paths})
+            if status == 200:
+                answers = body.get('data') or body
+                teams = [t for t, p in zip(teams, paths)
+                         if set(answers.get(p, ['list'])) & set(['list', 'root'])]
+        collections = ['user/%s/' % s.user] + teams
+
+        def list_keys(path):
+            status, body = s.request('list group', 'LIST', pwdata.PREFIX + path)
+            return body['data']['keys'] if status == 200 else []
+        listed = vaultpool.parallel(list_keys, collections, MAXREQUESTS)
+        groups = [(c, g) for c, keys in zip(collections, listed) for g in keys if g.endswith('/')]
+        listed = vaultpool.parallel(lambda (c, g): list_keys(c + g), groups, MAXREQUESTS)
+        return [(c, g, t) for (c, g), keys in zip(groups, listed) if not is_archive(g)
+                for t in keys if not t.endswith('/')]
+
+    def update(s, entries, i):
+        """ Save entries[i] changed as saveEntry() does: for a rename the read of
+        the new path, which stops the update when an entry is there, then the
+        archive copy of the old version and the new version in parallel, then the
+        delete of the old path when the entry was renamed. The entry list is
+        updated in place. """
+        collection, group, title = entries[i]
+        path = pwdata.PREFIX + collection + group + title
+        status, old = s.request('read entry', 'GET', path)
+        if status != 200:
+            return
+        timestamp = time.strftime('%Y%m%d%H%M%S', time.gmtime())
+        archive = (pwdata.PREFIX + collection + 'Archive/%s-%s/' % (timestamp[:4], timestamp[4:6]) +
+                   ARCHIVE_TITLE % (group[:-1], title, timestamp))
+        renamed = s.random.random() < s.args.rename_ratio
+        newtitle = (title[:-1] if title.endswith('~') else title + '~') if renamed else title
+        newpath = pwdata.PREFIX + collection + group + newtitle
+        if renamed:
+            status, body = s.request('read entry', 'GET', newpath, missing_ok=True)
+            if status != 404:
+                return
+        data = dict(old['data'], changed=pwdata.current_time())
+        results = vaultpool.parallel(
+            lambda (op, p, d): s.request(op, 'POST', p, d),
+            [('archive', archive, old['data']), ('write', newpath, data)],
+            2)
+        if renamed and all(r[0] in (200, 204) for r in results):
+            s.request('delete', 'DELETE', path)
+            entries[i] = (collection, group, newtitle)
+
+def is_archive(group):
+    return group == pwdata.ARCHIVE_GROUP + '/' or group.startswith(pwdata.ARCHIVE_GROUP + '/')
+
+
+def run(args, recorder):
+    """ Run the virtual users until the duration is up. Returns the elapsed time. """
+    deadline = time.time() + args.duration
+    vusers = [VirtualUser(n, args, recorder) for n in range(args.users)]
+    threads = []
+    start = time.time()
+    for vuser in vusers:
+        thread = threading.Thread(target=vuser.run, args=(deadline,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+        # Spread the logins over the first think time
+        if args.ramp:
+            time.sleep(args.ramp / float(args.users))
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Load generator replaying vault-pwmgr sessions')
+    parser.add_argument('--addr', default=os.environ.get('VAULT_ADDR', 'http://127.0.0.1:8200'))
+    parser.add_argument('--token', default=os.environ.get('VAULT_TOKEN'),
+                        help='Root token for --setup')
+    parser.add_argument('--url', help='Server the virtual users talk to (default: --addr)')
+    parser.add_argument('--fake', action='store_true',
+                        help='Run the Vault stand-in in this process, implies --setup')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every request with --fake')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random seconds added up to this with --fake')
+    parser.add_argument('--setup', action='store_true', help='Create the users and dataset')
+    parser.add_argument('--users', type=int, default=10, help='Virtual users')
+    parser.add_argument('--teams', type=int, default=2, help='Teams shared by all users')
+    parser.add_argument('--groups', type=int, default=5, help='Groups per collection')
+    parser.add_argument('--entries', type=int, default=10, help='Entries per group')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--ramp', type=float, default=0.0,
+                        help='Seconds over which the virtual users are started')
+    parser.add_argument('--think', type=float, default=1.0,
+                        help='Mean seconds between the actions of a user')
+    parser.add_argument('--actions', type=int, default=20,
+                        help='Reads and updates per session')
+    parser.add_argument('--write-ratio', type=float, default=0.1,
+                        help='Share of actions that are updates')
+    parser.add_argument('--rename-ratio', type=float, default=0.2,
+                        help='Share of updates that rename the entry')
+    parser.add_argument('--tree', action='store_true',
+                        help='Get the tree from the pwmgr/tree endpoint of --url')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Requests in flight at once during --setup')
+    args = parser.parse_args(argv)
+
+    vault = None
+    if args.fake:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests'))
+        from fakevault import FakeVault
+        vault = FakeVault(latency=args.latency, jitter=args.jitter)
+        args.addr = vault.start()
+        args.token = vault.root_token
+        args.setup = True
+    args.url = args.url or args.addr
+    try:
+        if args.setup:
+            if not args.token:
+                parser.error('A root token is needed for --setup (--token or VAULT_TOKEN)')
+            setup(pwdata.VaultClient(args.addr, args.token, args.concurrency),
+                  args.users, args.teams, args.groups, args.entries, args.concurrency)
+        recorder = Recorder()
+        elapsed = run(args, recorder)
+    except pwdata.VaultError as e:
+        print >>sys.stderr, 'Failed:', e
+        return 1
+    finally:
+        if vault is not None:
+            vault.stop()
+
+    report = recorder.report(elapsed)
+    report['config'] = dict((k, v) for k, v in vars(args).items() if k != 'token')
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    print
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,515 @@
+#!/usr/bin/python
+
+# Bulk load and export of vault-pwmgr data.
+#
+#   pwdata.py load dataset.json
+#   pwdata.py load dataset.csv --concurrency 32 --resume
+#   pwdata.py export user/user1 > user1.csv
+#   pwdata.py compact --all --keep 10 --days 365 --reshard month
+#   pwdata.py migrate --all --to-mount kv2
+#
+# The Vault address and token are taken from VAULT_ADDR and VAULT_TOKEN unless
+# given with --addr and --token. Loading users and policies needs a root token.
+#
+# CSV datasets have the columns in CSV_COLUMNS, one password entry per row.
+# The collection is "user/<vaultid>" or "team/<teamid>".
+#
+# JSON datasets may contain any of:
+#   "policies": {name: hcl_file}   policy files relative to the dataset
+#   "users":    {name: {"password": ..., "policies": [...]}}
+#   "entries":  [{"collection": ..., "group": ..., "title": ..., "url": ..., ...}]
+#   "secrets":  {"secret/vpwmgr/...": {field: value}}
+# so the tests/data/seed.json fixture can be loaded as well.
+#
+# compact prunes the archive group of collections. Archived versions of an entry
+# are kept when they are among the newest --keep versions or newer than --days.
+# --reshard moves entries archived before the archive was split into periods to
+# their period sub-group (ARCHIVE_SHARD in config.js).
+#
+# migrate copies collections to a KV version 2 mount for KV_VERSION 2 in config.js.
+# The archived copies of each entry become its older versions, oldest first, and the
+# current entry its latest version. Entries that only exist in the archive are soft
+# deleted and recorded in the DELETED_SECRET of the collection so they still show in
+# the archive group. The KV version 1 data is left as it was. A migrated entry is
+# marked with MIGRATED_MARKER in its custom metadata once all of it is written, and
+# is skipped after that; an interrupted migration can be run again and continues
+# an entry after the versions it already wrote.
+
+import argparse
+import csv
+import httplib
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+import urllib
+
+import vaultpool
+
+# Fields of a password entry as written by writeEntry() in pwmgr.js
+ENTRY_FIELDS = ('url', 'userid', 'password', 'notes', 'changed', 'pwChanged')
+
+CSV_COLUMNS = ('collection', 'group', 'title') + ENTRY_FIELDS
+
+# Where the password manager data is kept in Vault (VPWMGR in config.js)
+PREFIX = 'secret/vpwmgr/'
+
+# Number of entries read per batch when exporting
+EXPORT_BATCH = 500
+
+# Group of archived entries (HISTGROUP in vaultdata.js) and the titles given to them
+# by archiveOldEntry(): <group>|<title>|<YYYYMMDDhhmmss>
+ARCHIVE_GROUP = 'Archive'
+ARCHIVE_TITLE = re.compile(r'^(.*)\|(.*)\|(\d{14})$')
+
+# Secret of a collection on a KV version 2 mount recording its deleted entries
+# (DELETED_SECRET in vaultdata.js)
+DELETED_SECRET = '.deleted'
+
+# Custom metadata key set by migrate on entries that are completely migrated
+MIGRATED_MARKER = 'pwdata-migrated'
+
+
+class VaultError(Exception):
+    """ A Vault request failed. """
+
+
+class VaultClient(object):
+    """
+    Vault API calls over a pool of persistent connections. Connection errors,
+    429 and 5xx responses are retried with exponential backoff.
+    """
+    def __init__(s, addr, token, size=16, retries=3, backoff=0.5):
+        s.pool = vaultpool.ConnectionPool(addr, size)
+        s.token = token
+        s.retries = retries
+        s.backoff = backoff
+
+    def call(s, method, path, data=None):
+        """ Make a request for a path below /v1/. Returns (status, parsed body). """
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        url = '/v1/' + urllib.quote(path)
+        if method == 'LIST':
+            method, url = 'GET', url + '?list=true'
+        body = json.dumps(data) if data is not None else None
+        headers = {'X-Vault-Token': s.token, 'Content-Type': 'application/json'}
+        attempt = 0
+        while True:
+            try:
+                status, reason, rheaders, rbody = s.pool.request(method, url, body, headers)
+                if status != 429 and status < 500:
+                    return status, json.loads(rbody) if rbody else None
+                error = '%s %s: %d %s' % (method, path, status, reason)
+            except (httplib.HTTPException, socket.error) as e:
+                error = '%s %s: %s' % (method, path, e)
+            if attempt >= s.retries:
+                raise VaultError(error)
+            time.sleep(s.backoff * 2 ** attempt)
+            attempt += 1
+
+    def list(s, path):
+        """ Return the keys under a path ending in '/', empty if there are none. """
+        status, body = s.call('LIST', path)
+        if status == 404:
+            return []
+        if status != 200:
+            raise VaultError('LIST %s: %d' % (path, status))
+        return body['data']['keys']
+
+    def read(s, path):
+        """ Return the data of a secret or None if it does not exist. """
+        status, body = s.call('GET', path)
+        if status == 404:
+            return None
+        if status != 200:
+            raise VaultError('GET %s: %d' % (path, status))
+        return body['data']
+
+    def write(s, path, data):
+        status, body = s.call('POST', path, data)
+        if status not in (200, 204):
+            raise VaultError('POST %s: %d %s' % (path, status, body))
+
+    def delete(s, path):
+        status, body = s.call('DELETE', path)
+        if status not in (200, 204, 404):
+            raise VaultError('DELETE %s: %d' % (path, status))
+
+
+def current_time():
+    """ The current time in the timestamp format used by pwmgr.js """
+    return time.strftime('%Y-%m-%d %H:%M:%SZ', time.gmtime())
+
+def entry_path(collection, group, title):
+    """ Vault path of a password entry. """
+    return PREFIX + collection.strip('/') + '/' + group + '/' + title
+
+def entry_data(row):
+    """ Secret data for an entry in the layout written by writeEntry(). """
+    data = dict((f, row[f]) for f in ENTRY_FIELDS if row.get(f) is not None)
+    data.setdefault('changed', current_time())
+    data.setdefault('pwChanged', data['changed'])
+    return data
+
+def read_dataset(filename):
+    """ Return a list of (path, data) writes for a JSON or CSV dataset. Policies
+    and users come first. """
+    writes = []
+    if filename.endswith('.csv'):
+        with open(filename, 'rb') as f:
+            for row in csv.DictReader(f):
+                row = dict((k, v.decode('utf-8')) for k, v in row.items() if v is not None)
+                writes.append((entry_path(row['collection'], row['group'], row['title']),
+                               entry_data(row)))
+        return writes
+
+    with open(filename) as f:
+        dataset = json.load(f)
+    base = os.path.dirname(os.path.abspath(filename))
+    for name, policyfile in sorted(dataset.get('policies', {}).items()):
+        with open(os.path.join(base, policyfile)) as f:
+            writes.append(('sys/policy/' + name, {'policy': f.read()}))
+    for name, user in sorted(dataset.get('users', {}).items()):
+        writes.append(('auth/userpass/users/' + name,
+                       {'password': user['password'],
+                        'policies': ','.join(user.get('policies', []))}))
+    for row in dataset.get('entries', []):
+        writes.append((entry_path(row['collection'], row['group'], row['title']),
+                       entry_data(row)))
+    for path, data in sorted(dataset.get('secrets', {}).items()):
+        writes.append((path, data))
+    return writes
+
+
+def load(client, filename, concurrency, journal, resume):
+    """ Write a dataset to Vault in parallel. Each completed path is appended to the
+    journal file so that a failed load can be resumed without repeating work. """
+    writes = read_dataset(filename)
+    done = set()
+    if resume and os.path.exists(journal):
+        with open(journal) as f:
+            done = set(line.rstrip('\n').decode('utf-8') for line in f)
+    todo = [w for w in writes if w[0] not in done]
+    print >>sys.stderr, '%d writes, %d already done' % (len(writes), len(writes) - len(todo))
+
+    lock = threading.Lock()
+    counter = [0]
+    start = time.time()
+    with open(journal, 'a' if resume else 'w') as jfile:
+        def write(item):
+            path, data = item
+            client.write(path, data)
+            with lock:
+                jfile.write(path.encode('utf-8') + '\n')
+                counter[0] += 1
+                if counter[0] % 1000 == 0:
+                    jfile.flush()
+                    print >>sys.stderr, '%d written' % counter[0]
+        try:
+            vaultpool.parallel(write, todo, concurrency)
+        finally:
+            jfile.flush()
+    elapsed = time.time() - start
+    print >>sys.stderr, '%d written in %.1fs (%.0f/s)' % (
+        counter[0], elapsed, counter[0] / elapsed if elapsed else 0)
+
+
+def collection_paths(client, collection, concurrency):
+    """ Return the (group, title) pairs of a collection. Groups are listed in parallel. """
+    base = PREFIX + collection.strip('/') + '/'
+    groups = [g for g in client.list(base) if g.endswith('/')]
+    titles = vaultpool.parallel(lambda g: client.list(base + g), groups, concurrency)
+    return [(g[:-1], t) for g, ts in zip(groups, titles) for t in ts if not t.endswith('/')]
+
+def export(client, collection, concurrency, fmt, out):
+    """ Write all entries of a collection to out as CSV or JSON lines. Entries are
+    read in parallel a batch at a time and written in order as each batch is done.
+    Entries deleted after the collection was listed are skipped and named on
+    stderr. Returns the number of entries written. """
+    collection = collection.strip('/')
+    paths = collection_paths(client, collection, concurrency)
+    exported = 0
+    skipped = []
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(CSV_COLUMNS)
+    for i in range(0, len(paths), EXPORT_BATCH):
+        batch = paths[i:i + EXPORT_BATCH]
+        datas = vaultpool.parallel(
+            lambda (group, title): client.read(entry_path(collection, group, title)),
+            batch, concurrency)
+        for (group, title), data in zip(batch, datas):
+            if data is None:
+                skipped.append(entry_path(collection, group, title))
+                continue
+            row = dict(data, collection=collection, group=group, title=title)
+            if fmt == 'csv':
+                writer.writerow([unicode(row.get(c, '')).encode('utf-8') for c in CSV_COLUMNS])
+            else:
+                out.write(json.dumps(row, sort_keys=True) + '\n')
+            exported += 1
+        out.flush()
+    for path in skipped:
+        print >>sys.stderr, ('skipped %s: no longer exists' % path).encode('utf-8')
+    print >>sys.stderr, '%d entries exported, %d skipped' % (exported, len(skipped))
+    return exported
+
+
+def archive_group(timestamp, shard):
+    """ Archive group for an entry archived at a YYYYMMDDhhmmss timestamp, as
+    archiveGroup() in vaultdata.js """
+    if shard == 'month':
+        return '%s/%s-%s' % (ARCHIVE_GROUP, timestamp[:4], timestamp[4:6])
+    if shard == 'year':
+        return '%s/%s' % (ARCHIVE_GROUP, timestamp[:4])
+    return ARCHIVE_GROUP
+
+def archived_entries(client, collection, concurrency):
+    """ Return the (group, title) pairs of the archived entries of a collection. The
+    group is the archive group or one of its period sub-groups. """
+    base = PREFIX + collection + '/' + ARCHIVE_GROUP + '/'
+    keys = client.list(base)
+    periods = [k for k in keys if k.endswith('/')]
+    entries = [(ARCHIVE_GROUP, k) for k in keys if not k.endswith('/')]
+    listed = vaultpool.parallel(lambda p: client.list(base + p), periods, concurrency)
+    for period, titles in zip(periods, listed):
+        entries.extend((ARCHIVE_GROUP + '/' + period[:-1], t) for t in titles if not t.endswith('/'))
+    return entries
+
+def select_expired(entries, keep, days, now):
+    """ Return the archived (group, title) pairs to delete. All versions of an entry
+    are deleted except the newest 'keep' ones and those archived within 'days' of
+    'now'. Either limit may be None. Titles that are not in the archive format are
+    never deleted. """
+    cutoff = None
+    if days is not None:
+        cutoff = time.strftime('%Y%m%d%H%M%S', time.gmtime(now - days * 86400))
+    versions = {}
+    for group, title in entries:
+        m = ARCHIVE_TITLE.match(title)
+        if m:
+            versions.setdefault(m.group(1, 2), []).append((m.group(3), group, title))
+    expired = []
+    for items in versions.values():
+        items.sort(reverse=True)
+        for n, (timestamp, group, title) in enumerate(items):
+            if keep is not None and n < keep:
+                continue
+            if cutoff is not None and timestamp >= cutoff:
+                continue
+            expired.append((group, title))
+    return sorted(expired)
+
+def compact(client, collections, keep, days, reshard, concurrency, dry_run, out):
+    """ Delete expired archived entries of collections and optionally move the
+    remaining unsplit ones into their periods. With dry_run the changes are only
+    listed on out. """
+    deleted = moved = 0
+    for collection in collections:
+        collection = collection.strip('/')
+        entries = archived_entries(client, collection, concurrency)
+        expired = []
+        if keep is not None or days is not None:
+            expired = select_expired(entries, keep, days, time.time())
+        moves = []
+        if reshard:
+            gone = set(expired)
+            for group, title in entries:
+                m = ARCHIVE_TITLE.match(title)
+                if group == ARCHIVE_GROUP and m and (group, title) not in gone:
+                    moves.append((title, archive_group(m.group(3), reshard)))
+        print >>sys.stderr, '%s: %d archived, %d to delete, %d to move' % (
+            collection, len(entries), len(expired), len(moves))
+
+        if dry_run:
+            for group, title in expired:
+                out.write(('delete %s\n' % entry_path(collection, group, title)).encode('utf-8'))
+            for title, group in moves:
+                out.write(('move %s %s\n' % (entry_path(collection, ARCHIVE_GROUP, title),
+                                             entry_path(collection, group, title))).encode('utf-8'))
+            continue
+
+        vaultpool.parallel(lambda (group, title): client.delete(entry_path(collection, group, title)),
+                           expired, concurrency)
+        deleted += len(expired)
+
+        def move((title, group)):
+            # Write the new copy before the old one is removed
+            path = entry_path(collection, ARCHIVE_GROUP, title)
+            data = client.read(path)
+            if data is not None:
+                client.write(entry_path(collection, group, title), data)
+                client.delete(path)
+        vaultpool.parallel(move, moves, concurrency)
+        moved += len(moves)
+    if not dry_run:
+        print >>sys.stderr, '%d archived entries deleted, %d moved' % (deleted, moved)
+
+def kv2_path(mount, endpoint, collection, key):
+    """ Path of an entry or secret of a collection on a KV version 2 mount, as
+    kvPath() in vaultdata.js """
+    return '%s/%s/%s%s/%s' % (mount, endpoint, PREFIX[PREFIX.index('/') + 1:], collection, key)
+
+def archive_time(timestamp):
+    """ A YYYYMMDDhhmmss archive timestamp in the format of current_time() """
+    return time.strftime('%Y-%m-%d %H:%M:%SZ', time.strptime(timestamp, '%Y%m%d%H%M%S'))
+
+def entry_versions(client, collection, concurrency):
+    """ Return {"<group>/<title>": [(timestamp, group, title), ...]} of the entries of
+    a collection with their archived copies, oldest first. The current entry comes
+    last with a timestamp of None. """
+    versions = {}
+    for group, title in archived_entries(client, collection, concurrency):
+        m = ARCHIVE_TITLE.match(title)
+        if m:
+            versions.setdefault('%s/%s' % m.group(1, 2), []).append((m.group(3), group, title))
+    for items in versions.values():
+        items.sort()
+    for group, title in collection_paths(client, collection, concurrency):
+        if group != ARCHIVE_GROUP:
+            versions.setdefault(group + '/' + title, []).append((None, group, title))
+    return versions
+
+def migrate(client, collections, mount, concurrency, dry_run, out):
+    """ Copy collections to the KV version 2 mount with their archived entries as
+    version history. With dry_run the entries are only listed on out. """
+    mount = mount.strip('/')
+    migrated = 0
+    for collection in collections:
+        collection = collection.strip('/')
+        versions = entry_versions(client, collection, concurrency)
+        print >>sys.stderr, '%s: %d entries, %d versions' % (
+            collection, len(versions), sum(len(v) for v in versions.values()))
+        if dry_run:
+            for key, items in sorted(versions.items()):
+                out.write(('migrate %s %s %d versions%s\n' % (
+                    entry_path(collection, *key.split('/', 1)),
+                    kv2_path(mount, 'data', collection, key), len(items),
+                    '' if items[-1][0] is None else ' (deleted)')).encode('utf-8'))
+            continue
+
+        def copy((key, items)):
+            """ Write the versions of an entry that are not on the new mount yet.
+            Returns (custom metadata, DELETED_SECRET record or None), or None if the
+            entry is already migrated. """
+            meta = client.read(kv2_path(mount, 'metadata', collection, key))
+            custom = (meta or {}).get('custom_metadata') or {}
+            if MIGRATED_MARKER in custom:
+                return None
+            # Versions written by an interrupted migration are not written again
+            written = meta['current_version'] if meta else 0
+            path = kv2_path(mount, 'data', collection, key)
+            count = 0
+            for timestamp, group, title in items:
+                data = client.read(entry_path(collection, group, title))
+                if data is not None:
+                    count += 1
+                    if count > written:
+                        client.write(path, {'data': data})
+            custom = dict(custom, **{MIGRATED_MARKER: str(count)})
+            timestamp, group, title = items[-1]
+            if timestamp is None:
+                return custom, None
+            client.delete(path)
+            return custom, {'deleted': archive_time(timestamp), 'title': title}
+
+        def mark((key, custom)):
+            client.write(kv2_path(mount, 'metadata', collection, key), {'custom_metadata': custom})
+
+        items = sorted(versions.items())
+        results = vaultpool.parallel(copy, items, concurrency)
+        done = [(key, r) for (key, _), r in zip(items, results) if r is not None]
+        deleted = dict((key, record) for key, (_, record) in done if record is not None)
+        if deleted:
+            path = kv2_path(mount, 'data', collection, DELETED_SECRET)
+            current = client.read(path)
+            deleted = dict(current['data'] if current else {}, **deleted)
+            client.write(path, {'data': deleted})
+        # Entries are marked only once they are recorded in DELETED_SECRET
+        vaultpool.parallel(mark, [(key, custom) for key, (custom, _) in done], concurrency)
+        migrated += len(done)
+    if not dry_run:
+        print >>sys.stderr, '%d entries migrated' % migrated
+
+def all_collections(client):
+    """ Names of all user and team collections """
+    return (['user/' + k for k in client.list(PREFIX + 'user/') if k.endswith('/')] +
+            ['team/' + k for k in client.list(PREFIX + 'team/') if k.endswith('/')])
+
+
+def add_vault_args(parser):
+    """ Command line options shared by the pwdata.py commands. """
+    parser.add_argument('--addr', default=os.environ.get('VAULT_ADDR', 'http://127.0.0.1:8200'))
+    parser.add_argument('--token', default=os.environ.get('VAULT_TOKEN'))
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Requests in flight at once')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Retries for failed requests')
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Bulk load and export of vault-pwmgr data')
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('load', help='Load a JSON or CSV dataset into Vault')
+    p.add_argument('dataset')
+    p.add_argument('--journal', help='File of completed writes (default: <dataset>.done)')
+    p.add_argument('--resume', action='store_true',
+                   help='Skip the writes already recorded in the journal')
+    add_vault_args(p)
+
+    p = commands.add_parser('export', help='Export a collection as CSV or JSON lines')
+    p.add_argument('collection', help='user/<vaultid> or team/<teamid>')
+    p.add_argument('--format', choices=('csv', 'json'), default='csv')
+    add_vault_args(p)
+
+    p = commands.add_parser('compact', help='Prune and split up the archive of collections')
+    p.add_argument('collections', nargs='*', help='user/<vaultid> or team/<teamid>')
+    p.add_argument('--all', action='store_true', help='Compact all collections')
+    p.add_argument('--keep', type=int, help='Keep this many newest versions of each entry')
+    p.add_argument('--days', type=float, help='Keep versions archived within this many days')
+    p.add_argument('--reshard', choices=('month', 'year'),
+                   help='Move unsplit archived entries into period groups')
+    p.add_argument('--dry-run', action='store_true',
+                   help='Only list the entries that would be deleted or moved')
+    add_vault_args(p)
+
+    p = commands.add_parser('migrate', help='Copy collections to a KV version 2 mount')
+    p.add_argument('collections', nargs='*', help='user/<vaultid> or team/<teamid>')
+    p.add_argument('--all', action='store_true', help='Migrate all collections')
+    p.add_argument('--to-mount', default='kv2', help='Path of the KV version 2 mount')
+    p.add_argument('--dry-run', action='store_true',
+                   help='Only list the entries that would be migrated')
+    add_vault_args(p)
+
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error('A Vault token is needed (--token or VAULT_TOKEN)')
+    client = VaultClient(args.addr, args.token, args.concurrency, args.retries)
+    try:
+        if args.command == 'load':
+            load(client, args.dataset, args.concurrency,
+                 args.journal or args.dataset + '.done', args.resume)
+        elif args.command == 'export':
+            export(client, args.collection, args.concurrency, args.format, sys.stdout)
+        elif args.command == 'compact':
+            if args.keep is None and args.days is None and not args.reshard:
+                parser.error('Nothing to do, give --keep, --days or --reshard')
+            collections = all_collections(client) if args.all else args.collections
+            compact(client, collections, args.keep, args.days, args.reshard,
+                    args.concurrency, args.dry_run, sys.stdout)
+        elif args.command == 'migrate':
+            collections = all_collections(client) if args.all else args.collections
+            migrate(client, collections, args.to_mount, args.concurrency, args.dry_run,
+                    sys.stdout)
+    except VaultError as e:
+        print >>sys.stderr, 'Failed:', e
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -12,13 +12,23 @@ function abort {
     exit 1
 }
 
-# Check for expected files
-which vault >/dev/null 2>&1 || abort "Vault executable not found. Please install vault in your path"
-
 [[ -x httpd.py ]] || abort "The test HTTP server appears to be missing. Are you in the top level directory?"
 
 mkdir -p logs
 
+# With --fake use the in-memory Vault stand-in instead of a Vault server. It starts
+# right away and is seeded with the same test data from tests/data/seed.json.
+if [[ "$1" == "--fake" ]]; then
+    tests/fakevault.py >logs/vault.log 2>&1 &
+    cd www; ../httpd.py >../logs/httpd.log 2>&1 &
+    cd -
+    echo "Server output is in logs. The Vault stand-in root token is 'root'."
+    exit 0
+fi
+
+# Check for expected files
+which vault >/dev/null 2>&1 || abort "Vault executable not found. Please install vault in your path (or use --fake)"
+
 vault server -dev >logs/vault.log 2>&1 &
 
 cd www; ../httpd.py >../logs/httpd.log 2>&1 &
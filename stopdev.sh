@@ -1,4 +1,5 @@
 #!/bin/bash
 
 killall vault
+killall fakevault.py
 killall httpd.py
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+
+# Startup benchmark of the web page by dataset size.
+#
+#   tests/bench_startup.py --save bench.json
+#   tests/bench_startup.py --sizes 100,1000 --repeat 5 --baseline bench.json
+#
+# For each dataset size the Vault stand-in is seeded with a user "bench" holding
+# that many entries across its own collection and --teams team collections of
+# --groups groups each, plus one large group with a fifth of the entries. A headless
+# Firefox then runs these steps against httpd.py, each timed in the page from the
+# action until renderSettled() (see pwmgr.js) and counted in HTTP requests from the
+# /metrics endpoint of httpd.py:
+#
+#   load      loading the login page (Navigation Timing load event)
+#   login     submitting the login form until the navigation tree is listed
+#   expand    opening the large group
+#   display   selecting the first entry of the large group (displayEntry)
+#   save      renaming that entry, which patches the tree
+#
+# Times are the median of --repeat runs in milliseconds. The results are printed as
+# JSON and saved with --save. With --baseline a step that is slower than the baseline
+# by more than --threshold (and by at least MIN_SLOWDOWN ms), or that makes more
+# requests, is reported as a regression and the exit status is 1.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib2
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS, '..'))
+
+import conftest
+import loadgen
+import pwdata
+import testutils
+from fakevault import FakeVault
+
+SIZES = (100, 1000, 10000, 50000)
+STEPS = ('load', 'login', 'expand', 'display', 'save')
+
+USER = 'bench'
+LARGE_GROUP = 'large'
+
+# Slowdowns smaller than this many milliseconds are noise, not regressions
+MIN_SLOWDOWN = 20
+
+# Clicks an element and answers with the milliseconds until the page has settled
+TIMED_CLICK_SCRIPT = testutils.SETTLE_JS + """
+var element = arguments[0], done = arguments[arguments.length - 1];
+var start = performance.now();
+element.click();
+whenSettled(function () { done(performance.now() - start) });
+"""
+
+
+def seed(vault, size, teams, groups):
+    """ Replace the data of the stand-in with a dataset of size entries. """
+    teamnames = ['benchteam%d' % t for t in range(teams)]
+    vault.add_policy('user-' + USER, loadgen.POLICY % {
+        'user': USER, 'teams': ''.join(loadgen.TEAM_POLICY % t for t in teamnames)})
+    vault.add_user(USER, USER + 'pw', ['user-' + USER])
+
+    collections = ['user/' + USER] + ['team/' + t for t in teamnames]
+    large = size // 5
+    spread = [(collections[i % len(collections)], 'group%d' % (i // len(collections) % groups))
+              for i in range(size - large)]
+    secrets = {}
+    for i in range(large):
+        title = 'entry%05d' % i
+        secrets[pwdata.entry_path('user/' + USER, LARGE_GROUP, title)] = \
+            loadgen.entry_data(USER, LARGE_GROUP, title)
+    for i, (collection, group) in enumerate(spread):
+        title = 'entry%05d' % i
+        secrets[pwdata.entry_path(collection, group, title)] = loadgen.entry_data(USER, group, title)
+    with vault.lock:
+        vault.secrets = secrets
+        vault.versioned = {}
+
+def request_counts(url):
+    """ Total requests answered by httpd.py, from its /metrics """
+    total = 0
+    for line in urllib2.urlopen(url + 'metrics').read().splitlines():
+        if line.startswith('pwmgr_http_requests_total{') and 'path="/metrics"' not in line:
+            total += int(line.rsplit(' ', 1)[1])
+    return total
+
+def run_steps(driver, url):
+    """ Run the steps once. Returns {step: (milliseconds, requests)}. """
+    results = {}
+    before = request_counts(url)
+
+    driver.get(url)
+    testutils.wait_settled(driver)
+    ms = driver.execute_script(
+        "return performance.timing.loadEventEnd - performance.timing.navigationStart")
+    after = request_counts(url)
+    results['load'] = (ms, after - before)
+
+    def timed(step, element):
+        before = request_counts(url)
+        ms = driver.execute_async_script(TIMED_CLICK_SCRIPT, element)
+        results[step] = (ms, request_counts(url) - before)
+
+    driver.find_element_by_id("loginid").clear()
+    driver.find_element_by_id("loginid").send_keys(USER)
+    driver.find_element_by_id("loginpw").clear()
+    driver.find_element_by_id("loginpw").send_keys(USER + 'pw')
+    timed('login', driver.find_element_by_css_selector("button[type=submit]"))
+
+    nav = testutils.NavigationHelper(driver)
+    nav.click([USER])
+    timed('expand', driver.execute_script(testutils.FIND_SCRIPT, USER, LARGE_GROUP + '/'))
+    timed('display', driver.execute_script(testutils.FIND_SCRIPT, USER, LARGE_GROUP + '/', 'entry00000'))
+
+    driver.find_element_by_id("title").send_keys('x')
+    timed('save', driver.find_element_by_id("b-update"))
+    driver.find_element_by_id("b-logout").click()
+    return results
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def compare(results, baseline, threshold):
+    """ Return a list of regression messages. """
+    regressions = []
+    for size, steps in sorted(results['sizes'].items(), key=lambda item: int(item[0])):
+        base = baseline.get('sizes', {}).get(size)
+        if base is None:
+            continue
+        for step in STEPS:
+            new, old = steps.get(step), base.get(step)
+            if not new or not old:
+                continue
+            if new['ms'] > old['ms'] * threshold and new['ms'] - old['ms'] >= MIN_SLOWDOWN:
+                regressions.append('%s entries, %s: %.0fms, was %.0fms'
+                                   % (size, step, new['ms'], old['ms']))
+            if new['requests'] > old['requests']:
+                regressions.append('%s entries, %s: %d requests, was %d'
+                                   % (size, step, new['requests'], old['requests']))
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=TESTS).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Startup benchmark of vault-pwmgr by dataset size')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='Comma separated numbers of entries')
+    parser.add_argument('--teams', type=int, default=4, help='Team collections')
+    parser.add_argument('--groups', type=int, default=20, help='Groups per collection')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per size, the median is kept')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Slowdown factor reported as a regression')
+    args = parser.parse_args(argv)
+
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options
+
+    vault = FakeVault()
+    vault.url = vault.start()
+    port = conftest.free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(TESTS, '..', 'httpd.py'), '--port', str(port), '--quiet',
+         '--mode', 'pooled'],
+        cwd=os.path.join(TESTS, '..', 'www'), env=dict(os.environ, VAULT_ADDR=vault.url))
+    url = 'http://127.0.0.1:%d/' % port
+    options = Options()
+    options.headless = True
+    driver = None
+    results = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(),
+               'teams': args.teams, 'groups': args.groups, 'sizes': {}}
+    try:
+        conftest.wait_for(url)
+        driver = webdriver.Firefox(options=options)
+        driver.set_script_timeout(300)
+        for size in [int(n) for n in args.sizes.split(',')]:
+            runs = []
+            for i in range(args.repeat):
+                # The save step renames an entry, so every run starts from new data
+                seed(vault, size, args.teams, args.groups)
+                runs.append(run_steps(driver, url))
+            results['sizes'][str(size)] = dict(
+                (step, {'ms': round(median([r[step][0] for r in runs]), 1),
+                        'requests': median([r[step][1] for r in runs])})
+                for step in STEPS)
+            steps = results['sizes'][str(size)]
+            print >>sys.stderr, size, ' '.join('%s=%.0fms/%d' % (step, steps[step]['ms'],
+                                                                  steps[step]['requests'])
+                                               for step in STEPS)
+    finally:
+        if driver is not None:
+            driver.quit()
+        server.terminate()
+        server.wait()
+        vault.stop()
+
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for message in regressions:
+            print >>sys.stderr, 'Regression:', message
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+# Shared fixtures for the functional tests.
+#
+# Every test process runs its own copy of the application: the in-memory Vault
+# stand-in seeded from tests/data/seed.json and httpd.py serving www/ in front of
+# it, both on free ports. Test processes so never share users, teams or data, and
+# the suite can be spread over CPU cores with pytest-xdist ('pytest -n auto').
+# Set PWMGR_URL to test a server that is already running instead (e.g. one started
+# by startdev.sh). Its data is shared and not reset, so run the tests one at a time.
+#
+# One browser is started per process and reused by all tests. The tests reset the
+# page by logging out and in again, which is cheaper than loading the page.
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib2
+
+import pytest
+
+from fakevault import FakeVault
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+SEED = os.path.join(TESTS, 'data', 'seed.json')
+
+# Seconds to wait for the web server to answer after starting it
+STARTUP_TIMEOUT = 10
+
+
+def free_port():
+    """ Return a TCP port that is free at the moment. """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def wait_for(url, timeout=STARTUP_TIMEOUT):
+    """ Wait until a web server answers on url. """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            urllib2.urlopen(url).read()
+            return
+        except (urllib2.URLError, socket.error):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+@pytest.fixture(scope="session")
+def pwmgr_vault():
+    """ The Vault stand-in of this test process, or None with PWMGR_URL. """
+    if os.environ.get('PWMGR_URL'):
+        yield None
+        return
+    vault = FakeVault.from_seed(SEED)
+    vault.save()
+    vault.url = vault.start()
+    yield vault
+    vault.stop()
+
+@pytest.fixture(scope="session")
+def pwmgr_url(pwmgr_vault):
+    """ Base URL of the application under test. """
+    if pwmgr_vault is None:
+        yield os.environ['PWMGR_URL']
+        return
+    port = free_port()
+    env = dict(os.environ, VAULT_ADDR=pwmgr_vault.url)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(TESTS, '..', 'httpd.py'), '--port', str(port), '--quiet'],
+        cwd=os.path.join(TESTS, '..', 'www'), env=env)
+    url = 'http://127.0.0.1:%d/' % port
+    try:
+        wait_for(url)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+@pytest.fixture(scope="session")
+def browser():
+    """ The browser of this test process, shared by all tests. """
+    from selenium import webdriver
+    driver = webdriver.Firefox()
+    yield driver
+    driver.quit()
+
+@pytest.fixture
+def vault_data(pwmgr_vault):
+    """ Start the test with the seeded Vault data. """
+    if pwmgr_vault is not None:
+        pwmgr_vault.restore()
+    return pwmgr_vault
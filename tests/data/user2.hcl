@@ -7,3 +7,12 @@ path "secret/vpwmgr/team/linuxadmin/*" {
 path "secret/vpwmgr/team/" {
   capabilities = ["list"]
 }
+path "kv2/+/vpwmgr/user/user2/*" {
+  capabilities = ["create", "read", "update", "delete", "list"]
+}
+path "kv2/+/vpwmgr/team/linuxadmin/*" {
+  capabilities = ["create", "read", "update", "delete", "list"]
+}
+path "kv2/metadata/vpwmgr/team/" {
+  capabilities = ["list"]
+}
@@ -7,3 +7,12 @@ path "secret/vpwmgr/team/winadmin/*" {
 path "secret/vpwmgr/team/" {
   capabilities = ["list"]
 }
+path "kv2/+/vpwmgr/user/user3/*" {
+  capabilities = ["create", "read", "update", "delete", "list"]
+}
+path "kv2/+/vpwmgr/team/winadmin/*" {
+  capabilities = ["create", "read", "update", "delete", "list"]
+}
+path "kv2/metadata/vpwmgr/team/" {
+  capabilities = ["list"]
+}
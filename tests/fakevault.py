@@ -0,0 +1,484 @@
+#!/usr/bin/python
+
+# In-memory stand-in for the parts of the Vault HTTP API that vault-pwmgr uses.
+#
+# Supports userpass login, KV v1 secret read / write / delete / list, a KV v2
+# mount (kv2/ by default) with versions, soft delete, undelete, destroy and
+# custom metadata, and path prefix policies in the format of tests/data/*.hcl. With the root token users
+# and policies can be added through auth/userpass/users/ and sys/policy/.
+# sys/capabilities-self answers for a list of paths in one request. Data is seeded from a JSON
+# fixture such as tests/data/seed.json. Every request can be delayed by a fixed
+# latency plus random jitter to reproduce slow networks.
+#
+# In process:
+#     vault = FakeVault.from_seed('tests/data/seed.json', latency=0.05)
+#     url = vault.start()
+#     ...
+#     vault.stop()
+#
+# As a subprocess (e.g. in place of 'vault server -dev'):
+#     tests/fakevault.py --port 8200 --seed tests/data/seed.json --latency 0.05
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib
+import urlparse
+import uuid
+
+# Matches one rule of a policy file: path "<path>" { capabilities = [...] }
+POLICY_RULE = re.compile(r'path\s+"([^"]*)"\s*{\s*capabilities\s*=\s*\[([^\]]*)\]\s*}')
+
+
+def parse_policy(text):
+    """ Return a list of (path, capabilities) rules from HCL policy text. """
+    rules = []
+    for path, caps in POLICY_RULE.findall(text):
+        rules.append((path, frozenset(re.findall(r'"([^"]*)"', caps))))
+    return rules
+
+def rule_matches(rule, path):
+    """ True if a policy path matches a path. A '+' matches one path segment and a
+    trailing '*' matches any suffix. """
+    pattern = re.escape(rule[:-1] if rule.endswith('*') else rule).replace(r'\+', '[^/]*')
+    return re.match(pattern + ('' if rule.endswith('*') else '$'), path) is not None
+
+def rule_capabilities(rules, path):
+    """ Return the capabilities the policy rules grant on a path. As in Vault an
+    exact rule wins over glob rules and the longest matching glob wins over shorter
+    ones. """
+    best = None
+    for rule, caps in rules:
+        if rule == path:
+            return caps
+        if (rule.endswith('*') or '+' in rule) and rule_matches(rule, path):
+            if best is None or len(rule) > len(best[0]):
+                best = (rule, caps)
+    return best[1] if best is not None else frozenset()
+
+
+class FakeVault(object):
+    """
+    The Vault state (users, policies, tokens and secrets) plus an HTTP server
+    serving it. Secrets are kept in a dictionary keyed by path without the
+    /v1/ prefix, e.g. 'secret/vpwmgr/user/user1/web/google'.
+    """
+    def __init__(s, latency=0.0, jitter=0.0, root_token='root', kv2_mounts=('kv2',)):
+        s.latency = latency
+        s.jitter = jitter
+        s.root_token = root_token
+        s.policies = {}
+        s.users = {}
+        s.tokens = {root_token: ('root', ['root'])}
+        s.secrets = {}
+        # KV v2 secrets keyed by path without the endpoint, e.g. 'kv2/vpwmgr/user/user1/web/google'
+        s.kv2_mounts = kv2_mounts
+        s.versioned = {}
+        s.saved = ({}, {})
+        s.lock = threading.Lock()
+        s.httpd = None
+
+    @classmethod
+    def from_seed(cls, seedfile, **kwargs):
+        """ Create a stand-in loaded from a JSON fixture file. Policy file names in
+        the fixture are relative to the fixture's directory. """
+        vault = cls(**kwargs)
+        vault.load_seed(seedfile)
+        return vault
+
+    def load_seed(s, seedfile):
+        """ Load policies, users and secrets from a JSON fixture of the form
+        {"policies": {name: hcl_file}, "users": {name: {"password": ..., "policies": [...]}},
+         "secrets": {path: {field: value}}}
+        """
+        with open(seedfile) as f:
+            seed = json.load(f)
+        base = os.path.dirname(os.path.abspath(seedfile))
+        for name, filename in seed.get('policies', {}).items():
+            with open(os.path.join(base, filename)) as f:
+                s.add_policy(name, f.read())
+        for name, user in seed.get('users', {}).items():
+            s.add_user(name, user['password'], user.get('policies', []))
+        for path, data in seed.get('secrets', {}).items():
+            s.secrets[path] = data
+
+    def add_policy(s, name, text):
+        s.policies[name] = parse_policy(text)
+
+    def add_user(s, name, password, policies):
+        s.users[name] = (password, ['default'] + list(policies))
+
+    def login(s, name, password):
+        """ Return a new token for a userpass login or None. """
+        user = s.users.get(name)
+        if user is None or user[0] != password:
+            return None
+        token = str(uuid.uuid4())
+        with s.lock:
+            s.tokens[token] = (name, user[1])
+        return token
+
+    def capabilities(s, token, path):
+        """ Return the sorted capabilities of a token on a path, as reported by
+        sys/capabilities-self. """
+        entry = s.tokens.get(token)
+        if entry is None:
+            return ['deny']
+        if 'root' in entry[1]:
+            return ['root']
+        caps = set()
+        for name in entry[1]:
+            caps |= rule_capabilities(s.policies.get(name, []), path)
+        return sorted(caps) or ['deny']
+
+    def can(s, token, path, capability):
+        """ True if a token has a capability on a path. """
+        caps = s.capabilities(token, path)
+        return 'root' in caps or capability in caps
+
+    def list(s, path, store=None):
+        """ Return the sorted child keys of a path ending in '/'. Sub-paths end in '/'.
+        store is the KV v1 secrets unless given. """
+        keys = set()
+        with s.lock:
+            for key in (s.secrets if store is None else store):
+                if key.startswith(path) and len(key) > len(path):
+                    rest = key[len(path):]
+                    i = rest.find('/')
+                    keys.add(rest if i < 0 else rest[:i+1])
+        return sorted(keys)
+
+    def write_version(s, path, data, cas=None):
+        """ Add a version to a KV v2 secret. Returns the new version number or None
+        if cas is given and is not the current version. """
+        with s.lock:
+            meta = s.versioned.setdefault(path, {'current_version': 0, 'versions': {},
+                                                 'custom_metadata': {}, 'created_time': now()})
+            if cas is not None and cas != meta['current_version']:
+                return None
+            version = meta['current_version'] + 1
+            meta['versions'][version] = {'data': data, 'created_time': now(),
+                                         'deletion_time': '', 'destroyed': False}
+            meta['current_version'] = version
+            return version
+
+    def read_version(s, path, version=None):
+        """ Return (version, version info) of a KV v2 secret, the current version
+        unless given, or None. """
+        with s.lock:
+            meta = s.versioned.get(path)
+            if meta is None:
+                return None
+            version = version or meta['current_version']
+            info = meta['versions'].get(version)
+            return (version, info) if info is not None else None
+
+    def mark_versions(s, path, versions, field, value):
+        """ Set the deletion_time or destroyed field of versions of a KV v2 secret. """
+        with s.lock:
+            meta = s.versioned.get(path)
+            for version in versions if meta else []:
+                info = meta['versions'].get(version)
+                if info is not None:
+                    info[field] = value
+                    if field == 'destroyed' and value:
+                        info['data'] = None
+
+    def save(s):
+        """ Remember the current secrets for restore(). """
+        with s.lock:
+            s.saved = copy.deepcopy((s.secrets, s.versioned))
+
+    def restore(s):
+        """ Go back to the secrets kept by save(). Users, policies and tokens are
+        left as they are, so logged in clients stay logged in. """
+        with s.lock:
+            s.secrets, s.versioned = copy.deepcopy(s.saved)
+
+    def start(s, host='127.0.0.1', port=0):
+        """ Serve the API from a background thread. Returns the base URL. """
+        class Handler(FakeVaultHandler):
+            vault = s
+        s.httpd = ThreadedHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=s.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://%s:%d' % s.httpd.server_address[:2]
+
+    def stop(s):
+        if s.httpd is not None:
+            s.httpd.shutdown()
+            s.httpd.server_close()
+            s.httpd = None
+
+
+def now():
+    """ The current time in the format Vault uses in KV v2 metadata """
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime())
+
+def version_metadata(version, info):
+    return {'version': version, 'created_time': info['created_time'],
+            'deletion_time': info['deletion_time'], 'destroyed': info['destroyed']}
+
+
+class FakeVaultHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Request handler. The vault attribute is set to the FakeVault to serve. """
+    protocol_version = 'HTTP/1.1'
+    vault = None
+    # The status line, headers and body are separate writes. With Nagle's algorithm
+    # each waits for the client's delayed ACK of the previous one on a kept-alive
+    # connection, adding about 40ms to every response.
+    disable_nagle_algorithm = True
+
+    def log_message(s, format, *args):
+        pass
+
+    def send_json(s, status, obj=None):
+        data = json.dumps(obj) if obj is not None else ''
+        s.send_response(status)
+        s.send_header('Content-Type', 'application/json')
+        s.send_header('Access-Control-Allow-Origin', '*')
+        s.send_header('Content-Length', str(len(data)))
+        s.end_headers()
+        s.wfile.write(data)
+
+    def read_json(s):
+        length = int(s.headers.getheader('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(s.rfile.read(length))
+
+    def handle_api(s):
+        vault = s.vault
+        delay = vault.latency + random.uniform(0, vault.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        ppath = urlparse.urlparse(s.path)
+        params = urlparse.parse_qs(ppath.query)
+        method = s.command
+        body = s.read_json() if method in ('POST', 'PUT') else {}
+        if not ppath.path.startswith('/v1/'):
+            return s.send_json(404, {'errors': []})
+        path = urllib.unquote(ppath.path[4:]).decode('utf-8')
+
+        if path.startswith('auth/userpass/login/') and method in ('POST', 'PUT'):
+            name = path[len('auth/userpass/login/'):]
+            token = vault.login(name, body.get('password'))
+            if token is None:
+                return s.send_json(400, {'errors': ['invalid username or password']})
+            return s.send_json(200, {
+                'request_id': str(uuid.uuid4()), 'lease_id': '', 'renewable': False,
+                'lease_duration': 0, 'data': None, 'wrap_info': None, 'warnings': None,
+                'auth': {'client_token': token, 'accessor': str(uuid.uuid4()),
+                         'policies': vault.users[name][1], 'metadata': {'username': name},
+                         'lease_duration': 2764800, 'renewable': True}})
+
+        token = s.headers.getheader('X-Vault-Token')
+        if token not in vault.tokens:
+            return s.send_json(403, {'errors': ['permission denied']})
+
+        if path == 'sys/capabilities-self' and method in ('POST', 'PUT'):
+            paths = body.get('paths') or [body.get('path', '')]
+            result = dict((p, vault.capabilities(token, p)) for p in paths)
+            response = dict(result, capabilities=result[paths[0]], data=result)
+            return s.send_json(200, response)
+        if path.startswith('sys/policy/') and method in ('POST', 'PUT'):
+            if not vault.can(token, path, 'update'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            vault.add_policy(path[len('sys/policy/'):], body.get('policy', ''))
+            return s.send_json(204)
+        if path.startswith('auth/userpass/users/') and method in ('POST', 'PUT'):
+            if not vault.can(token, path, 'update'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            policies = [p for p in body.get('policies', '').split(',') if p]
+            vault.add_user(path[len('auth/userpass/users/'):], body['password'], policies)
+            return s.send_json(204)
+
+        if path.split('/')[0] in vault.kv2_mounts:
+            return s.handle_kv2(token, method, path, params, body)
+        if not path.startswith('secret/'):
+            return s.send_json(404, {'errors': []})
+
+        if method == 'LIST' or (method == 'GET' and params.get('list') == ['true']):
+            if not path.endswith('/'):
+                path += '/'
+            if not vault.can(token, path, 'list'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            keys = vault.list(path)
+            if not keys:
+                return s.send_json(404, {'errors': []})
+            return s.send_json(200, {'request_id': str(uuid.uuid4()), 'lease_id': '',
+                                     'renewable': False, 'lease_duration': 0,
+                                     'data': {'keys': keys}, 'wrap_info': None,
+                                     'warnings': None, 'auth': None})
+        if method == 'GET':
+            if not vault.can(token, path, 'read'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            with vault.lock:
+                data = vault.secrets.get(path)
+            if data is None:
+                return s.send_json(404, {'errors': []})
+            return s.send_json(200, {'request_id': str(uuid.uuid4()), 'lease_id': '',
+                                     'renewable': False, 'lease_duration': 2764800,
+                                     'data': data, 'wrap_info': None, 'warnings': None,
+                                     'auth': None})
+        if method in ('POST', 'PUT'):
+            with vault.lock:
+                exists = path in vault.secrets
+            if not vault.can(token, path, 'update' if exists else 'create'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            with vault.lock:
+                vault.secrets[path] = body
+            return s.send_json(204)
+        if method == 'DELETE':
+            if not vault.can(token, path, 'delete'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            with vault.lock:
+                vault.secrets.pop(path, None)
+            return s.send_json(204)
+        return s.send_json(405, {'errors': []})
+
+    def handle_kv2(s, token, method, path, params, body):
+        """ KV v2 endpoints: <mount>/(data|metadata|delete|undelete|destroy)/<path> """
+        vault = s.vault
+        parts = path.split('/', 2)
+        if len(parts) < 3:
+            return s.send_json(404, {'errors': []})
+        mount, endpoint, sub = parts
+        key = mount + '/' + sub
+        denied = lambda capability: not vault.can(token, path, capability)
+
+        if endpoint == 'metadata' and (method == 'LIST' or
+                                       (method == 'GET' and params.get('list') == ['true'])):
+            prefix = key if key.endswith('/') else key + '/'
+            if denied('list'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            keys = vault.list(prefix, vault.versioned)
+            if not keys:
+                return s.send_json(404, {'errors': []})
+            return s.send_json(200, {'data': {'keys': keys}})
+
+        if endpoint == 'data' and method == 'GET':
+            if denied('read'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            found = vault.read_version(key, int(params.get('version', ['0'])[0]))
+            if found is None:
+                return s.send_json(404, {'errors': []})
+            version, info = found
+            metadata = version_metadata(version, info)
+            if info['deletion_time'] or info['destroyed']:
+                return s.send_json(404, {'data': {'data': None, 'metadata': metadata}})
+            return s.send_json(200, {'data': {'data': info['data'], 'metadata': metadata}})
+        if endpoint == 'data' and method in ('POST', 'PUT'):
+            if denied('update' if key in vault.versioned else 'create'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            version = vault.write_version(key, body.get('data', {}),
+                                          body.get('options', {}).get('cas'))
+            if version is None:
+                return s.send_json(400, {'errors': [
+                    'check-and-set parameter did not match the current version']})
+            return s.send_json(200, {'data': version_metadata(version, vault.read_version(key, version)[1])})
+        if endpoint == 'data' and method == 'DELETE':
+            if denied('delete'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            found = vault.read_version(key)
+            if found is not None:
+                vault.mark_versions(key, [found[0]], 'deletion_time', now())
+            return s.send_json(204)
+
+        if endpoint in ('delete', 'undelete', 'destroy') and method in ('POST', 'PUT'):
+            if denied('update'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            field, value = {'delete': ('deletion_time', now()), 'undelete': ('deletion_time', ''),
+                            'destroy': ('destroyed', True)}[endpoint]
+            vault.mark_versions(key, body.get('versions', []), field, value)
+            return s.send_json(204)
+
+        if endpoint == 'metadata' and method == 'GET':
+            if denied('read'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            with vault.lock:
+                meta = vault.versioned.get(key)
+                if meta is None:
+                    return s.send_json(404, {'errors': []})
+                versions = dict((str(n), dict((k, v) for k, v in info.items() if k != 'data'))
+                                for n, info in meta['versions'].items())
+                data = {'current_version': meta['current_version'],
+                        'created_time': meta['created_time'],
+                        'custom_metadata': meta['custom_metadata'] or None,
+                        'versions': versions}
+            return s.send_json(200, {'data': data})
+        if endpoint == 'metadata' and method in ('POST', 'PUT'):
+            if denied('update' if key in vault.versioned else 'create'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            with vault.lock:
+                meta = vault.versioned.setdefault(key, {'current_version': 0, 'versions': {},
+                                                        'custom_metadata': {}, 'created_time': now()})
+                if 'custom_metadata' in body:
+                    meta['custom_metadata'] = body['custom_metadata'] or {}
+            return s.send_json(204)
+        if endpoint == 'metadata' and method == 'DELETE':
+            if denied('delete'):
+                return s.send_json(403, {'errors': ['permission denied']})
+            with vault.lock:
+                vault.versioned.pop(key, None)
+            return s.send_json(204)
+        return s.send_json(405, {'errors': []})
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_LIST = handle_api
+
+    def do_OPTIONS(s):
+        """ CORS preflight, for pages that talk to this server directly """
+        s.send_response(204)
+        s.send_header('Access-Control-Allow-Origin', '*')
+        s.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, LIST')
+        s.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Vault-Token')
+        s.send_header('Content-Length', '0')
+        s.end_headers()
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Handle requests in a seperate thread. """
+    daemon_threads = True
+    allow_reuse_address = True
+    # Many clients connect at once in load tests, the default backlog of 5 makes
+    # the rest retry after a second
+    request_queue_size = 128
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='In-memory Vault stand-in for vault-pwmgr tests')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8200)
+    parser.add_argument('--seed', default=os.path.join(os.path.dirname(__file__), 'data', 'seed.json'),
+                        help='JSON fixture with policies, users and secrets')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Up to this many random seconds added to every request')
+    parser.add_argument('--root-token', default='root')
+    args = parser.parse_args(argv)
+
+    vault = FakeVault.from_seed(args.seed, latency=args.latency, jitter=args.jitter,
+                                root_token=args.root_token)
+    url = vault.start(args.host, args.port)
+    print time.asctime(), "Fake Vault Starts - %s" % url
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    vault.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+# Tests for the in-memory Vault stand-in. These run without a browser or Vault.
+
+import json
+import os
+import time
+import urllib2
+
+import pytest
+
+from fakevault import FakeVault
+
+SEED = os.path.join(os.path.dirname(__file__), 'data', 'seed.json')
+
+
+@pytest.fixture
+def vault():
+    vault = FakeVault.from_seed(SEED)
+    vault.url = vault.start()
+    yield vault
+    vault.stop()
+
+def request(vault, method, path, token=None, data=None):
+    """ Make an API request. Returns (status, parsed JSON body or None). """
+    req = urllib2.Request(vault.url + path, json.dumps(data) if data is not None else None)
+    req.get_method = lambda: method
+    if token:
+        req.add_header('X-Vault-Token', token)
+    try:
+        resp = urllib2.urlopen(req)
+    except urllib2.HTTPError as e:
+        resp = e
+    body = resp.read()
+    return resp.getcode(), json.loads(body) if body else None
+
+def login(vault, userid):
+    status, body = request(vault, 'POST', '/v1/auth/userpass/login/' + userid,
+                           data={'password': userid + 'pw'})
+    assert status == 200
+    return body['auth']['client_token']
+
+
+def test_login(vault):
+    assert login(vault, 'user1')
+    status, body = request(vault, 'POST', '/v1/auth/userpass/login/user1',
+                           data={'password': 'iMaCl0wn'})
+    assert status == 400
+    assert 'auth' not in body
+
+def test_list_and_read(vault):
+    token = login(vault, 'user1')
+    status, body = request(vault, 'GET', '/v1/secret/vpwmgr/team/?list=true', token)
+    assert status == 200
+    assert body['data']['keys'] == ['linuxadmin/', 'winadmin/']
+    status, body = request(vault, 'GET', '/v1/secret/vpwmgr/user/user1/?list=true', token)
+    assert body['data']['keys'] == ['Pauls Stuff/', 'network/', 'web/']
+    status, body = request(vault, 'GET', '/v1/secret/vpwmgr/user/user1/web/google', token)
+    assert status == 200
+    assert body['data']['userid'] == 'user'
+
+def test_policies(vault):
+    token = login(vault, 'user1')
+    status, body = request(vault, 'GET', '/v1/secret/vpwmgr/team/winadmin/?list=true', token)
+    assert status == 403
+    status, body = request(vault, 'GET', '/v1/secret/vpwmgr/user/user2/welcome/welcome', token)
+    assert status == 403
+    status, body = request(vault, 'GET', '/v1/secret/vpwmgr/user/user1/web/google', 'bogus')
+    assert status == 403
+
+def test_capabilities(vault):
+    token = login(vault, 'user1')
+    status, body = request(vault, 'POST', '/v1/sys/capabilities-self', token, {'paths': [
+        'secret/vpwmgr/team/linuxadmin/', 'secret/vpwmgr/team/winadmin/']})
+    assert status == 200
+    assert 'list' in body['secret/vpwmgr/team/linuxadmin/']
+    assert body['secret/vpwmgr/team/winadmin/'] == ['deny']
+
+def test_write_delete(vault):
+    token = login(vault, 'user1')
+    path = '/v1/secret/vpwmgr/user/user1/new%20group/title'
+    status, body = request(vault, 'POST', path, token, {'userid': 'bob'})
+    assert status == 204
+    assert vault.secrets['secret/vpwmgr/user/user1/new group/title'] == {'userid': 'bob'}
+    status, body = request(vault, 'DELETE', path, token)
+    assert status == 204
+    status, body = request(vault, 'GET', '/v1/secret/vpwmgr/user/user1/new%20group/?list=true', token)
+    assert status == 404
+
+def test_save_restore(vault):
+    token = login(vault, 'user1')
+    vault.save()
+    path = '/v1/secret/vpwmgr/user/user1/web/google'
+    request(vault, 'POST', path, token, {'userid': 'changed'})
+    request(vault, 'DELETE', '/v1/secret/vpwmgr/user/user1/web/netflix', token)
+    vault.restore()
+    status, body = request(vault, 'GET', path, token)
+    assert status == 200, 'tokens are kept'
+    assert body['data']['userid'] == 'user'
+    assert 'secret/vpwmgr/user/user1/web/netflix' in vault.secrets
+
+def test_latency():
+    vault = FakeVault.from_seed(SEED, latency=0.2)
+    vault.url = vault.start()
+    try:
+        start = time.time()
+        login(vault, 'user1')
+        assert time.time() - start >= 0.2
+    finally:
+        vault.stop()
+
+def test_kv2_versions(vault):
+    token = login(vault, 'user1')
+    data = '/v1/kv2/data/vpwmgr/user/user1/web/title'
+    metadata = '/v1/kv2/metadata/vpwmgr/user/user1/web/title'
+    status, body = request(vault, 'POST', data, token, {'data': {'userid': 'bob'}})
+    assert status == 200 and body['data']['version'] == 1
+    status, body = request(vault, 'POST', data, token, {'data': {'userid': 'ann'}, 'options': {'cas': 0}})
+    assert status == 400
+    status, body = request(vault, 'POST', data, token, {'data': {'userid': 'ann'}, 'options': {'cas': 1}})
+    assert body['data']['version'] == 2
+    status, body = request(vault, 'GET', data + '?version=1', token)
+    assert body['data']['data'] == {'userid': 'bob'}
+
+    status, body = request(vault, 'DELETE', data, token)
+    assert status == 204
+    status, body = request(vault, 'GET', data, token)
+    assert status == 404 and body['data']['metadata']['deletion_time']
+    status, body = request(vault, 'GET', '/v1/kv2/metadata/vpwmgr/user/user1/web/?list=true', token)
+    assert body['data']['keys'] == ['title'], 'soft deleted keys are still listed'
+    status, body = request(vault, 'POST', '/v1/kv2/undelete/vpwmgr/user/user1/web/title', token, {'versions': [2]})
+    status, body = request(vault, 'GET', data, token)
+    assert body['data']['data'] == {'userid': 'ann'}
+
+    status, body = request(vault, 'POST', metadata, token, {'custom_metadata': {'previous': 'web/old'}})
+    status, body = request(vault, 'GET', metadata, token)
+    assert body['data']['current_version'] == 2
+    assert body['data']['custom_metadata'] == {'previous': 'web/old'}
+    assert sorted(body['data']['versions']) == ['1', '2']
+
+    status, body = request(vault, 'GET', '/v1/kv2/data/vpwmgr/user/user2/web/title', token)
+    assert status == 403
+    status, body = request(vault, 'DELETE', metadata, token)
+    assert status == 204 and not vault.versioned
@@ -0,0 +1,36 @@
+#!/usr/bin/python
+
+# Tests for the load generator. These run against the in-memory Vault stand-in,
+# without a browser or Vault.
+
+import json
+import os
+import sys
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import loadgen
+
+
+def test_percentile():
+    samples = [i / 1000.0 for i in range(1, 101)]
+    assert loadgen.percentile(samples, 50) == 50
+    assert loadgen.percentile(samples, 99) == 99
+    assert loadgen.percentile([0.005], 95) == 5
+
+def test_run(monkeypatch):
+    out = StringIO()
+    monkeypatch.setattr(sys, 'stdout', out)
+    assert loadgen.main(['--fake', '--users', '3', '--duration', '1', '--think', '0.01',
+                         '--groups', '2', '--entries', '3', '--write-ratio', '0.5',
+                         '--rename-ratio', '0.5']) == 0
+    report = json.loads(out.getvalue())
+    assert report['errors'] == 0
+    assert report['sessions'] >= 3
+    ops = report['operations']
+    for op in ('login', 'list team', 'capabilities', 'list group', 'read entry',
+               'archive', 'write'):
+        assert ops[op]['count'] > 0, op
+        assert ops[op]['p50'] <= ops[op]['p99'] <= ops[op]['max']
+    # Every session lists the user's collection, its groups and the two teams'
+    assert ops['list group']['count'] >= report['sessions'] * 2
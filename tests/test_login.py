@@ -3,48 +3,25 @@
 # Functional tests for the initial password login page.
 
 # Currently targeting Firefox
-# Depends on the vault configuration provided by the startdev.sh script. 
-# TODO: configure vault data from pretest fixture.
+# The browser and the server under test are set up by conftest.py.
 
 import pytest
-import time
 
-from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-# Test vault-pwmgr server to point to for tests
-PWMGR_URL = "http://127.0.0.1:7080/"
-
+import testutils
 
 # Log in with the supplied credentials
-def login(driver, userid, userpw):
-    loginid = driver.find_element_by_id("loginid")
-    loginid.clear()
-    loginid.send_keys(userid)
-
-    loginpw = driver.find_element_by_id("loginpw")
-    loginpw.clear()
-    loginpw.send_keys(userpw)
-
-    loginpw.submit()
-    
-
-@pytest.fixture(scope="module")
-def webdriver_object():
-    # Create a new instance of the browser driver
-    driver = webdriver.Firefox()
-    yield driver
-    driver.quit()
+login = testutils.login
 
 @pytest.fixture
-def driver(webdriver_object):
-    # Browse to the login page URL to start fresh
-    webdriver_object.get(PWMGR_URL)
-    WebDriverWait(webdriver_object, 10).until(EC.title_contains("Vault Password Manager"))
-    return webdriver_object
+def driver(browser, pwmgr_url):
+    # Start from a fresh login page
+    testutils.login_page(browser, pwmgr_url)
+    return browser
 
 def test_expected_fields(driver):
     # Verify that expected fields are shown
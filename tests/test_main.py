@@ -3,16 +3,13 @@
 # Functional tests for the main password manager page
 
 # Currently targeting Firefox
-# Depends on the vault configuration provided by the startdev.sh script.
-# Depends on pytest-sourceorder to force test case execution order.
-# TODO: configure vault data from pretest fixture.
+# Each test starts logged in as user1 with the data of tests/data/seed.json, see
+# conftest.py. Tests do not depend on each other and may run in any order or in
+# parallel (pytest -n).
 
 import datetime
 import pytest
-import time
 
-from pytest_sourceorder import ordered
-from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.select import Select
@@ -20,50 +17,53 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 import testutils
-
-# Test vault-pwmgr server to point to for tests
-PWMGR_URL = "http://127.0.0.1:7080/"
+from fakevault import parse_policy
 
 HISTGROUP = testutils.HISTGROUP
 
-# Used to store state information for multi-step tests. Generally tests should
-# be independent, but some cases may depend on results returned earlier by the
-# program under test. This can be used judiciously instead of than duplicating
-# test code or having very long test cases that test multiple items.
-state = {}
-
-def _login_pw(driver, userid, userpw):
-    """ Helper routine to log in by password with the supplied credentials. """
-    loginid = driver.find_element_by_id("loginid")
-    loginid.clear()
-    loginid.send_keys(userid)
-
-    loginpw = driver.find_element_by_id("loginpw")
-    loginpw.clear()
-    loginpw.send_keys(userpw)
-
-    loginpw.submit()
-    
-
-@pytest.fixture(scope="module")
-def webdriver_module():
-    # Create a new instance of the browser driver at the module level
-    driver = webdriver.Firefox()
-    yield driver
-    driver.quit()
+# Entry added by the add and delete tests
+FACEPALM = {
+    "collectionid":"user1",
+    "groupid":"web",
+    "title":"Facepalm",
+    "url":"https://facepalm.com",
+    "userid":"bob",
+    "password":"bobknows",
+    "notes":"Forget privacy!",
+}
 
 @pytest.fixture
-def driver(webdriver_module):
-    # Set up the initial webdirver state for functions in this module.
+def driver(browser, pwmgr_url, vault_data):
+    # Set up the initial webdriver state for functions in this module.
     # These functions test post login functionality, so start with a
     # fresh login page and enter test user credentials.
-    webdriver_module.get(PWMGR_URL)
-    WebDriverWait(webdriver_module, 10).until(EC.title_contains("Vault Password Manager"))
-    _login_pw(webdriver_module,'user1','user1pw')
-    WebDriverWait(webdriver_module, 10).until(EC.presence_of_element_located((By.ID,"entrydetails")))
-    WebDriverWait(webdriver_module, 10).until(EC.presence_of_element_located((By.TAG_NAME,"nav")))
-    return webdriver_module
-
+    testutils.login_page(browser, pwmgr_url)
+    testutils.login(browser,'user1','user1pw')
+    WebDriverWait(browser, 10).until(EC.presence_of_element_located((By.ID,"entrydetails")))
+    WebDriverWait(browser, 10).until(EC.presence_of_element_located((By.TAG_NAME,"nav")))
+    testutils.wait_settled(browser)
+    return browser
+
+def add_facepalm(driver):
+    """ Add the FACEPALM entry through the form. """
+    form = testutils.ItemHelper(driver)
+    form.fields = FACEPALM
+    form.add_new()
+    assert form.message == "Added new entry web/Facepalm"
+
+def delete_facepalm(driver):
+    """ Add the FACEPALM entry and delete it again. Returns the time of the delete. """
+    add_facepalm(driver)
+    nav = testutils.NavigationHelper(driver)
+    nav.click(["user1"])
+    nav.click(["user1","web/"])
+    nav.click(["user1","web/","Facepalm"])
+    testutils.ItemHelper(driver).delete()
+    delete_ts = datetime.datetime.utcnow()
+    WebDriverWait(driver, 5).until(
+        EC.text_to_be_present_in_element(
+            (By.ID,"mainmsg"),"Deleted entry web/Facepalm"))
+    return delete_ts
 
 
 def ztest_navigation_visibility(driver):
@@ -142,7 +142,85 @@ def ztest_navigation_visibility(driver):
         ('user1','web/'),
     ]
 
-@ordered
+def test_search(driver):
+    """
+    Requirement: Entries can be found by a prefix or misspelling of their title
+    or group, and selecting a result shows the entry.
+    """
+    search = driver.find_element_by_id("search")
+    search.send_keys("netflx")
+    WebDriverWait(driver, 10).until(
+        EC.text_to_be_present_in_element((By.ID, "searchresults"), "netflix"))
+
+    search.clear()
+    search.send_keys("webserv ext")
+    WebDriverWait(driver, 10).until(
+        EC.text_to_be_present_in_element((By.ID, "searchresults"), "extB"))
+    results = [e.text.split()[0] for e in driver.find_elements_by_class_name("searchresult")]
+    assert sorted(results) == ['extA', 'extB']
+
+    driver.find_elements_by_class_name("searchresult")[0].click()
+    fields = testutils.ItemHelper(driver).fields
+    assert fields['groupid'] == 'webservers'
+    assert fields['title'] == results[0]
+
+def test_search_after_clearing_details(driver):
+    """
+    Requirement: An entry whose URL has a word of its group name is still found by
+    its group name after the cached details are cleared (logout or idle timeout).
+    """
+    form = testutils.ItemHelper(driver)
+    form.fields = dict(FACEPALM, url="https://web.facepalm.com")
+    form.add_new()
+    nav = testutils.NavigationHelper(driver)
+    nav.click(["user1"])
+    nav.click(["user1","web/"])
+    nav.click(["user1","web/","Facepalm"])
+    driver.execute_script("cacheClear()")
+
+    search = driver.find_element_by_id("search")
+    search.send_keys("web facep")
+    WebDriverWait(driver, 10).until(
+        EC.text_to_be_present_in_element((By.ID, "searchresults"), "Facepalm"))
+
+# Builds a separate index of 20000 generated entries and returns the median time in
+# ms of each query, after running all of them once
+SEARCH_TIMING_SCRIPT = """
+var index = new SearchIndex()
+var groups = ["servers", "network", "web", "databases", "storage", "monitoring",
+              "backup", "printers", "switches", "firewalls"]
+var kinds = ["srv", "web", "db", "sw", "fw", "mail", "host", "node"]
+for (var i=0; i < 20000; i++) {
+    var number = ("000"+ i).slice(-Math.max(4, String(i).length))
+    index.add("user/user1/", groups[i % groups.length] + (i % 37) +"/",
+              kinds[i % kinds.length] + number + (i % 3 ? "-prod" : ".example.com"))
+}
+var queries = arguments[0], times = {}
+queries.forEach(function (q) { index.search(q, SEARCH_RESULTS) })
+queries.forEach(function (q) {
+    var runs = []
+    for (var i=0; i < 5; i++) {
+        var start = performance.now()
+        index.search(q, SEARCH_RESULTS)
+        runs.push(performance.now() - start)
+    }
+    runs.sort(function (a, b) { return a - b })
+    times[q] = runs[2]
+})
+return times
+"""
+
+def test_search_timing(driver):
+    """
+    Requirement: A search in a large tree takes less than a frame (16 ms), also
+    for short queries and misspellings.
+    """
+    queries = ["s", "srv", "srv1234", "svr1234", "servre", "mail0042", "hots",
+               "web12 prod", "exampel"]
+    times = driver.execute_script(SEARCH_TIMING_SCRIPT, queries)
+    slow = dict((q, ms) for q, ms in times.items() if ms >= 16)
+    assert slow == {}
+
 class TestAddRemove(object):
     """ 
     """
@@ -166,25 +244,9 @@ class TestAddRemove(object):
             "url":"",
             "userid":"",
         }
-        form.fields = {
-            "collectionid":"user1",
-            "groupid":"web",
-            "title":"Facepalm",
-            "url":"https://facepalm.com",
-            "userid":"bob",
-            "password":"bobknows",
-            "notes":"Forget privacy!",
-        }
+        form.fields = FACEPALM
         # Should be able to read the values back.
-        assert form.fields == {
-            "collectionid":"user1",
-            "groupid":"web",
-            "title":"Facepalm",
-            "url":"https://facepalm.com",
-            "userid":"bob",
-            "password":"bobknows",
-            "notes":"Forget privacy!",
-        }
+        assert form.fields == FACEPALM
         form.add_new()
         assert form.message == "Added new entry web/Facepalm"
 
@@ -201,6 +263,7 @@ class TestAddRemove(object):
         """
         nav = testutils.NavigationHelper(driver)
 
+        add_facepalm(driver)
         nav.click(["user1"])
         nav.click(["user1","web/"])
         assert nav.visible(('user1','web/', 'Facepalm'))
@@ -234,22 +297,20 @@ class TestAddRemove(object):
         
         assert form.message == "Deleted entry web/Facepalm", "Requirement: delete message displayed"
 
-        time.sleep(1) # Nav tree needs extra time to update
+        archive = testutils.archivegroup(delete_ts)
         visible = nav.visiblelist()
         assert visible == [
             (u'linuxadmin',),
-            (u'user1',HISTGROUP),
+            (u'user1',archive),
             (u'user1',u'Pauls Stuff/'),
             (u'user1',u'network/'),
             (u'user1',u'web/', u'google'),
             (u'user1',u'web/', u'netflix'),
         ], "Archive group is visible in nav tree"
 
-        nav.click(["user1", HISTGROUP])
+        nav.click(["user1", archive])
         title = nav.findarchived(delete_ts, ('user1','web','Facepalm') )
         assert title is not None, "Requirement: deleted entry is in archive group."
-        # Stash title name for later test step
-        state["test_del_item_facepalm_title"] = title
 
         
     def test_del_archived_item_facepalm(s,driver):
@@ -258,15 +319,16 @@ class TestAddRemove(object):
         nav = testutils.NavigationHelper(driver)
         form = testutils.ItemHelper(driver)
 
-        nav.click(["user1"])
-        nav.click(["user1", HISTGROUP])
-        title = state["test_del_item_facepalm_title"]
-        del state["test_del_item_facepalm_title"]
+        delete_ts = delete_facepalm(driver)
+        archive = testutils.archivegroup(delete_ts)
+        nav.click(["user1", archive])
+        title = nav.findarchived(delete_ts, ('user1','web','Facepalm') )
+        assert title is not None
 
-        nav.click(("user1", HISTGROUP, title))
+        nav.click(("user1", archive, title))
         assert form.fields == {
             "collectionid":"user1",
-            "groupid":HISTGROUP[:-1],
+            "groupid":archive[:-1],
             "notes":"Forget privacy!",
             "password":"bobknows",
             "title":title,
@@ -277,7 +339,7 @@ class TestAddRemove(object):
         form.delete()
         WebDriverWait(driver, 5).until(
             EC.text_to_be_present_in_element(
-                (By.ID,"mainmsg"),"Deleted entry %s%s" % (HISTGROUP, title)))
+                (By.ID,"mainmsg"),"Deleted entry %s%s" % (archive, title)))
 
         assert form.fields == {
             "collectionid":"user1",
@@ -289,7 +351,7 @@ class TestAddRemove(object):
             "userid":"",
         }, "Requirement: fields cleared after delete (archived entry)"
 
-        assert nav.hidden(('user1', HISTGROUP, title)), "Requirement: item removed from archive"
+        assert nav.hidden(('user1', archive, title)), "Requirement: item removed from archive"
 
 
 def ztest_delete_item(driver):
@@ -308,9 +370,59 @@ def ztest_modify_item_password(driver):
     """  """
     assert False, 'not implemented'
 
-def ztest_modify_item_title(driver):
-    """  """
-    assert False, 'not implemented'
+def test_modify_item_title(driver):
+    """ Requirement: An entry can be renamed. The new name replaces the old one in
+    the nav tree once the save completes, and the values are kept.
+    """
+    nav = testutils.NavigationHelper(driver)
+    form = testutils.ItemHelper(driver)
+
+    nav.click(["user1"])
+    nav.click(["user1","network/"])
+    nav.click(["user1","network/","router"])
+    form.fields = {"title": "2"}
+    form.update()
+    WebDriverWait(driver, 5).until(
+        EC.text_to_be_present_in_element((By.ID,"mainmsg"),"Renamed entry to network/router2"))
+    assert nav.visible(('user1','network/','router2'))
+    assert nav.hidden(('user1','network/','router'))
+    assert form.fields["userid"] == "admin"
+
+    # And back again
+    driver.find_element_by_id("title").clear()
+    form.fields = {"title": "router"}
+    form.update()
+    WebDriverWait(driver, 5).until(lambda d: form.message == "Renamed entry to network/router")
+    assert nav.visible(('user1','network/','router'))
+
+def test_modify_item_title_rolled_back(driver, vault_data):
+    """ Requirement: A rename that fails part way changes nothing. When the old
+    name cannot be deleted, the entry under the new name and the archive copy are
+    removed again.
+    """
+    if vault_data is None:
+        pytest.skip('needs the Vault stand-in')
+    nav = testutils.NavigationHelper(driver)
+    form = testutils.ItemHelper(driver)
+    before = dict(vault_data.secrets)
+    policy = vault_data.policies['user-user1']
+    vault_data.policies['user-user1'] = policy + parse_policy(
+        'path "secret/vpwmgr/user/user1/network/router" '
+        '{ capabilities = ["create", "read", "update", "list"] }')
+    try:
+        nav.click(["user1"])
+        nav.click(["user1","network/"])
+        nav.click(["user1","network/","router"])
+        form.fields = {"title": "2"}
+        form.update()
+        WebDriverWait(driver, 5).until(
+            EC.text_to_be_present_in_element((By.ID,"mainmsg"),"nothing was changed"))
+    finally:
+        vault_data.policies['user-user1'] = policy
+    assert vault_data.secrets == before
+    testutils.wait_settled(driver)
+    assert nav.visible(('user1','network/','router'))
+    assert nav.hidden(('user1','network/','router2'))
 
 def ztest_modify_item_url(driver):
     """  """
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+
+# Tests for pwdata.py: bulk load and export, archive compaction and migration.
+# These run against the in-memory Vault stand-in, without a browser or Vault.
+
+import json
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+import pytest
+
+from fakevault import FakeVault
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pwdata
+
+SEED = os.path.join(os.path.dirname(__file__), 'data', 'seed.json')
+ARCHIVE = 'secret/vpwmgr/user/user1/Archive/'
+
+
+def stamp(days_ago):
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime(time.time() - days_ago * 86400))
+
+@pytest.fixture
+def vault():
+    vault = FakeVault.from_seed(SEED)
+    url = vault.start()
+    vault.client = pwdata.VaultClient(url, 'root')
+    yield vault
+    vault.stop()
+
+def collection(vault, name):
+    """ The secrets of a collection keyed by path below it """
+    base = pwdata.PREFIX + name + '/'
+    return dict((k[len(base):], v) for k, v in vault.secrets.items() if k.startswith(base))
+
+def archived(vault):
+    return sorted(k[len(ARCHIVE):] for k in vault.secrets if k.startswith(ARCHIVE))
+
+
+ENTRIES = [
+    {'collection': 'user/user9', 'group': 'web', 'title': 'mail', 'url': 'https://mail',
+     'userid': 'me', 'password': u'p\xe4ss, "quoted"', 'notes': 'two\nlines',
+     'changed': '2018-01-01 00:00:00Z', 'pwChanged': '2018-01-01 00:00:00Z'},
+    {'collection': 'user/user9', 'group': 'net', 'title': 'router', 'userid': 'admin',
+     'password': 'admin', 'changed': '2018-02-01 00:00:00Z', 'pwChanged': '2018-01-15 00:00:00Z'},
+    {'collection': 'user/user9', 'group': 'net', 'title': 'switch', 'userid': 'admin',
+     'password': 'x', 'changed': '2018-03-01 00:00:00Z', 'pwChanged': '2018-03-01 00:00:00Z'},
+]
+
+def write_dataset(tmpdir, entries):
+    filename = str(tmpdir.join('dataset.json'))
+    with open(filename, 'w') as f:
+        json.dump({'entries': entries}, f)
+    return filename
+
+class FailingClient(object):
+    """ A client whose writes fail after the first 'limit' """
+    def __init__(s, client, limit):
+        s.client = client
+        s.limit = limit
+        s.writes = []
+
+    def write(s, path, data):
+        if len(s.writes) >= s.limit:
+            raise pwdata.VaultError('POST %s: 503' % path)
+        s.writes.append(path)
+        s.client.write(path, data)
+
+class VanishingClient(object):
+    """ A client for which the given entries are deleted after they were listed """
+    def __init__(s, client, gone):
+        s.client = client
+        s.gone = gone
+
+    def list(s, path):
+        return s.client.list(path)
+
+    def read(s, path):
+        return None if path in s.gone else s.client.read(path)
+
+class FlakyPool(object):
+    """ A connection pool answering with the given statuses in turn """
+    def __init__(s, statuses):
+        s.statuses = list(statuses)
+
+    def request(s, method, path, body=None, headers=None):
+        return s.statuses.pop(0), 'Status', [], ''
+
+
+def test_load_export_json(vault, tmpdir):
+    pwdata.load(vault.client, write_dataset(tmpdir, ENTRIES), 4,
+                str(tmpdir.join('journal')), False)
+    data = collection(vault, 'user/user9')
+    assert sorted(data) == ['net/router', 'net/switch', 'web/mail']
+    assert data['web/mail']['password'] == u'p\xe4ss, "quoted"'
+
+    out = StringIO()
+    pwdata.export(vault.client, 'user/user9', 4, 'json', out)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    key = lambda row: (row['group'], row['title'])
+    assert sorted(rows, key=key) == sorted(ENTRIES, key=key)
+
+def test_export_skips_deleted(vault, tmpdir):
+    pwdata.load(vault.client, write_dataset(tmpdir, ENTRIES), 4,
+                str(tmpdir.join('journal')), False)
+    client = VanishingClient(vault.client, [pwdata.PREFIX + 'user/user9/net/router'])
+    out = StringIO()
+    assert pwdata.export(client, 'user/user9', 4, 'json', out) == 2
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted(row['title'] for row in rows) == ['mail', 'switch']
+
+def test_load_export_csv(vault, tmpdir):
+    pwdata.load(vault.client, write_dataset(tmpdir, ENTRIES), 4,
+                str(tmpdir.join('journal')), False)
+    before = collection(vault, 'user/user9')
+    filename = str(tmpdir.join('user9.csv'))
+    with open(filename, 'wb') as f:
+        pwdata.export(vault.client, 'user/user9', 4, 'csv', f)
+
+    for path in [k for k in vault.secrets if k.startswith(pwdata.PREFIX + 'user/user9/')]:
+        del vault.secrets[path]
+    pwdata.load(vault.client, filename, 4, str(tmpdir.join('journal')), False)
+    after = collection(vault, 'user/user9')
+    # Empty CSV cells come back as empty fields
+    assert after['net/router'].pop('url') == ''
+    assert after['net/router'].pop('notes') == ''
+    assert after['net/switch'].pop('url') == ''
+    assert after['net/switch'].pop('notes') == ''
+    assert after == before
+
+def test_load_resume(vault, tmpdir):
+    entries = [dict(ENTRIES[1], title='host%02d' % i) for i in range(20)]
+    dataset = write_dataset(tmpdir, entries)
+    journal = str(tmpdir.join('journal'))
+    failing = FailingClient(vault.client, 7)
+    with pytest.raises(pwdata.VaultError):
+        pwdata.load(failing, dataset, 1, journal, False)
+    with open(journal) as f:
+        done = f.read().splitlines()
+    assert done == failing.writes
+    assert len(collection(vault, 'user/user9')) == 7
+
+    resumed = FailingClient(vault.client, 100)
+    pwdata.load(resumed, dataset, 4, journal, True)
+    assert len(resumed.writes) == 13, 'completed writes are not repeated'
+    assert not set(resumed.writes) & set(done)
+    assert len(collection(vault, 'user/user9')) == 20
+    with open(journal) as f:
+        assert sorted(f.read().splitlines()) == sorted(done + resumed.writes)
+
+def test_client_retries():
+    client = pwdata.VaultClient('http://127.0.0.1:1', 'root', retries=2, backoff=0)
+    client.pool = FlakyPool([503, 429, 204])
+    client.write('secret/vpwmgr/x', {})
+    client.pool = FlakyPool([503, 502, 500])
+    with pytest.raises(pwdata.VaultError):
+        client.write('secret/vpwmgr/x', {})
+    client.pool = FlakyPool([403])
+    with pytest.raises(pwdata.VaultError):
+        client.write('secret/vpwmgr/x', {})
+
+def test_select_expired():
+    now = time.time()
+    entries = [('Archive', 'web|google|%s' % stamp(d)) for d in (1, 10, 100, 200)]
+    entries.append(('Archive/2017-01', 'web|netflix|20170101000000'))
+    entries.append(('Archive', 'not an archived title'))
+
+    expired = pwdata.select_expired(entries, 2, None, now)
+    assert expired == sorted([entries[2], entries[3]])
+    expired = pwdata.select_expired(entries, None, 50, now)
+    assert expired == sorted([entries[2], entries[3], entries[4]])
+    # A version is kept if either limit keeps it
+    expired = pwdata.select_expired(entries, 1, 50, now)
+    assert expired == sorted([entries[2], entries[3]])
+
+def test_compact(vault):
+    for days in (1, 10, 400):
+        vault.secrets[ARCHIVE + 'web|google|' + stamp(days)] = {'userid': str(days)}
+    vault.secrets[ARCHIVE + '2017-01/web|netflix|20170101000000'] = {'userid': 'n'}
+
+    pwdata.compact(vault.client, ['user/user1'], None, 365, None, 4, True, sys.stdout)
+    assert len(archived(vault)) == 4, 'dry run changes nothing'
+
+    pwdata.compact(vault.client, ['user/user1/'], None, 365, 'month', 4, False, sys.stdout)
+    assert archived(vault) == sorted([
+        stamp(1)[:4] + '-' + stamp(1)[4:6] + '/web|google|' + stamp(1),
+        stamp(10)[:4] + '-' + stamp(10)[4:6] + '/web|google|' + stamp(10),
+    ])
+    assert vault.secrets[ARCHIVE + stamp(1)[:4] + '-' + stamp(1)[4:6] +
+                         '/web|google|' + stamp(1)] == {'userid': '1'}
+
+def test_migrate(vault):
+    vault.secrets[ARCHIVE + 'web|google|20180101000000'] = {'userid': 'first'}
+    vault.secrets[ARCHIVE + '2018-02/web|google|20180201000000'] = {'userid': 'second'}
+    vault.secrets[ARCHIVE + 'web|gone|20180301000000'] = {'userid': 'gone'}
+    kv2 = 'kv2/vpwmgr/user/user1/'
+
+    pwdata.migrate(vault.client, ['user/user1'], 'kv2', 4, True, sys.stdout)
+    assert not vault.versioned, 'dry run changes nothing'
+
+    pwdata.migrate(vault.client, ['user/user1'], 'kv2', 4, False, sys.stdout)
+    google = vault.versioned[kv2 + 'web/google']
+    assert [google['versions'][n]['data']['userid'] for n in (1, 2, 3)] == ['first', 'second', 'user']
+    assert google['current_version'] == 3
+    gone = vault.versioned[kv2 + 'web/gone']
+    assert gone['versions'][1]['data'] == {'userid': 'gone'}
+    assert gone['versions'][1]['deletion_time'], 'entries only in the archive are deleted'
+    deleted = vault.versioned[kv2 + '.deleted']['versions'][1]['data']
+    assert deleted == {'web/gone': {'deleted': '2018-03-01 00:00:00Z',
+                                    'title': 'web|gone|20180301000000'}}
+    assert not [k for k in vault.versioned if '/Archive/' in k]
+    assert kv2 + 'Pauls Stuff/$+dream' in vault.versioned
+
+    pwdata.migrate(vault.client, ['user/user1'], 'kv2', 4, False, sys.stdout)
+    assert google['current_version'] == 3, 'migrated entries are skipped'
+    assert vault.versioned[kv2 + '.deleted']['current_version'] == 1
+
+def test_migrate_resume(vault):
+    vault.secrets[ARCHIVE + 'web|google|20180101000000'] = {'userid': 'first'}
+    vault.secrets[ARCHIVE + 'web|google|20180201000000'] = {'userid': 'second'}
+    kv2 = 'kv2/vpwmgr/user/user1/'
+    # An interrupted migration wrote the first version only
+    vault.client.write(pwdata.kv2_path('kv2', 'data', 'user/user1', 'web/google'),
+                       {'data': {'userid': 'first'}})
+
+    pwdata.migrate(vault.client, ['user/user1'], 'kv2', 4, False, sys.stdout)
+    google = vault.versioned[kv2 + 'web/google']
+    assert [google['versions'][n]['data']['userid'] for n in (1, 2, 3)] == ['first', 'second', 'user']
+    assert google['current_version'] == 3
+    assert google['custom_metadata'] == {pwdata.MIGRATED_MARKER: '3'}
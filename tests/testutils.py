@@ -3,13 +3,119 @@
 # Helper classes for tests.
 
 import datetime
-import time
 
+from selenium.webdriver.common.by import By
 from selenium.webdriver.support.select import Select
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
 
 """ Name of the archive group. """
 HISTGROUP = u'Archive/'
 
+# Seconds to wait for the page to settle after an action
+SETTLE_TIMEOUT = 10
+
+# whenSettled(callback) calls back once renderSettled() in pwmgr.js is true and Vue
+# has rendered any change still queued. Rendering may start new requests (e.g. the
+# tree listing after login), so it checks again after that. Pages without the
+# function (e.g. the login page before pwmgr.js has loaded) count as settled.
+SETTLE_JS = """
+function whenSettled(callback) {
+    if (window.renderSettled && !window.renderSettled()) {
+        document.addEventListener("render-settled", function () { whenSettled(callback) },
+                                  {once: true});
+    } else if (window.Vue) {
+        Vue.nextTick(function () {
+            if (window.renderSettled && !window.renderSettled()) whenSettled(callback);
+            else callback();
+        });
+    } else {
+        callback();
+    }
+}
+"""
+
+SETTLED_SCRIPT = SETTLE_JS + """
+var done = arguments[arguments.length - 1];
+whenSettled(function () { done(true) });
+"""
+
+# Returns the navigation tree as [collection, displayed, groups] lists, with
+# groups as [group, displayed, items] and items as [title, displayed].
+SNAPSHOT_SCRIPT = """
+function shown(e) { return e.getClientRects().length > 0 }
+function text(e) { return e.textContent.trim() }
+function names(parent, cls) {
+    return Array.prototype.slice.call(parent.getElementsByClassName(cls));
+}
+var nav = document.getElementsByTagName("nav")[0];
+return names(nav, "collectionname").map(function (cname) {
+    var groups = names(cname.parentNode, "groupname").map(function (gname) {
+        var items = names(gname.parentNode, "itemname").map(function (item) {
+            return [text(item), shown(item)];
+        });
+        return [text(gname), shown(gname), items];
+    });
+    return [text(cname), shown(cname), groups];
+});
+"""
+
+# Returns the name element of the navigation tree entry at the path given as
+# the arguments (collection[, group[, title]]), or null.
+FIND_SCRIPT = """
+var path = arguments;
+var classes = ["collectionname", "groupname", "itemname"];
+var parent = document.getElementsByTagName("nav")[0];
+var found = null;
+for (var i = 0; i < path.length; i++) {
+    var elements = parent.getElementsByClassName(classes[i]);
+    found = null;
+    for (var j = 0; j < elements.length; j++) {
+        if (elements[j].textContent.trim() === path[i]) { found = elements[j]; break; }
+    }
+    if (found === null) return null;
+    parent = found.parentNode;
+}
+return found;
+"""
+
+def wait_settled(driver, timeout=SETTLE_TIMEOUT):
+    """ Wait until the page has the answers to its Vault requests rendered. This
+    follows the "render-settled" event of pwmgr.js instead of sleeping. """
+    if getattr(driver, 'settle_timeout', None) != timeout:
+        driver.set_script_timeout(timeout)
+        driver.settle_timeout = timeout
+    driver.execute_async_script(SETTLED_SCRIPT)
+
+def archivegroup(ts):
+    """ Name of the archive group for entries archived at the datetime ts. The
+    archive has a group per month (ARCHIVE_SHARD in config.js). """
+    return HISTGROUP + ts.strftime('%Y-%m') + '/'
+
+def login(driver, userid, userpw):
+    """ Log in by password on the login page with the supplied credentials and
+    wait for the answer, which shows the main page or an error message. """
+    loginid = driver.find_element_by_id("loginid")
+    loginid.clear()
+    loginid.send_keys(userid)
+
+    loginpw = driver.find_element_by_id("loginpw")
+    loginpw.clear()
+    loginpw.send_keys(userpw)
+
+    loginpw.submit()
+    wait_settled(driver)
+
+def login_page(driver, url):
+    """ Show a fresh login page. When logged in this logs out, which resets the
+    application state without loading the page again. """
+    logout = driver.find_elements_by_id("b-logout")
+    if logout:
+        logout[0].click()
+    else:
+        driver.get(url)
+        WebDriverWait(driver, 10).until(EC.title_contains("Vault Password Manager"))
+    WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID,"loginid")))
 
 
 class ItemHelper(object):
@@ -56,31 +162,50 @@ class ItemHelper(object):
         return s.form.find_element_by_id("mainmsg").text
 
     def add_new(s):
-        """ Clicks the Add New button """
+        """ Clicks the Add New button and waits for the page to settle """
         s.form.find_element_by_id("b-new").click()
+        wait_settled(s.driver)
+
+    def update(s):
+        """ Clicks the Update (Move, Rename, ...) button and waits for the save to
+        complete. """
+        s.form.find_element_by_id("b-update").click()
+        wait_settled(s.driver)
 
     def delete(s):
-        """ Clicks the Delete button then OKs the 'Are you sure?' dialog. 
-        A WebDriverWait is recommended after calling this function.
+        """ Clicks the Delete button then OKs the 'Are you sure?' dialog and waits
+        for the page to settle.
         """
         s.form.find_element_by_id("b-delete").click()
         s.driver.switch_to.alert.accept()
+        wait_settled(s.driver)
 
 class NavigationHelper(object):
     """ 
     Helper class for examining and manipulating the navigation tree of 
     collections, groups and items.
     The click, visiblelist, visible, and archived functions are most commonly used.
+    The tree is read in one script call (see snapshot) and clicks wait for the
+    page to settle, which keeps the number of WebDriver round trips low.
     """
     def __init__(s,driver):
         """ Expects a Selenium style web browser driver """
         s.driver = driver
         s.nav = driver.find_element_by_tag_name("nav")
         assert s.nav
-        
+
+    def snapshot(s):
+        """ Return the navigation tree as a list of (collection, displayed, groups)
+        tuples, where groups is a list of (group, displayed, items) tuples and items
+        a list of (title, displayed) tuples. Taken with one script call. """
+        return [(cname, cshown,
+                 [(gname, gshown, [tuple(item) for item in items])
+                  for gname, gshown, items in groups])
+                for cname, cshown, groups in s.driver.execute_script(SNAPSHOT_SCRIPT)]
+
     def findarchived(s, del_ts, path, limit=5):
-        """ Returns the title of an item in the archive group that is within 'limit'
-        seconds of the del_ts datetime value. None is returned if no matching item 
+        """ Returns the title of an item in the archive group for the month of del_ts
+        that is within 'limit' seconds of the del_ts datetime value. None is returned if no matching item 
         is found. The path is the original (collection, group, title) tuple.
         This function is needed to allow for the difference in timestamps when the
         item is deleted and measured by the test program. It will prevent the test 
@@ -88,50 +213,38 @@ class NavigationHelper(object):
         timestamps.
         """
         prefix = "{1}|{2}|".format(*path)
-        for item in s.items(s.group(s.collection(path[0]), HISTGROUP)):
-            if item.text.startswith(prefix):
-                ts_str = item.text[len(prefix):]
-                item_ts = datetime.datetime.strptime(ts_str,'%Y%m%d%H%M%S')
-                if (del_ts - item_ts).total_seconds() < limit:
-                    return item.text
+        archive = archivegroup(del_ts)
+        for cname, cshown, groups in s.snapshot():
+            if cname != path[0]:
+                continue
+            for gname, gshown, items in groups:
+                if gname != archive:
+                    continue
+                for title, shown in items:
+                    if title.startswith(prefix):
+                        ts_str = title[len(prefix):]
+                        item_ts = datetime.datetime.strptime(ts_str,'%Y%m%d%H%M%S')
+                        if (del_ts - item_ts).total_seconds() < limit:
+                            return title
         return None
 
     def click(s, path):
         """ Generate a click on a navigation tree element """
         assert len(path) > 0 and len(path) < 4
-
-        collection = s.collectionname(path[0])
-        assert collection
-        if len(path) == 1:
-            s._click(collection)
-            return
-
-        group = s.groupname(collection.find_element_by_xpath('..'), path[1])
-        assert group
-        if len(path) == 2:
-            s._click(group)
-            return
-
-        item = s.item(group.find_element_by_xpath('..'), path[2])
-        assert item
-        s._click(item)
-        return
+        element = s.driver.execute_script(FIND_SCRIPT, *path)
+        assert element
+        s._click(element)
 
     def collection(s, name):
         """ Return a collection webelement by name or None if not found """
-        for element in s.nav.find_elements_by_class_name("collectionname"):
-            if element.text == name:
-                return element.find_element_by_xpath('..')
-        return None
+        element = s.collectionname(name)
+        return element.find_element_by_xpath('..') if element else None
 
     def collectionname(s, name):
         """ Return a collection webelement by name or None if not found.
         The collection element is the parent of the collectionname element
         """
-        for element in s.nav.find_elements_by_class_name("collectionname"):
-            if element.text == name:
-                return element
-        return None
+        return s.driver.execute_script(FIND_SCRIPT, name)
 
     def collections(s):
         """ Return a dictionary of collectionname_webelement:collection_webelement pairs. 
@@ -144,10 +257,8 @@ class NavigationHelper(object):
 
     def group(s, collection, name):
         """ Return a group webelement by name or None if not found """
-        for element in collection.find_elements_by_class_name("groupname"):
-            if element.text == name:
-                return element.find_element_by_xpath('..')
-        return None
+        element = s.groupname(collection, name)
+        return element.find_element_by_xpath('..') if element else None
 
     def groupname(s, collection, name):
         """ Return a group webelement by name or None if not found.
@@ -172,21 +283,7 @@ class NavigationHelper(object):
         is (collection, group, title) tuple. """
         # Vue does not fully build the nav tree immediately, so we must allow for
         # elements to be missing in addition to being present but not displayed.
-        assert len(path) > 0 and len(path) < 4
-
-        collection = s.collectionname(path[0])
-        if not collection: return True
-        if len(path) == 1:
-            return not collection.is_displayed()
-
-        group = s.groupname(collection.find_element_by_xpath('..'), path[1])
-        if not group: return True
-        if len(path) == 2:
-            return not group.is_displayed()
-
-        item = s.item(group.find_element_by_xpath('..'), path[2])
-        if not item: return True
-        return not item.is_displayed()
+        return not s.visible(path)
 
     def item(s, group, name):
         """ Return an item web element by name or None if not found. 
@@ -208,22 +305,18 @@ class NavigationHelper(object):
         is (collection, group, title) tuple. 
         """
         assert len(path) > 0 and len(path) < 4
-        print "Looking for ",path
-        collection = s.collectionname(path[0])
-        if not collection: return False
-        print "Found collection", collection.text
-        if len(path) == 1:
-            return collection.is_displayed()
-
-        group = s.groupname(collection.find_element_by_xpath('..'), path[1])
-        if not group: return False
-        print "Found group", group.text
-        if len(path) == 2:
-            return group.is_displayed()
-
-        item = s.item(group.find_element_by_xpath('..'), path[2])
-        if not item: return False
-        return item.is_displayed()
+        for cname, cshown, groups in s.snapshot():
+            if cname != path[0]:
+                continue
+            if len(path) == 1:
+                return cshown
+            for gname, gshown, items in groups:
+                if gname != path[1]:
+                    continue
+                if len(path) == 2:
+                    return gshown
+                return any(shown for title, shown in items if title == path[2])
+        return False
 
     def visiblelist(s):
         """ Returns a sorted list of tuples in the nav tree that are currently visible.
@@ -231,29 +324,25 @@ class NavigationHelper(object):
         ("collection", "group", "item"). No expansion of the tree items is done. 
         """
         visible = []
-        collectionmap = s.collections()
-        assert len(collectionmap) > 0
-        for cname in collectionmap.keys():
+        tree = s.snapshot()
+        assert len(tree) > 0
+        for cname, cshown, groups in tree:
             collection_expanded = False
-            groups = s.groups(collectionmap[cname])
-            for groupname in groups.keys():
+            for gname, gshown, items in groups:
                 group_expanded = False
-                items = s.items(groups[groupname])
-                for item in items:
-                    if item.is_displayed():
-                        visible.append( (cname.text, groupname.text, item.text) )
+                for title, shown in items:
+                    if shown:
+                        visible.append( (cname, gname, title) )
                         collection_expanded = True
                         group_expanded = True
-                if groupname.is_displayed() and not group_expanded:
-                    visible.append( (cname.text, groupname.text) )
+                if gshown and not group_expanded:
+                    visible.append( (cname, gname) )
                     collection_expanded = True
             if not collection_expanded:
-                visible.append( (cname.text,) )
+                visible.append( (cname,) )
         return sorted(visible)
         
     def _click(s, element):
-        # Reload nav tree after clicking an element
+        # Wait for the nav tree to update after clicking an element
         element.click()
-        time.sleep(0.5)
-        s.nav = s.driver.find_element_by_tag_name("nav")
-
+        wait_settled(s.driver)
@@ -0,0 +1,140 @@
+# Pooled persistent HTTP/1.1 connections to a Vault server.
+
+import httplib
+import select
+import socket
+import sys
+import threading
+import urlparse
+
+# Methods that can be sent again when the answer to them was lost
+IDEMPOTENT = ('GET', 'HEAD')
+
+
+class ConnectionPool(object):
+    """
+    A pool of persistent connections to one upstream HTTP server. At most 'size'
+    requests are in flight at once. Further callers wait for a free connection.
+    Idle connections are reused, so only the first requests pay for a connect.
+    """
+    def __init__(s, url, size=8, timeout=30):
+        """ url is the base URL of the server, e.g. http://127.0.0.1:8200 """
+        parsed = urlparse.urlparse(url)
+        s.url = url
+        s.https = parsed.scheme == 'https'
+        s.host = parsed.hostname
+        s.port = parsed.port
+        s.size = size
+        s.timeout = timeout
+        s.idle = []
+        s.lock = threading.Lock()
+        s.slots = threading.BoundedSemaphore(size)
+
+    def _connect(s):
+        if s.https:
+            return httplib.HTTPSConnection(s.host, s.port, timeout=s.timeout)
+        return httplib.HTTPConnection(s.host, s.port, timeout=s.timeout)
+
+    def _get(s):
+        """ Return (connection, reused) with an idle connection if there is one.
+        Idle connections the server has closed meanwhile are dropped. """
+        while True:
+            with s.lock:
+                if not s.idle:
+                    break
+                conn = s.idle.pop()
+            if not stale(conn):
+                return conn, True
+            conn.close()
+        return s._connect(), False
+
+    def _put(s, conn):
+        with s.lock:
+            s.idle.append(conn)
+
+    def request(s, method, path, body=None, headers=None):
+        """ Send a request and read the whole response. Returns a tuple of
+        (status, reason, headers, body) where headers is a list of (name, value)
+        pairs with lower case names. A request that fails on a reused connection
+        is tried again on another one, since the server may have closed it while
+        it was idle: always when it could not be sent, and only for IDEMPOTENT
+        methods when the response was lost, as the server may have acted on the
+        request. Other connection errors are raised as socket.error or
+        httplib.HTTPException.
+        """
+        s.slots.acquire()
+        try:
+            while True:
+                conn, reused = s._get()
+                sent = False
+                try:
+                    conn.request(method, path, body, headers or {})
+                    sent = True
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    if reused and (not sent or method in IDEMPOTENT):
+                        continue
+                    raise
+                if resp.will_close:
+                    conn.close()
+                else:
+                    s._put(conn)
+                return resp.status, resp.reason, resp.getheaders(), data
+        finally:
+            s.slots.release()
+
+    def close(s):
+        """ Close all idle connections. """
+        with s.lock:
+            idle, s.idle = s.idle, []
+        for conn in idle:
+            conn.close()
+
+
+def stale(conn):
+    """ True if the server has closed an idle connection (or sent something
+    unasked, which leaves it unusable too): its socket is readable before a
+    request was sent. """
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return True
+    return bool(readable)
+
+def parallel(func, items, workers):
+    """ Call func for each item using up to 'workers' threads. Returns the results
+    in the order of items. If func raises, the remaining items are skipped and the
+    first exception is raised again here. """
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    pending = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if errors:
+                    return
+                i = next(pending, None)
+            if i is None:
+                return
+            try:
+                results[i] = func(items[i])
+            except Exception:
+                with lock:
+                    errors.append(sys.exc_info())
+                return
+
+    threads = [threading.Thread(target=work) for i in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
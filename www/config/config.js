@@ -1,6 +1,62 @@
 // Path prefix within Vault where data is stored for this application
 var VPWMGR= "v1/secret/vpwmgr/"
 
-// Base URL for the Vault server
-var BASEURL='http://127.0.0.1:8200/'
+// Version of the KV secrets engine that holds VPWMGR, mounted at KV_MOUNT. With 2 an
+// update is one versioned write and replaces the Archive copies: the entry form offers
+// earlier versions, and deleted entries are soft deleted and can be undeleted from the
+// Archive group. 'pwdata.py migrate' moves KV version 1 data with its Archive over.
+var KV_VERSION=1
+var KV_MOUNT="v1/secret/"
 
+// Base URL for the Vault server. '/' sends requests through the /v1/ proxy of the
+// server that serves these files (e.g. httpd.py), which avoids CORS preflight requests.
+// Use the Vault address (e.g. 'http://127.0.0.1:8200/') to talk to Vault directly.
+var BASEURL='/'
+
+
+// Maximum number of requests to the Vault server that may be in flight at once
+var MAXREQUESTS=6
+
+// List the navigation tree in a Web Worker (dataworker.js), off the UI thread. The
+// page does the listing itself when this is false or the browser has no workers.
+var DATA_WORKER=true
+
+// Only list the collection names at login. Groups and entries are loaded when
+// a collection or group is first opened in the navigation tree.
+var LAZYLOAD=false
+
+// Groups with more entries than NAV_WINDOW show them in a scrolling window of NAV_ROWS
+// rows in the navigation tree. Only the rows in view, plus NAV_OVERSCAN above and
+// below, are rendered.
+var NAV_WINDOW=200
+var NAV_ROWS=30
+var NAV_OVERSCAN=10
+
+// Number of entry details (including passwords) kept in memory and for how many
+// seconds they are reused before reading them from Vault again. 0 disables the cache.
+var DETAILCACHE_SIZE=100
+var DETAILCACHE_TTL=300
+
+// Seconds without user activity after which cached secrets are cleared. 0 disables.
+var IDLETIMEOUT=900
+
+// When a group is opened or hovered in the navigation tree, read the details of up to
+// PREFETCH_LIMIT of its entries into the cache above while the browser is idle, with at
+// most PREFETCH_REQUESTS of those requests in flight. 0 disables prefetching.
+var PREFETCH_LIMIT=0
+var PREFETCH_REQUESTS=2
+
+// Deleted and replaced entries are archived in a sub-group of the Archive group per
+// "month" or "year", so that no one group grows without bound. "" keeps them all in
+// the Archive group itself. Use 'pwdata.py compact' to prune old archived entries.
+var ARCHIVE_SHARD="month"
+
+// Number of results shown for the search box, and whether the URL and userid of
+// entries whose details have been read are searched as well.
+var SEARCH_RESULTS=50
+var SEARCH_DETAILS=true
+
+// Show the Timings button, which opens a panel with the p50/p95/p99 round trip times
+// of Vault requests by operation. The last TIMING_SAMPLES times of each are kept.
+var DEBUG_PANEL=false
+var TIMING_SAMPLES=1000
@@ -0,0 +1,37 @@
+/*
+Web Worker running the Vault data layer (vaultdata.js) for the page, see dataCall()
+in pwmgr.js.
+
+A message {id, call, args, token} runs dataCalls[call] with the user's token and is
+answered with {id, result} or {id, error} once its promise settles. Every answer also
+carries the worker's DELETED_SECRET records, which getGroupNames reads, and the request
+timings taken since the last answer. A message {deleted} brings in the records the page
+has written since.
+*/
+
+var window = self
+window.userToken = ""
+importScripts("config/config.js", "vaultdata.js")
+forwardTimings = true
+
+/* Post an answer to the page with the pending timings */
+function answer(msg) {
+    msg.deleted = deletedEntries
+    msg.timings = pendingTimings
+    pendingTimings = []
+    self.postMessage(msg)
+}
+
+self.onmessage = function (event) {
+    var msg = event.data
+    if (msg.deleted) {
+        for (var collectionid in msg.deleted) deletedEntries[collectionid] = msg.deleted[collectionid]
+    }
+    if (! msg.call) return
+    window.userToken = msg.token
+    dataCalls[msg.call].apply(null, msg.args).then(function (result) {
+        answer({id: msg.id, result: result})
+    }, function (err) {
+        answer({id: msg.id, error: err.message})
+    })
+}
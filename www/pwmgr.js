@@ -25,9 +25,6 @@ notes = textual notes associated with a password entry (optional)
 window.userToken = ""
 window.vaultid = ""
 
-// Name of the special group for historical entries. Deleted entries are stored here.
-var HISTGROUP="Archive"
-
 // A empty Vue instance to act as a event transfer hub. This is used for communication
 // between different vue components.
 var eventHub = new Vue();
@@ -40,163 +37,802 @@ function currentTime() {
 }
 
 
-/* Authenticate a user to Vault using a password.
+/* Authenticate a user to Vault using a password. Returns a promise for the client
+token, which is "" when the login failed.
 A successful Vault response for a password login looks similar to:
 {"request_id":"df406871-9c46-2a4b-265a-e4991e1b3737","lease_id":"","renewable":false,"lease_duration":0,"data":null,"wrap_info":null,"warnings":null,"auth":{"client_token":"7d44048a-60b0-6788-7252-1f81a423387e","accessor":"2cc26537-4873-75e5-c18d-5bc5e0d34434","policies":["default","user-psparks"],"metadata":{"userid":"psparks"},"lease_duration":2764800,"renewable":true,"entity_id":"0cf6ec07-3c81-ff05-64f2-d5a835091e92"}}
 */
 function passwordAuthenticate(vaultid, password) {
-    var xhttp = new XMLHttpRequest();
-    xhttp.open("POST", BASEURL +"v1/auth/userpass/login/"+ vaultid, false);
-    xhttp.setRequestHeader("Content-type", "application/json");
-    xhttp.send('{"password":"'+ password +'"}');
-    var response = JSON.parse(xhttp.responseText);
-    if (! response.auth)
-        return ""
-    console.log("Response: token=%s", response.auth.client_token);
-    return response.auth.client_token
-}
-
-/* Make a request to the Vault server. Return the parsed JSON result.
-*/
-function vaultGetRequest(relURL) {
-    var xhttp = new XMLHttpRequest();
-    xhttp.open("GET", BASEURL + encodeURI(relURL), false);
-    xhttp.setRequestHeader("Content-type", "application/json");
-    xhttp.setRequestHeader("X-Vault-Token",window.userToken);
-    xhttp.send();
-	if (xhttp.status != 200) return null
-    console.log("%s response=%s",xhttp.status, xhttp.responseText);
-    return JSON.parse(xhttp.responseText);
-}
-
-/* Make a request to the Vault server. Return the status.
-*/
-function vaultPostRequest(relURL, dataobj) {
-    var xhttp = new XMLHttpRequest();
-    xhttp.open("POST", BASEURL + encodeURI(relURL), false);
-    xhttp.setRequestHeader("Content-type", "application/json");
-    xhttp.setRequestHeader("X-Vault-Token",window.userToken);
-    xhttp.send(JSON.stringify(dataobj));
-    console.log("response=%s",xhttp.responseText);
-    return xhttp.status
-}
-
-/* Make a request to the Vault server. Return the status.
-TODO: Make this asynchronous. There is not much the user can do during a request, 
-but it would be nice not to freeze in case there is a problem talking to Vault.
+    return dataRequest("POST", "v1/auth/userpass/login/"+ vaultid, {password: password}).then(function (response) {
+        if (! response.body || ! response.body.auth)
+            return ""
+        return response.body.auth.client_token
+    })
+}
+
+/* The Web Worker running the data layer (see dataworker.js) or null when the
+functions of vaultdata.js run on the page. See DATA_WORKER in config.js. */
+var dataWorker = null
+
+/* Calls waiting for an answer from dataWorker, keyed by call id */
+var workerCalls = {}
+var workerCallId = 0
+
+/* Return a promise for the result of one of the dataCalls functions of vaultdata.js
+with the given arguments. It runs in dataWorker when there is one, with the answer
+posted back to the page, which keeps the UI thread free while a large tree is listed.
 */
-function vaultDeleteRequest(relURL) {
-    var xhttp = new XMLHttpRequest();
-    xhttp.open("DELETE", BASEURL + encodeURI(relURL), false);
-    xhttp.setRequestHeader("Content-type", "application/json");
-    xhttp.setRequestHeader("X-Vault-Token",window.userToken);
-    xhttp.send();
-    console.log("response=%s",xhttp.status);
-    return xhttp.status;
+function dataCall(name, args) {
+    if (! dataWorker) return dataCalls[name].apply(null, args)
+    workerCallId += 1
+    var id = workerCallId
+    return new Promise(function (resolve, reject) {
+        workerCalls[id] = {name: name, args: args, resolve: resolve, reject: reject}
+        dataWorker.postMessage({id: id, call: name, args: args, token: window.userToken})
+    })
 }
 
+/* Make a Vault request like vaultRequest() does, in dataWorker when there is one.
+The page and the worker then share one request queue, so that no more than
+MAXREQUESTS requests are in flight in all. */
+function dataRequest(method, relURL, dataobj) {
+    return dataCall("vaultRequest", [method, relURL, dataobj])
+}
+
+/* Start dataWorker if the browser supports it. Should it fail to load, the calls
+waiting for it are run on the page and so is everything after. A write it may have
+sent already is not sent again but answered as a network failure (status 0). */
+function startDataWorker() {
+    if (! DATA_WORKER || typeof Worker === "undefined") return
+    try {
+        dataWorker = new Worker("dataworker.js")
+    } catch (e) {
+        console.log("Data worker not available: %s", e.message)
+        return
+    }
+    dataWorker.onmessage = function (event) {
+        var msg = event.data
+        for (var collectionid in msg.deleted) deletedEntries[collectionid] = msg.deleted[collectionid]
+        for (var i=0; i < msg.timings.length; i++) recordTiming(msg.timings[i][0], msg.timings[i][1])
+        var call = workerCalls[msg.id]
+        delete workerCalls[msg.id]
+        if (msg.error !== undefined) call.reject(new Error(msg.error))
+        else call.resolve(msg.result)
+        settleLater()
+    }
+    dataWorker.onerror = function (event) {
+        console.log("Data worker failed: %s", event.message)
+        dataWorker.terminate()
+        dataWorker = null
+        var calls = workerCalls
+        workerCalls = {}
+        for (var id in calls) {
+            var call = calls[id]
+            if (call.name === "vaultRequest" && call.args[0] !== "GET")
+                call.resolve({status: 0, body: null})
+            else
+                dataCall(call.name, call.args).then(call.resolve, call.reject)
+        }
+    }
+}
+startDataWorker()
+
+/* Number of settleLater() calls still waiting to check whether rendering settled */
+var settleWaits = 0
+
+/* True when the page is not waiting for Vault or the data worker and the navigation
+tree and form show the results. Each time this becomes true after such a wait, a
+"render-settled" event is dispatched on document. The functional tests wait for it
+rather than sleeping after every click. */
+function renderSettled() {
+    return settleWaits === 0 && requestsActive === 0 && requestQueue.length === 0 &&
+        Object.keys(workerCalls).length === 0
+}
+
+/* Dispatch "render-settled" once the promise reactions of the last response have run
+(the timeout) and Vue has rendered their changes (the next tick). */
+function settleLater() {
+    settleWaits += 1
+    setTimeout(function () {
+        Vue.nextTick(function () {
+            settleWaits -= 1
+            if (renderSettled()) document.dispatchEvent(new Event("render-settled"))
+        })
+    }, 0)
+}
+requestsDone = settleLater
+
 /* Return an array of objects consisting of names of form "(user|team)/<collectionname>/" 
-and a collection of groups.
+and a collection of groups. The array is returned right away and filled in as the
+Vault responses arrive. Each collection has a loading flag and an error message
+for display in the navigation tree. Collections the user does not have access to
+are dropped once Vault says so.
+In LAZYLOAD mode only the collection names are listed here. The groups of a
+collection are loaded by loadCollection when it is first opened.
 */
 function getCollections(vaultid) {
     console.log('getCollections for %s',vaultid);
-	var clist = [ "user/"+ vaultid +"/"]
-    var response = vaultGetRequest(VPWMGR +"team/?list=true");
-    var teamnames = response.data.keys.sort();
-	for (var i=0; i < teamnames.length; i++) clist[i+1] = "team/"+ teamnames[i];
-		
-	var msg="";	for (i=0; i< clist.length; i++) msg += " "+ clist[i];
-	console.log('collection list:%s',msg)
-
-	var collections = []
-	var next= 0
-    for (var i=0; i< clist.length; i++) {
-		var collection = getCollection(clist[i])
-		if (! collection) continue
-		collections[next] = {}
-		collections[next].name = clist[i]
-		collections[next].entries = collection
-		console.log("Added collection %s", collections[next].name)
-		next += 1
-    }
+    var collections = []
+    searchIndex.clear()
+    refreshCollections(vaultid, collections)
     return collections;
 }
 
-/* Return an array of password group objects consisting of names (with ending '/') 
-and an array of entry names for the given collection id. A collectionpath format is 
-either "user/<vaultid>/" or "team/<teamid>/"
-Returns null if a collection cannot be retrieved as in the case for teams which the 
-user does not have access to.
+/* Re-list the collections in place. Collection objects that are still present are
+kept along with whatever was loaded for them, and those are loaded again. Returns a
+promise that resolves when all loads are done. Unless in LAZYLOAD mode the whole tree
+is fetched with one request when the server offers the tree endpoint.
+*/
+function refreshCollections(vaultid, collections) {
+    var tree = LAZYLOAD ? Promise.resolve(null) : dataCall("getTree", [vaultid])
+    return tree.then(function (tree) {
+        if (tree) return applyTree(collections, tree)
+        return listCollections(vaultid, collections)
+    })
+}
+
+/* Re-list the collections in place with one request per collection and group. */
+function listCollections(vaultid, collections) {
+    return dataCall("getCollectionNames", [vaultid]).then(function (clist) {
+        var old = {}
+        for (var i=0; i < collections.length; i++) old[collections[i].name] = collections[i]
+        collections.splice(0, collections.length)
+        var loads = []
+        for (i=0; i< clist.length; i++) {
+            var collection = old[clist[i]] || newCollection(clist[i])
+            delete old[clist[i]]
+            collections.push(collection)
+            if (! LAZYLOAD || collection.loaded) loads.push(loadCollection(collections, collection))
+        }
+        for (var name in old) searchIndex.removeCollection(name)
+        return Promise.all(loads)
+    })
+}
 
-Vault list groups response looks similar to the following (groups=network, web)
-/ {"request_id":"5eec889b-4bd2-e309-a7be-e4a1265e37f4","lease_id":"","renewable":false,"lease_duration":0,"data":{"keys":["network/","web/"]},"wrap_info":null,"warnings":null,"auth":null}
+/* Replace the contents of the collections array with a tree from getTree. Existing
+collection objects are kept so that the navigation tree keeps its state. */
+function applyTree(collections, tree) {
+    var old = {}
+    for (var i=0; i < collections.length; i++) old[collections[i].name] = collections[i]
+    collections.splice(0, collections.length)
+    for (i=0; i < tree.length; i++) {
+        var collection = old[tree[i].name] || newCollection(tree[i].name)
+        delete old[tree[i].name]
+        collection.loading = false
+        collection.error = tree[i].error
+        if (! tree[i].error) {
+            collection.entries = tree[i].entries
+            collection.loaded = true
+            indexCollection(collection)
+        }
+        collections.push(collection)
+    }
+    for (var name in old) searchIndex.removeCollection(name)
+}
+
+/* Fill in the groups of a collection object when they arrive. The collection is
+removed from the collections array if it cannot be accessed. In LAZYLOAD mode only
+the group names are listed. Groups that were already loaded but arrive without
+their entries (LAZYLOAD groups, archive periods) keep their object and have their
+entries loaded again.
 */
-function getCollection(collectionpath) {
-    console.log('getCollection for %s',collectionpath);
-    var response = vaultGetRequest(VPWMGR +collectionpath+"?list=true");
-	if (! response) return null
-    var groupnames = response.data.keys;
-    var groups = []
-    for (var i=0; i< groupnames.length; i++) {
-        groups[i]= {};
-        groups[i].name = decodeURI(groupnames[i]);
-        groups[i].entries = [];
-        response = vaultGetRequest(VPWMGR +collectionpath+ groupnames[i] +"?list=true");
-        for (var j=0; j< response.data.keys.length; j++)
-	    groups[i].entries[j] = decodeURI(response.data.keys[j]);
+function loadCollection(collections, collection) {
+    collection.loading = true
+    collection.error = ""
+    var request = dataCall(LAZYLOAD ? "getGroupNames" : "getCollection", [collection.name])
+    return request.then(function (groups) {
+        collection.loading = false
+        if (! groups) {
+            var i = collections.indexOf(collection)
+            if (i >= 0) collections.splice(i, 1)
+            searchIndex.removeCollection(collection.name)
+            return
+        }
+        var loads = []
+        var old = {}
+        for (i=0; i < collection.entries.length; i++)
+            old[collection.entries[i].name] = collection.entries[i]
+        for (i=0; i < groups.length; i++) {
+            var group = old[groups[i].name]
+            if (! group || ! group.loaded || groups[i].loaded) continue
+            groups[i] = group
+            loads.push(loadGroup(collection, group))
+        }
+        collection.entries = groups
+        collection.loaded = true
+        indexCollection(collection)
+        console.log("Added collection %s", collection.name)
+        return Promise.all(loads)
+    }, function (err) {
+        collection.loading = false
+        collection.error = err.message
+    })
+}
+
+/* Fill in the entry names of a group object of a collection when they arrive. */
+function loadGroup(collection, group) {
+    group.loading = true
+    group.error = ""
+    return dataCall("getGroupEntries", [collection.name, group.name]).then(function (entries) {
+        // Archive periods are groups of their own, see expandArchive
+        var periods = entries.filter(function (e) { return e.slice(-1) === "/" })
+        entries = entries.filter(function (e) { return e.slice(-1) !== "/" })
+        group.loading = false
+        group.entries = entries
+        group.loaded = true
+        indexGroup(collection, group)
+        if (group.name === HISTGROUP +"/") addArchivePeriods(collection, periods)
+    }, function (err) {
+        group.loading = false
+        group.error = err.message
+    })
+}
+
+/* In LAZYLOAD mode the archive group is listed when it is opened rather than with
+the collection (see expandArchive). Add the period sub-groups found in it to the
+groups of the collection, to be loaded when opened in turn. */
+function addArchivePeriods(collection, periods) {
+    var groups = collection.entries
+    var names = groups.map(function (g) { return g.name })
+    for (var i=0; i < periods.length; i++) {
+        var name = HISTGROUP +"/"+ periods[i]
+        var j = sortedIndex(names, name)
+        if (names[j] === name) continue
+        names.splice(j, 0, name)
+        groups.splice(j, 0, newGroup(name))
+    }
+}
+
+/* Search index over the loaded entries of all collections (see search.js) */
+var searchIndex = new SearchIndex()
+
+/* Index the loaded groups of a collection, replacing what was indexed for it. */
+function indexCollection(collection) {
+    searchIndex.removeCollection(collection.name)
+    collection.titles = new Map()
+    for (var i=0; i < collection.entries.length; i++) {
+        var group = collection.entries[i]
+        if (group.loaded) indexGroup(collection, group)
     }
-    return groups;
+    collection.titlesVersion++
 }
 
-/* Takes group and entry name (e.g. group/entry) Returns object with details of a password entry.
+/* Index the entries of a loaded group, replacing what was indexed for it. */
+function indexGroup(collection, group) {
+    searchIndex.setGroup(collection.name, group.name, group.entries)
+    collection.titles.set(group.name, new Set(group.entries))
+    collection.titlesVersion++
+}
+
+/* Takes group and entry name (e.g. group/entry) Returns a promise for an object with
+details of a password entry, rejected when it cannot be read.
 Vault returns results similar to: {"request_id":"5a98b00a-24b6-4fc0-eec3-dd26f0118369","lease_id":"","renewable":false,"lease_duration":2764800,"data":{"notes":"Check email","password":"userpw","userid":"user"},"wrap_info":null,"warnings":null,"auth":null}
 */
 function getDetails(entrypath) {
     console.log('getDetails for %s',entrypath);
-    var response = vaultGetRequest(VPWMGR + entrypath);
-    var retdata = response.data
     var eidparts = entrypath.split("/")
-    retdata.groupid = eidparts[2]
-    retdata.title = eidparts[3]
-    return retdata
+    var gparts = eidparts[2] === HISTGROUP && eidparts.length > 4 ? 2 : 1
+    var groupid = eidparts.slice(2, 2 + gparts).join("/")
+    var title = eidparts.slice(2 + gparts).join("/")
+    var retdata = null
+    if (KV_VERSION === 2 && isArchive(groupid)) {
+        retdata = deletedDetails(eidparts.slice(0, 2).join("/") +"/", title)
+    } else {
+        retdata = cacheGet(entrypath)
+    }
+    var request = Promise.resolve(retdata)
+    if (! retdata) {
+        prefetchQueue.delete(entrypath)
+        request = readDetails(entrypath)
+    }
+    return request.then(function (data) {
+        data = Object.assign({}, data)
+        data.groupid = groupid
+        data.title = title
+        return data
+    })
+}
+
+/* Cache of entry details keyed by entry path. A Map iterates in insertion order and
+entries are re-inserted when used, so the first key is always the least recently
+used one. See DETAILCACHE_SIZE and DETAILCACHE_TTL in config.js. */
+var detailCache = new Map()
+
+/* Return cached details for an entry path or null if missing or expired. */
+function cacheGet(entrypath) {
+    var item = detailCache.get(entrypath)
+    if (! item) return null
+    detailCache.delete(entrypath)
+    if (Date.now() - item.time > DETAILCACHE_TTL*1000) return null
+    detailCache.set(entrypath, item)
+    return item.data
+}
+
+/* True if unexpired details of an entry path are cached. Unlike cacheGet this does
+not count as a use. */
+function cacheHas(entrypath) {
+    var item = detailCache.get(entrypath)
+    return item !== undefined && Date.now() - item.time <= DETAILCACHE_TTL*1000
+}
+
+/* Save entry details in the cache, evicting the least recently used entries. */
+function cachePut(entrypath, data) {
+    if (DETAILCACHE_SIZE <= 0) return
+    detailCache.delete(entrypath)
+    detailCache.set(entrypath, {data: data, time: Date.now()})
+    while (detailCache.size > DETAILCACHE_SIZE)
+        detailCache.delete(detailCache.keys().next().value)
+}
+
+/* Drop an entry path from the cache after it was changed in Vault. A read of it
+that is in flight is dropped too, its answer may predate the change. */
+function cacheInvalidate(entrypath) {
+    detailCache.delete(entrypath)
+    detailReads.delete(entrypath)
 }
 
-/* Write an entry to the vault (new or update)
+/* Forget all cached secrets. Used on logout and after IDLETIMEOUT. */
+function cacheClear() {
+    console.log('Clear entry details cache')
+    detailCache.clear()
+    prefetchQueue.clear()
+    detailReads.clear()
+    searchIndex.clearDetails()
+}
+
+/* Reads of entry details in flight keyed by entry path, each an object with a
+promise for the details. getDetails and prefetches share them. */
+var detailReads = new Map()
+
+/* Return a promise for the details of an entry read from Vault, rejected when it
+cannot be read. A read of the entry in flight is used rather than starting another.
+The answer is cached unless the entry was changed or the cache cleared meanwhile
+(see cacheInvalidate), then it may predate the change. */
+function readDetails(entrypath) {
+    var read = detailReads.get(entrypath)
+    if (read) return read.details
+    read = {}
+    detailReads.set(entrypath, read)
+    read.details = dataRequest("GET", kvPath("data", entrypath)).then(function (response) {
+        var current = detailReads.get(entrypath) === read
+        if (current) detailReads.delete(entrypath)
+        if (response.status !== 200) throw new Error(requestError(response.status))
+        var data = kvData(response.body)
+        if (current) {
+            cachePut(entrypath, data)
+            if (SEARCH_DETAILS) searchIndex.addDetails(entrypath, data)
+        }
+        return data
+    })
+    return read.details
+}
+
+/* Entry paths waiting to be prefetched, in order, and the number of prefetches in
+flight. See PREFETCH_LIMIT in config.js. */
+var prefetchQueue = new Map()
+var prefetchActive = 0
+var prefetchScheduled = false
+
+/* Queue the entries of a loaded group for prefetching into detailCache, replacing
+what was queued for another group: the group the user turned to last is the one
+likely to be clicked. Entries that are cached or being read are left out, without
+changing the order in which cached entries are evicted. Archive groups are not
+prefetched. */
+function prefetchGroup(collectionid, group) {
+    if (PREFETCH_LIMIT <= 0 || DETAILCACHE_SIZE <= 0 || ! group.loaded) return
+    if (isArchive(group.name.slice(0, -1))) return
+    prefetchQueue.clear()
+    var count = Math.min(group.entries.length, PREFETCH_LIMIT, DETAILCACHE_SIZE)
+    for (var i=0; i < count; i++) {
+        var path = collectionid + group.name + group.entries[i]
+        if (! detailReads.has(path) && ! cacheHas(path)) prefetchQueue.set(path, true)
+    }
+    schedulePrefetch()
+}
+
+/* Run runPrefetch when the browser is idle, unless it is already waiting to. */
+function schedulePrefetch() {
+    if (prefetchScheduled || prefetchQueue.size === 0) return
+    prefetchScheduled = true
+    if (window.requestIdleCallback) window.requestIdleCallback(runPrefetch)
+    else setTimeout(runPrefetch, 50)
+}
+
+/* Start prefetches up to PREFETCH_REQUESTS in flight. Requests of the page wait in
+requestQueue only when all MAXREQUESTS slots are taken, so prefetches are only
+started while none wait and a slot is free. When dataWorker runs, the requests are
+queued there instead, and prefetches wait until the only calls it has outstanding
+are prefetches. That way they never hold up what the user asked for, and details
+read by displayEntry (see getDetails) do not queue. */
+function runPrefetch() {
+    prefetchScheduled = false
+    if (requestQueue.length > 0 || requestsActive >= MAXREQUESTS) return schedulePrefetch()
+    if (Object.keys(workerCalls).length > prefetchActive) return schedulePrefetch()
+    while (prefetchActive < PREFETCH_REQUESTS && prefetchQueue.size > 0) {
+        var path = prefetchQueue.keys().next().value
+        prefetchQueue.delete(path)
+        if (! detailReads.has(path)) prefetchEntry(path)
+    }
+}
+
+/* Read the details of an entry into detailCache (see readDetails). getDetails uses
+the read if the entry is clicked meanwhile. */
+function prefetchEntry(entrypath) {
+    function done() {
+        prefetchActive -= 1
+        schedulePrefetch()
+    }
+    prefetchActive += 1
+    readDetails(entrypath).then(done, done)
+}
+
+/* Idle timer for clearing cached secrets when the user has walked away. */
+var idleTimer = null
+
+/* Restart the idle timer. Called on user activity. */
+function touchIdleTimer() {
+    if (idleTimer) clearTimeout(idleTimer)
+    idleTimer = null
+    if (IDLETIMEOUT > 0) idleTimer = setTimeout(cacheClear, IDLETIMEOUT*1000)
+}
+document.addEventListener('mousedown', touchIdleTimer)
+document.addEventListener('keydown', touchIdleTimer)
+
+/* The secret data of an entry from the form fields, or from the o_ fields with the
+values the entry was loaded with when old is set. */
+function entryData(obj, old) {
+    var p = old ? "o_" : ""
+    return {url: obj[p+"url"], userid: obj[p+"userid"], password: obj[p+"password"],
+            notes: obj[p+"notes"], changed: obj.changed, pwChanged: obj.pwChanged}
+}
+
+/* Write an entry to the vault (new or update). Returns a promise for the HTTP status.
 */
 function writeEntry(obj) {
-    var data = new Object()
-    data.url = obj.url
-    data.userid = obj.userid
-    data.password = obj.password
-    data.notes = obj.notes
-    data.changed = obj.changed
-    data.pwChanged = obj.pwChanged
+    var data = entryData(obj)
     var path = obj.collectionid + obj.groupid +'/'+ obj.title
-    vaultPostRequest(VPWMGR + path, data)
+    cacheInvalidate(path)
+    return dataRequest("POST", kvPath("data", path), KV_VERSION === 2 ? {data: data} : data)
+    .then(function (response) { return response.status })
 }
 
-/* Delete a vault entry */
+/* Delete a vault entry. Returns a promise for the HTTP status. */
 function deleteEntry(entrypath) {
     console.log('deleteEntry for %s',entrypath);
-    return vaultDeleteRequest(VPWMGR + entrypath)
+    cacheInvalidate(entrypath)
+    return dataRequest("DELETE", kvPath("data", entrypath))
+    .then(function (response) { return response.status })
 }
 
 /* Archive an entry that the user has requested to be deleted. Saved the entry in
-archive area where it can be permanently deleted or accessed for restoration. */
+archive area where it can be permanently deleted or accessed for restoration.
+Returns a promise for an object with the HTTP status and the group and title of the
+archive entry. */
 function archiveOldEntry(obj) {
-    var data = {}
-    data.url = obj.o_url
-    data.userid = obj.o_userid
-    data.password = obj.o_password
-    data.notes = obj.o_notes
-    data.changed = obj.changed
-    data.pwChanged = obj.pwChanged
-	
-    var timestamp = new Date().toISOString().replace(/[^0-9]/g,"")
-    var path = obj.collectionid + HISTGROUP +"/"+
-        obj.o_groupid +"|"+ obj.o_title +"|"+ timestamp.slice(0,14)
+    var archive = archiveName(obj.o_groupid, obj.o_title)
+    var path = obj.collectionid + archive.groupid +"/"+ archive.title
 	console.log("Create archive entry: %s", path)
-    vaultPostRequest(VPWMGR + path, data)
+    cacheInvalidate(path)
+    return dataRequest("POST", VPWMGR + path, entryData(obj, true)).then(function (response) {
+        archive.status = response.status
+        return archive
+    })
+}
+
+/* The archive group and title for a copy of an entry made now */
+function archiveName(groupid, title) {
+    var timestamp = new Date().toISOString().replace(/[^0-9]/g,"")
+    return {groupid: archiveGroup(timestamp), title: groupid +"|"+ title +"|"+ timestamp.slice(0,14)}
+}
+
+/* Save the form of an existing entry as an update, move, rename or overwrite of
+another entry, without blocking. With KV_VERSION 1 the archive copy of the old entry
+and the entry under its new name are written in parallel, and the old name is only
+deleted once both are written. When a step fails the steps already done are undone,
+so that the entry and the archive are left as they were. A moved entry is only saved
+over an existing one with overwrite set, otherwise nothing is changed and exists is
+set in the result.
+Returns a promise for an object with the HTTP status of the failed step (or the last
+one), the new data, the archive group and title of the copy (KV_VERSION 1) and, for a
+failed save, whether it was undone. */
+function saveEntry(obj, overwrite) {
+    var path = obj.collectionid + obj.groupid +"/"+ obj.title
+    var oldpath = obj.collectionid + obj.o_groupid +"/"+ obj.o_title
+    var moved = path !== oldpath
+    var olddata = entryData(obj, true)
+    var data = entryData(obj)
+    data.changed = currentTime()
+    if (obj.o_password !== obj.password) data.pwChanged = data.changed
+    cacheInvalidate(path)
+    cacheInvalidate(oldpath)
+    if (KV_VERSION === 2) return saveVersion(obj.collectionid, path, oldpath, data, overwrite)
+
+    var archive = archiveName(obj.o_groupid, obj.o_title)
+    var archivepath = VPWMGR + obj.collectionid + archive.groupid +"/"+ archive.title
+    function result(status, undone) {
+        return {status: status, data: data, archive: archive, undone: undone}
+    }
+    // Put the new path back the way it was: the old data for an update in place,
+    // the data of the entry found there or nothing for a move
+    function undo(status, archived, written, previous) {
+        var steps = []
+        if (archived) steps.push(dataRequest("DELETE", archivepath))
+        if (written && previous) steps.push(dataRequest("POST", kvPath("data", path), previous))
+        if (written && ! previous) steps.push(dataRequest("DELETE", kvPath("data", path)))
+        return Promise.all(steps).then(function (responses) {
+            return result(status, responses.every(function (r) { return okStatus(r.status) }))
+        })
+    }
+
+    // An entry under the new name is read first so that it can be put back, the
+    // form may not know of it (another session, a group not loaded yet)
+    var before = moved ? dataRequest("GET", kvPath("data", path)) : Promise.resolve(null)
+    return before.then(function (response) {
+        if (response && response.status !== 200 && response.status !== 404)
+            return result(response.status, true)
+        if (response && response.status === 200 && ! overwrite)
+            return {status: 409, data: data, archive: null, undone: true, exists: true}
+        var previous = ! moved ? olddata : response && response.status === 200 ? kvData(response.body) : null
+        return Promise.all([
+            dataRequest("POST", archivepath, olddata),
+            dataRequest("POST", kvPath("data", path), data),
+        ]).then(function (responses) {
+            var archived = okStatus(responses[0].status)
+            var written = okStatus(responses[1].status)
+            if (! archived || ! written)
+                return undo(archived ? responses[1].status : responses[0].status, archived, written, previous)
+            if (! moved) return result(responses[1].status)
+            return dataRequest("DELETE", kvPath("data", oldpath)).then(function (response) {
+                if (okStatus(response.status)) return result(response.status)
+                return undo(response.status, true, true, previous)
+            })
+        })
+    })
+}
+
+/* saveEntry with KV_VERSION 2. The new data is a new version. A moved entry is then
+soft deleted under its old name, which the new name's metadata points to, and recorded
+in DELETED_SECRET. If the soft delete fails the new name is put back as it was: its
+metadata is removed if it had none, otherwise its previous version is written again
+(or the new one deleted if the previous one was) and its custom metadata restored. */
+function saveVersion(collectionid, path, oldpath, data, overwrite) {
+    function result(status, undone) {
+        return {status: status, data: data, archive: null, undone: undone}
+    }
+    if (path === oldpath) {
+        return dataRequest("POST", kvPath("data", path), {data: data}).then(function (response) {
+            return okStatus(response.status) ? result(response.status) : result(response.status, true)
+        })
+    }
+    var key = path.slice(collectionid.length)
+    var oldkey = oldpath.slice(collectionid.length)
+    return Promise.all([
+        dataRequest("GET", kvPath("data", path)),
+        dataRequest("GET", kvPath("metadata", path)),
+    ]).then(function (before) {
+        for (var i=0; i < before.length; i++) {
+            if (before[i].status !== 200 && before[i].status !== 404) return result(before[i].status, true)
+        }
+        if (before[0].status === 200 && ! overwrite)
+            return {status: 409, data: data, archive: null, undone: true, exists: true}
+        var previous = before[0].status === 200 ? kvData(before[0].body) : null
+        var custom = before[1].status === 200 ? before[1].body.data.custom_metadata || {} : null
+
+        function undo(status, version) {
+            var steps = []
+            if (! custom) {
+                steps.push(dataRequest("DELETE", kvPath("metadata", path)))
+            } else {
+                if (previous) steps.push(dataRequest("POST", kvPath("data", path), {data: previous}))
+                else steps.push(dataRequest("POST", kvPath("delete", path), {versions: [version]}))
+                steps.push(dataRequest("POST", kvPath("metadata", path), {custom_metadata: custom}))
+            }
+            return Promise.all(steps).then(function (responses) {
+                return result(status, responses.every(function (r) { return okStatus(r.status) }))
+            })
+        }
+
+        return dataRequest("POST", kvPath("data", path), {data: data}).then(function (response) {
+            if (! okStatus(response.status)) return result(response.status, true)
+            return Promise.all([
+                dataRequest("POST", kvPath("metadata", path), {custom_metadata: {previous: oldkey}}),
+                dataRequest("DELETE", kvPath("data", oldpath)),
+            ]).then(function (responses) {
+                var status = responses[1].status
+                if (! okStatus(status)) return undo(status, response.body.data.version)
+                var record = {deleted: data.changed, moved_to: key}
+                return updateDeleted(collectionid, function (entries) { entries[oldkey] = record })
+                .then(function (status) { return result(status, false) })
+            })
+        })
+    })
+}
+
+/* Return the "<group>/<title>" of the deleted entry shown in the archive group by
+the given title, or null. */
+function deletedKey(collectionid, title) {
+    var deleted = deletedEntries[collectionid] || {}
+    for (var key in deleted) {
+        if (deleted[key].title === title) return key
+    }
+    return null
+}
+
+/* Details to show for an entry in the archive group. Deleted versions cannot be read
+until they are undeleted. */
+function deletedDetails(collectionid, title) {
+    var key = deletedKey(collectionid, title)
+    var deleted = key ? deletedEntries[collectionid][key].deleted : ""
+    return {url: "", userid: "", password: "", notes: "", changed: deleted, pwChanged: "",
+            deleted: deleted}
+}
+
+/* Change the DELETED_SECRET records of a collection with change(entries). The write
+uses check-and-set, so if another session changed them meanwhile it is tried again
+with their changes. Returns a promise for the HTTP status. */
+function updateDeleted(collectionid, change) {
+    var path = kvPath("data", collectionid + DELETED_SECRET)
+    function attempt(tries) {
+        return dataRequest("GET", path).then(function (response) {
+            if (response.status !== 200 && response.status !== 404) return response.status
+            var entries = response.status === 200 ? response.body.data.data : {}
+            var version = response.status === 200 ? response.body.data.metadata.version : 0
+            change(entries)
+            return dataRequest("POST", path, {options: {cas: version}, data: entries}).then(function (response) {
+                if (response.status === 400 && tries > 1) return attempt(tries - 1)
+                if (okStatus(response.status)) {
+                    deletedEntries[collectionid] = entries
+                    var update = {}
+                    update[collectionid] = entries
+                    if (dataWorker) dataWorker.postMessage({deleted: update})
+                }
+                return response.status
+            })
+        })
+    }
+    return attempt(3)
+}
+
+/* Soft delete an entry and record it in DELETED_SECRET, so that it is shown in the
+archive group. Moved entries are soft deleted by saveVersion.
+Returns a promise for an object with the HTTP status and the title in the archive group. */
+function softDeleteEntry(collectionid, groupid, title) {
+    return deleteEntry(collectionid + groupid +"/"+ title).then(function (status) {
+        if (! okStatus(status)) return {status: status}
+        var record = {deleted: currentTime(), title: archiveName(groupid, title).title}
+        return updateDeleted(collectionid, function (entries) { entries[groupid +"/"+ title] = record })
+        .then(function (status) { return {status: status, title: record.title} })
+    })
+}
+
+/* Undelete the latest version of an entry shown in the archive group. Returns a
+promise for an object with the HTTP status and the group and title of the restored entry. */
+function undeleteEntry(collectionid, title) {
+    var key = deletedKey(collectionid, title)
+    if (! key) return Promise.resolve({status: 404})
+    return dataRequest("GET", kvPath("metadata", collectionid + key)).then(function (response) {
+        if (response.status !== 200) return {status: response.status}
+        return dataRequest("POST", kvPath("undelete", collectionid + key),
+                            {versions: [response.body.data.current_version]})
+    }).then(function (response) {
+        if (! okStatus(response.status)) return {status: response.status}
+        return updateDeleted(collectionid, function (entries) { delete entries[key] }).then(function (status) {
+            var i = key.indexOf("/")
+            return {status: status, groupid: key.slice(0, i), title: key.slice(i+1)}
+        })
+    })
+}
+
+/* Delete an entry shown in the archive group with all of its versions for good.
+Returns a promise for the HTTP status. */
+function destroyEntry(collectionid, title) {
+    var key = deletedKey(collectionid, title)
+    if (! key) return Promise.resolve(404)
+    cacheInvalidate(collectionid + key)
+    return dataRequest("DELETE", kvPath("metadata", collectionid + key)).then(function (response) {
+        if (! okStatus(response.status)) return response.status
+        return updateDeleted(collectionid, function (entries) { delete entries[key] })
+    })
+}
+
+/* Return a promise for the versions of an entry, newest first, followed by those kept
+under the names it had before it was moved or renamed. Each is an object with an id,
+the entry path, the version number, a label for display and whether it can be read. */
+function getHistory(entrypath) {
+    var collectionid = entrypath.split("/").slice(0, 2).join("/") +"/"
+    var history = []
+    var seen = {}
+    function next(entrypath) {
+        if (! entrypath || seen[entrypath]) return Promise.resolve(history)
+        seen[entrypath] = true
+        return dataRequest("GET", kvPath("metadata", entrypath)).then(function (response) {
+            if (response.status !== 200) return history
+            var versions = response.body.data.versions
+            var numbers = Object.keys(versions).map(Number).sort(function (a, b) { return b - a })
+            for (var i=0; i < numbers.length; i++) {
+                var v = versions[numbers[i]]
+                var readable = ! v.deletion_time && ! v.destroyed
+                var label = "v"+ numbers[i] +" "+ v.created_time.slice(0,16).replace("T", " ")
+                if (history.length && history[0].path !== entrypath)
+                    label += " "+ entrypath.slice(collectionid.length)
+                if (! readable) label += " (deleted)"
+                history.push({id: entrypath +"@"+ numbers[i], path: entrypath,
+                              version: numbers[i], label: label, readable: readable})
+            }
+            var custom = response.body.data.custom_metadata
+            return next(custom && custom.previous ? collectionid + custom.previous : null)
+        })
+    }
+    return next(entrypath)
+}
+
+/* Return a promise for the data of a version of an entry, null if it cannot be read. */
+function getVersion(entrypath, version) {
+    return dataRequest("GET", kvPath("data", entrypath) +"?version="+ version).then(function (response) {
+        return response.status === 200 ? kvData(response.body) : null
+    })
+}
+
+/* True if an HTTP status is a success */
+function okStatus(status) {
+    return status >= 200 && status < 300
+}
+
+/* Return the collection object with the given name or null. */
+function findCollection(collections, name) {
+    for (var i=0; i < collections.length; i++) {
+        if (collections[i].name === name) return collections[i]
+    }
+    return null
+}
+
+/* Add an entry title to the navigation tree after it has been written to Vault.
+The group is created when needed. Collections and groups that have not been
+loaded yet (LAZYLOAD mode) are left alone, they will be listed when opened. */
+function treeAddEntry(collections, collectionid, groupid, title) {
+    var collection = findCollection(collections, collectionid)
+    if (! collection || ! collection.loaded) return
+    var groups = collection.entries
+    var gname = groupid +"/"
+    var names = groups.map(function (g) { return g.name })
+    var i = sortedIndex(names, gname)
+    if (names[i] !== gname) {
+        var group = newGroup(gname)
+        group.loaded = true
+        group.entries.push(title)
+        groups.splice(i, 0, group)
+        indexGroup(collection, group)
+        return
+    }
+    if (! groups[i].loaded) return
+    var entries = groups[i].entries
+    var j = sortedIndex(entries, title)
+    if (entries[j] !== title) entries.splice(j, 0, title)
+    searchIndex.add(collectionid, gname, title)
+    collection.titles.get(gname).add(title)
+    collection.titlesVersion++
+}
+
+/* Remove an entry title from the navigation tree after it has been deleted from
+Vault. A loaded group is dropped when its last entry is removed, as Vault does. */
+function treeRemoveEntry(collections, collectionid, groupid, title) {
+    var collection = findCollection(collections, collectionid)
+    if (! collection || ! collection.loaded) return
+    var groups = collection.entries
+    for (var i=0; i < groups.length; i++) {
+        if (groups[i].name !== groupid +"/") continue
+        if (! groups[i].loaded) return
+        var j = groups[i].entries.indexOf(title)
+        if (j >= 0) groups[i].entries.splice(j, 1)
+        searchIndex.remove(collectionid, groupid +"/", title)
+        collection.titles.get(groups[i].name).delete(title)
+        if (groups[i].entries.length === 0) {
+            collection.titles.delete(groups[i].name)
+            groups.splice(i, 1)
+        }
+        collection.titlesVersion++
+        return
+    }
 }
 
 
@@ -234,6 +870,8 @@ function clearAllFields(obj) {
 	obj.changed="";
 	obj.error="";
 	obj.showPW=false;
+	obj.history=[];
+	obj.version="";
 }
 
 
@@ -249,16 +887,18 @@ Vue.component('authentication', {
     template: "#login-template",
     methods: {
 	    login: function () {
+            var self = this
 	        window.vaultid = this.vaultid;
-	        window.userToken = passwordAuthenticate(this.vaultid, this.pass)
-	        console.log("window.userToken=%s", window.userToken);
-	        if (window.userToken === "") {
-		        this.error = "Bad Login information";
-	        }
-	        else {
-                this.error=""
-		        this.$emit('auth-done')
-	        }
+	        passwordAuthenticate(this.vaultid, this.pass).then(function (token) {
+	            window.userToken = token
+	            if (token === "") {
+		            self.error = "Bad Login information";
+	            }
+	            else {
+                    self.error=""
+		            self.$emit('auth-done')
+	            }
+	        })
 	    }
     }
 })
@@ -271,7 +911,6 @@ Vue.component('pwmgr', {
     data: function () {
 	    return {
 			collections: [],
-			groups: [],
             collectionid: "",
             o_collectionid: "",
 	        groupid: "",
@@ -290,13 +929,22 @@ Vue.component('pwmgr', {
 	        changed: "",
 	        error: "",
 	        showPW: false,
-			updateType: "Update",
+	        query: "",
+	        indexVersion: 0,
+	        history: [],
+	        version: "",
+	        saving: false,
+	        displaying: "",
+	        debugPanel: DEBUG_PANEL,
 	    }
     },
 
     // Populate the navigation tree with the user's groups. Enable the event hub.
     created: function () {
 	    eventHub.$on('displayEntry', this.displayEntry)
+	    eventHub.$on('openCollection', this.openCollection)
+	    var self = this
+	    searchIndex.onchange = function () { self.indexVersion++ }
 		this.collections = getCollections(window.vaultid)
         this.collectionid = "user/"+ window.vaultid +"/"
     },
@@ -304,56 +952,113 @@ Vue.component('pwmgr', {
     // Disable the event hub.
     beforeDestroy: function () {
 	    eventHub.$off('displayEntry', this.displayEntry)
+	    eventHub.$off('openCollection', this.openCollection)
+	    searchIndex.onchange = null
+    },
+
+    computed: {
+        // Entries matching the search box, best first. indexVersion changes with the index.
+        searchResults: function () {
+            return this.indexVersion >= 0 ? searchIndex.search(this.query, SEARCH_RESULTS) : []
+        },
+
+        // 'true' if an entry with the same group/title exists in the form's collection.
+        // titlesVersion changes with the titles of the collection.
+        entryExists: function () {
+            var collection = findCollection(this.collections, this.collectionid)
+            if (! collection || collection.titlesVersion < 0) return false
+            var titles = collection.titles.get(this.groupid +"/")
+            return titles !== undefined && titles.has(this.title)
+        },
+
+        // Determine if currently shown entry can be deleted (display delete button)
+        showDelete: function () {
+            return (this.o_groupid!=="" && this.o_title!=="" &&
+                    this.groupid!=="" && this.title!=="")
+        },
+
+        // Determine if the Undelete button should be displayed (KV_VERSION 2)
+        showUndelete: function () {
+            return KV_VERSION === 2 && isArchive(this.o_groupid) && this.o_title !== ""
+        },
+
+        // Determine if "New entry" button should be displayed
+        showNew: function () {
+            return (this.groupid!=="" && this.title!=="" && !this.entryExists)
+        },
+
+        // The kind of change the Update button makes, also its label. Moving or
+        // renaming onto an existing entry overwrites it.
+        updateType: function () {
+            var moved = this.o_groupid!==this.groupid || this.o_title!==this.title
+            if (moved && this.entryExists) return "Overwrite existing!"
+            if (this.o_groupid!==this.groupid && this.o_title===this.title) return "Move"
+            if (this.o_groupid===this.groupid && this.o_title!==this.title) return "Rename"
+            return "Update"
+        },
+
+        // Determine if Update button should be displayed.
+        showUpdate: function () {
+            if (isArchive(this.groupid)) return false
+            if (this.updateType !== "Update") return true
+            return (this.o_url !== this.url || this.o_userid !== this.userid ||
+                    this.o_password !== this.password || this.o_notes !== this.notes)
+        },
+    },
+
+    watch: {
+        groupid: function () { this.loadFormGroup() },
+        collectionid: function () { this.loadFormGroup() },
     },
 
 
     methods: {
 	submit: function () {}, /* Dummy, just ignore submit request */
 
-	/* Return 'true' if an entry with the same group/title exists in this collection*/
-	entryExists: function () {
-		var gid= this.groupid +"/";
-		for (i=0; i < this.groups.length; i++) {
-			if (this.groups[i].name !== gid) continue;
-			for (j=0; j < this.groups[i].entries.length; j++) {
-				if (this.groups[i].entries[j] === this.title) return true;
-			}
+	// Load the groups of a collection the first time it is opened (LAZYLOAD mode)
+	openCollection: function (collection) {
+		if (collection.loaded || collection.loading) return
+		loadCollection(this.collections, collection).then(this.loadFormGroup)
+	},
+
+	/* In LAZYLOAD mode make sure the group named in the form has been loaded, so
+	that existing entries are recognized before anything is written. */
+	loadFormGroup: function () {
+		if (! LAZYLOAD) return
+		var collection = null
+		for (var i=0; i < this.collections.length; i++) {
+			if (this.collections[i].name === this.collectionid) collection = this.collections[i]
+		}
+		if (! collection) return
+		if (! collection.loaded) {
+			this.openCollection(collection)
+			return
+		}
+		var gid = this.groupid +"/"
+		for (i=0; i < collection.entries.length; i++) {
+			var group = collection.entries[i]
+			if (group.name === gid && ! group.loaded && ! group.loading)
+				loadGroup(collection, group)
 		}
-		return false;
 	},
 
-	// Determine if currently shown entry can be deleted (display delete button)
-	showDelete: function () {
-		return (this.o_groupid!=="" && this.o_title!=="" &&
-			   this.groupid!=="" && this.title!=="")
+	// The "Refresh" button implementation. Reload what is shown in the navigation tree.
+	refresh: function () {
+		refreshCollections(window.vaultid, this.collections)
 	},
 
-	// Determine if "New entry" button should be displayed
-	showNew: function () {
-	    return (this.groupid!=="" && this.title!=="" &&
-				!this.entryExists())
+	/* A write to Vault failed part way. Show the error and reload the navigation
+	tree, since it can no longer be patched with confidence. undone is set when the
+	steps done before the failure were undone. */
+	writeFailed: function (status, undone) {
+		this.error = "Save failed: "+ requestError(status) + (undone ? ", nothing was changed" : "")
+		this.refresh()
 	},
 
-	// Determine if Update button should be displayed.
-	showUpdate: function () {
-		this.updateType="Update"
-		if (this.groupid === HISTGROUP) return false
-		if (this.o_groupid!==this.groupid && this.o_title===this.title) {
-			this.updateType="Move"
-			return true
-		}
-		if (this.o_groupid===this.groupid && this.o_title!==this.title) {
-			this.updateType="Rename"
-			return true
-		}
-		if (this.o_groupid!==this.groupid && this.o_title!==this.title) {
-			if (this.entryExists()) {
-				this.updateType="Overwrite existing!"
-				return true
-			}
-		}
-		return (this.o_url !== this.url || this.o_userid !== this.userid ||
-				this.o_password !== this.password || this.o_notes !== this.notes)
+	// True if the form shows the given entry. It may show another one by the time a
+	// request made for an entry is answered.
+	shows: function (collectionid, groupid, title) {
+		return this.collectionid === collectionid && this.groupid === groupid && this.title === title
 	},
 
 	// The "Clear fields" button implementation
@@ -373,18 +1078,112 @@ Vue.component('pwmgr', {
 		var entrypath= this.collectionid + this.groupid +"/"+ this.title
         var entryname= this.groupid +"/"+ this.title
 		console.log("Delete entry:"+ entrypath);
-		if (this.entryExists()) {
-			if (this.groupid !== HISTGROUP) archiveOldEntry(this)
-			deleteEntry(entrypath);
-			this.collections = getCollections(window.vaultid)
-			clearAllFields(this)
-		    this.error= "Deleted entry "+ entryname
+		if (this.entryExists && KV_VERSION === 2) {
+			var self = this
+			return this.deleteVersioned().then(function (done) {
+				if (done) self.error= "Deleted entry "+ entryname
+			})
+		}
+		else if (this.entryExists) {
+			var self = this
+			var collectionid = this.collectionid, groupid = this.groupid, title = this.title
+			var archived = isArchive(groupid) ? Promise.resolve(null) : archiveOldEntry(this)
+			return archived.then(function (archived) {
+				if (archived) {
+					if (! okStatus(archived.status)) return self.writeFailed(archived.status)
+					treeAddEntry(self.collections, collectionid, archived.groupid, archived.title)
+				}
+				return deleteEntry(entrypath).then(function (status) {
+					if (! okStatus(status)) return self.writeFailed(status)
+					treeRemoveEntry(self.collections, collectionid, groupid, title)
+					if (self.shows(collectionid, groupid, title)) clearAllFields(self)
+					self.error= "Deleted entry "+ entryname
+				})
+			})
 		}
 		else {
 		    this.error= "Entry does not exist:"+ entrypath
 		}
 	},
 
+	/* Delete with KV_VERSION 2. An entry is soft deleted and shown in the archive
+	group, from where it can be undeleted or deleted for good. Returns a promise for
+	true when done. */
+	deleteVersioned: function () {
+		var self = this
+		var collectionid = this.collectionid, groupid = this.groupid, title = this.title
+		var done
+		if (isArchive(groupid)) {
+			done = destroyEntry(collectionid, title).then(function (status) { return {status: status} })
+		} else {
+			done = softDeleteEntry(collectionid, groupid, title)
+		}
+		return done.then(function (deleted) {
+			if (! okStatus(deleted.status)) return self.writeFailed(deleted.status)
+			if (deleted.title) treeAddEntry(self.collections, collectionid, HISTGROUP, deleted.title)
+			treeRemoveEntry(self.collections, collectionid, groupid, title)
+			if (self.shows(collectionid, groupid, title)) clearAllFields(self)
+			return true
+		})
+	},
+
+	// Restore the deleted entry shown from the archive group (KV_VERSION 2)
+	undelete: function () {
+		var self = this
+		var collectionid = this.collectionid, title = this.o_title
+		return undeleteEntry(collectionid, title).then(function (restored) {
+			if (! okStatus(restored.status)) return self.writeFailed(restored.status)
+			treeRemoveEntry(self.collections, collectionid, HISTGROUP, title)
+			treeAddEntry(self.collections, collectionid, restored.groupid, restored.title)
+			self.displayEntry(collectionid, restored.groupid +"/"+ restored.title)
+			self.error = "Restored entry "+ restored.groupid +"/"+ restored.title
+		})
+	},
+
+	/* With KV_VERSION 2 an entry may be saved under the name of a deleted one. It then
+	carries on its version history and is no longer shown in the archive group. */
+	forgetDeleted: function (collectionid, groupid, title) {
+		var self = this
+		var key = groupid +"/"+ title
+		var record = (deletedEntries[collectionid] || {})[key]
+		if (! record) return Promise.resolve()
+		return updateDeleted(collectionid, function (entries) { delete entries[key] }).then(function (status) {
+			if (! okStatus(status)) return self.writeFailed(status)
+			if (record.title) treeRemoveEntry(self.collections, collectionid, HISTGROUP, record.title)
+		})
+	},
+
+	// Show the version history of the entry in the form once it is read (KV_VERSION 2)
+	loadHistory: function (collectionid, groupid, title) {
+		var self = this
+		return getHistory(collectionid + groupid +"/"+ title).then(function (history) {
+			if (! self.shows(collectionid, groupid, title)) return
+			self.history = history
+			self.version = history.length ? history[0].id : ""
+		})
+	},
+
+	// Fill the form with the version chosen from the history (KV_VERSION 2). Saving
+	// it with Update makes it the current version again.
+	showVersion: function () {
+		var self = this
+		var chosen = this.history.filter(function (v) { return v.id === self.version })[0]
+		if (! chosen) return
+		return getVersion(chosen.path, chosen.version).then(function (data) {
+			// Another version may have been chosen meanwhile
+			if (self.version !== chosen.id) return
+			if (! data) {
+				self.error = "Version "+ chosen.version +" cannot be read"
+				return
+			}
+			self.url = data.url
+			self.userid = data.userid
+			self.password = data.password
+			self.notes = data.notes
+			self.error = chosen === self.history[0] ? "" : "Showing "+ chosen.label +", Update to restore it"
+		})
+	},
+
 	// Add a new entry to PW vault
 	addnew: function () {
 	    console.log("Add entry");
@@ -397,7 +1196,7 @@ Vue.component('pwmgr', {
 		    return;
 	    }
 	    if (!(this.o_groupid===this.groupid && this.o_title===this.title)) {
-		    if (this.entryExists()) {
+		    if (this.entryExists) {
 		        console.log('Duplicate Entry');
 		        this.error= "Duplicate Entry (group/title)"
 		    }
@@ -407,20 +1206,28 @@ Vue.component('pwmgr', {
 	    }
         var d = currentTime()
         this.changed = d
-        console.log("o_password="+ this.o_password +" curPW="+ this.password)
         if (this.o_password !== this.password) this.pwChanged = d
-	    writeEntry(this)
-		this.collections = getCollections(window.vaultid)
-		this.o_groupid = this.groupid;
-		this.o_title = this.title;
-		this.o_url = this.url;
-		this.o_userid = this.userid;
-		this.o_password = this.password;
-		this.o_notes = this.notes;
-		this.showPW = false;
+		var self = this
+		var collectionid = this.collectionid
+		var groupid = this.groupid, title = this.title
+		var saved = {url: this.url, userid: this.userid, password: this.password, notes: this.notes}
+	    return writeEntry(this).then(function (status) {
+			if (! okStatus(status)) return self.writeFailed(status)
+			treeAddEntry(self.collections, collectionid, groupid, title)
+			if (KV_VERSION === 2) self.forgetDeleted(collectionid, groupid, title)
+			if (! self.shows(collectionid, groupid, title)) return
+			self.o_groupid = groupid;
+			self.o_title = title;
+			self.o_url = saved.url;
+			self.o_userid = saved.userid;
+			self.o_password = saved.password;
+			self.o_notes = saved.notes;
+			self.showPW = false;
+		})
 	},
 
-	// Update a PW vault entry
+	/* Update a PW vault entry. The save runs in the background (see saveEntry), the
+	form can be used meanwhile. Returns a promise that resolves when it is done. */
 	update: function () {
 	    console.log("Update the entry");
 	    if (!okGroupid(this.groupid)) {
@@ -432,36 +1239,51 @@ Vue.component('pwmgr', {
 		    return;
 	    }
 
-		archiveOldEntry(this)
-
-		// If either groupid or the title changed, then delete the old entry
-		if (this.o_groupid!==this.groupid || this.o_title!==this.title) {
-			var entrypath = this.collectionid + this.o_groupid +"/"+ this.o_title
-		    console.log('Deleting Old Entry %s',entrypath);
-			deleteEntry(entrypath);
-		}
-
 		var ename=this.groupid +"/"+ this.title;
-		if (this.updateType ==="Move") this.error="Moved entry to "+ename;
-		else if (this.updateType ==="Rename") this.error="Renamed entry to "+ename;
-		else if (this.updateType ==="Overwrite existing!") this.error="Overwrote entry "+ename;
-		else this.error="Updated entry "+ename;
+		var message
+		if (this.updateType ==="Move") message="Moved entry to "+ename;
+		else if (this.updateType ==="Rename") message="Renamed entry to "+ename;
+		else if (this.updateType ==="Overwrite existing!") message="Overwrote entry "+ename;
+		else message="Updated entry "+ename;
 
-        var d = currentTime()
-        this.changed = d
-        console.log("o_password="+ this.o_password +" curPW="+ this.password)
-        if (this.o_password !== this.password) this.pwChanged = d
-	    writeEntry(this)
-		// TODO Might be able to make this conditional
-        this.collections = getCollections(window.vaultid)
-		this.o_collectionid = this.collectionid;
-		this.o_groupid = this.groupid;
-		this.o_title = this.title;
-		this.o_url = this.url;
-		this.o_userid = this.userid;
-		this.o_password = this.password;
-		this.o_notes = this.notes;
-		this.showPW = false;
+		var self = this
+		var collectionid = this.collectionid
+		var groupid = this.groupid, title = this.title
+		var o_groupid = this.o_groupid, o_title = this.o_title
+		var saved = {url: this.url, userid: this.userid, password: this.password, notes: this.notes}
+		this.saving = true
+		this.error = "Saving "+ ename
+		return saveEntry(this, this.updateType === "Overwrite existing!").then(function (result) {
+			self.saving = false
+			if (result.exists) {
+				// Known now, the form offers to overwrite it
+				treeAddEntry(self.collections, collectionid, groupid, title)
+				self.error = "Entry "+ ename +" exists, nothing was changed"
+				return
+			}
+			if (! okStatus(result.status)) return self.writeFailed(result.status, result.undone)
+			if (result.archive)
+				treeAddEntry(self.collections, collectionid, result.archive.groupid, result.archive.title)
+			if (o_groupid !== groupid || o_title !== title)
+				treeRemoveEntry(self.collections, collectionid, o_groupid, o_title)
+			treeAddEntry(self.collections, collectionid, groupid, title)
+			if (KV_VERSION === 2) self.forgetDeleted(collectionid, groupid, title)
+
+			// The form may show another entry by now
+			if (! self.shows(collectionid, groupid, title)) return
+			self.changed = result.data.changed
+			self.pwChanged = result.data.pwChanged
+			self.o_collectionid = collectionid;
+			self.o_groupid = groupid;
+			self.o_title = title;
+			self.o_url = saved.url;
+			self.o_userid = saved.userid;
+			self.o_password = saved.password;
+			self.o_notes = saved.notes;
+			self.showPW = false;
+			self.error = message
+			if (KV_VERSION === 2) return self.loadHistory(collectionid, groupid, title)
+		})
 	},
 
 	// Show the plaintext password toggle button (eyeball)
@@ -469,36 +1291,40 @@ Vue.component('pwmgr', {
 	    this.showPW = !this.showPW;
 	},
 
-	// Show PW entry details when a navigation entry is selected
+	// Show PW entry details when a navigation entry is selected. When entries are
+	// clicked in quick succession the last one is shown.
 	displayEntry: function (collectionId, entryId) {
 	    console.log("displayEntry %s %s", collectionId, entryId)
-		// Make sure the groups field gets set for the current collection
-		this.groups = null
-		for (var i=0; i < this.collections.length; i++) {
-			if (this.collections[i].name === collectionId) {
-				this.groups = this.collections[i].entries
-				break
-			}
-		}
-	    var data = getDetails(collectionId + entryId)
-	    console.log("group=%s title=%s user=%s",data.groupid, data.title, data.userid)
-	    this.o_collectionid = collectionId
-	    this.o_groupid = data.groupid
-	    this.o_title = data.title
-		this.o_url = data.url;
-		this.o_userid = data.userid;
-        this.o_password = data.password
-		this.o_notes = data.notes;
-	    this.collectionid = collectionId
-	    this.groupid = data.groupid
-	    this.title = data.title
-	    this.userid = data.userid
-	    this.password = data.password
-        this.url = data.url
-	    this.notes = data.notes
-        this.changed = data.changed
-        this.pwChanged = data.pwChanged
-        this.showPW = false
+	    var self = this
+	    var entrypath = collectionId + entryId
+	    this.displaying = entrypath
+	    return getDetails(entrypath).then(function (data) {
+	        if (self.displaying !== entrypath) return
+	        console.log("group=%s title=%s user=%s",data.groupid, data.title, data.userid)
+	        self.o_collectionid = collectionId
+	        self.o_groupid = data.groupid
+	        self.o_title = data.title
+	        self.o_url = data.url;
+	        self.o_userid = data.userid;
+	        self.o_password = data.password
+	        self.o_notes = data.notes;
+	        self.collectionid = collectionId
+	        self.groupid = data.groupid
+	        self.title = data.title
+	        self.userid = data.userid
+	        self.password = data.password
+	        self.url = data.url
+	        self.notes = data.notes
+	        self.changed = data.changed
+	        self.pwChanged = data.pwChanged
+	        self.showPW = false
+	        self.history = []
+	        self.version = ""
+	        if (data.deleted) self.error = "Deleted "+ data.deleted +". Undelete restores it."
+	        else if (KV_VERSION === 2) self.loadHistory(collectionId, data.groupid, data.title)
+	    }, function (err) {
+	        if (self.displaying === entrypath) self.error = err.message
+	    })
 	},
 
 	copyuserid: function() {
@@ -525,6 +1351,34 @@ Vue.component('pwmgr', {
     }
 })
 
+// define the request timings panel, shown with DEBUG_PANEL. Times are in milliseconds.
+Vue.component('timings', {
+    template: "#timings-template",
+    data: function () {
+        return {
+            open: false,
+            summary: [],
+            timer: null,
+        }
+    },
+
+    beforeDestroy: function () {
+        clearInterval(this.timer)
+    },
+
+    methods: {
+        // Show or hide the table, which is refreshed every second while shown
+        toggle: function () {
+            this.open = ! this.open
+            clearInterval(this.timer)
+            if (! this.open) return
+            var self = this
+            this.summary = timingSummary()
+            this.timer = setInterval(function () { self.summary = timingSummary() }, 1000)
+        },
+    },
+})
+
 // Main app component. Handle switch between login screen and the main page.
 Vue.component('application', {
     template: "#app-template",
@@ -536,6 +1390,15 @@ Vue.component('application', {
     methods: {
 		authComplete: function() {
 			this.flow= 'main';
+			touchIdleTimer()
+			console.log('flow=%s', this.flow);
+		},
+		// Forget the token and any cached secrets, then show the login screen.
+		logout: function() {
+			window.userToken = ""
+			window.vaultid = ""
+			cacheClear()
+			this.flow= 'auth';
 			console.log('flow=%s', this.flow);
 		}
     }
@@ -575,25 +1438,86 @@ Vue.component('confirm', {
 	}
 })
 
-/* This is the group component of the navigation tree. Open and close the enclosed items. */
+/* This is the group component of the navigation tree. Open and close the enclosed items.
+Groups with more than NAV_WINDOW entries show them in a scrolling window that only
+renders the rows in view, with spacers above and below standing in for the rest. */
 Vue.component('group', {
     template: '#group-template',
     props: {
-		collectionid: String,
+		collection: Object,
         model: Object
 	},
     data: function () {
         return {
-            open: false
+            open: false,
+            scrollTop: 0,
+            rowHeight: 24,      // measured once rows are shown
+            scrollPending: false,
         }
     },
+    computed: {
+        windowed: function () {
+            return this.model.entries.length > NAV_WINDOW
+        },
+        // Index of the first and one past the last rendered row
+        first: function () {
+            return Math.max(0, Math.floor(this.scrollTop / this.rowHeight) - NAV_OVERSCAN)
+        },
+        last: function () {
+            var end = Math.ceil(this.scrollTop / this.rowHeight) + NAV_ROWS + NAV_OVERSCAN
+            return Math.min(this.model.entries.length, end)
+        },
+        rows: function () {
+            if (! this.windowed) return this.model.entries
+            return this.open ? this.model.entries.slice(this.first, this.last) : []
+        },
+        padTop: function () {
+            return this.first * this.rowHeight
+        },
+        padBottom: function () {
+            return Math.max(0, this.model.entries.length - this.last) * this.rowHeight
+        },
+        windowStyle: function () {
+            return this.windowed ? {maxHeight: NAV_ROWS * this.rowHeight +"px"} : {}
+        },
+    },
+    updated: function () {
+        this.measureRow()
+    },
     methods: {
         toggle: function () {
             this.open = !this.open
+            if (! this.open) return
+            var collectionid = this.collection.name, group = this.model
+            if (group.loaded) prefetchGroup(collectionid, group)
+            else if (! group.loading) loadGroup(this.collection, group).then(function () {
+                prefetchGroup(collectionid, group)
+            })
+        },
+        // The user is likely to open the group under the mouse pointer
+        hover: function () {
+            prefetchGroup(this.collection.name, this.model)
+        },
+        // Follow the scroll position at most once per animation frame
+        scrolled: function (event) {
+            if (! this.windowed || this.scrollPending) return
+            this.scrollPending = true
+            var self = this
+            window.requestAnimationFrame(function () {
+                self.scrollPending = false
+                self.scrollTop = event.target.scrollTop
+            })
+        },
+        // Take the row height from a rendered row, it depends on the fonts
+        measureRow: function () {
+            if (! this.windowed) return
+            var row = this.$el.querySelector(".itemname")
+            var height = row ? row.parentNode.offsetHeight : 0
+            if (height > 0 && height !== this.rowHeight) this.rowHeight = height
         },
 		displayItem: function (entryid) {
 			console.log('Selected entryid=%s', entryid)
-			eventHub.$emit('displayEntry', this.collectionid, entryid);
+			eventHub.$emit('displayEntry', this.collection.name, entryid);
 		},
     }
 })
@@ -612,6 +1536,7 @@ Vue.component('collection', {
     methods: {
         toggle: function () {
             this.open = !this.open
+            if (this.open) eventHub.$emit('openCollection', this.model)
         },
     }
 })
@@ -620,5 +1545,6 @@ Vue.component('collection', {
 // boot up the application
 var demo = new Vue({
     el: '#demo',
+    render: function (h) { return h("application", {attrs: {id: "demo"}}) },
 },
 )
@@ -0,0 +1,348 @@
+/*
+In-memory search index over the password entries in the navigation tree.
+
+Entries are indexed by the words of their title and group name, and optionally by
+the URL and userid once their details have been read. Each entry is keyed by its path
+below VPWMGR ("<collection><group>/<title>"), the same key used by the details cache.
+The index is updated entry by entry as the tree changes, it is never rebuilt.
+
+A query matches entries where every query word is a prefix of one of the entry's
+words. A query word that is the prefix of no word is matched against words within a
+small edit distance instead. The candidates for those are found through an index of
+the letter pairs at the start of each word (see _fuzzyCandidates), so a search does
+not have to look at every word.
+*/
+
+// Relative weight of a word match by the field it was found in
+var SEARCH_WEIGHTS = {title: 3, group: 1, details: 2}
+
+// Number of leading characters of a word indexed by letter pairs for spelling matches
+var FUZZY_PREFIX = 12
+
+/* Return the letter pairs of the start of a word, with "^" standing for the start,
+as an array of [pair, position] arrays. */
+function letterPairs(word) {
+    var w = "^"+ word.slice(0, FUZZY_PREFIX)
+    var pairs = []
+    for (var i=0; i < w.length - 1; i++) pairs.push([w.substr(i, 2), i])
+    return pairs
+}
+
+/* Split text into lower case words. The whole text is also kept as one word so
+that titles with punctuation (e.g. "$+dream") can be found as typed. */
+function searchWords(text) {
+    var lower = String(text || "").toLowerCase()
+    var words = lower.split(/[^0-9a-z\u00c0-\uffff]+/).filter(function (w) { return w !== "" })
+    if (lower !== "" && words.indexOf(lower) < 0) words.push(lower)
+    return words
+}
+
+var distanceRows = [[], []]
+
+/* Edit distance between a and b, or max+1 if it is larger than max. */
+function boundedDistance(a, b, max) {
+    if (Math.abs(a.length - b.length) > max) return max + 1
+    // Two rows of the distance table are kept and reused, as this is called for
+    // every candidate word
+    var prev = distanceRows[0], cur = distanceRows[1], row
+    for (var j=0; j <= b.length; j++) prev[j] = j
+    for (var i=1; i <= a.length; i++) {
+        var ac = a.charCodeAt(i-1)
+        var rowMin = cur[0] = i
+        for (j=1; j <= b.length; j++) {
+            var d = prev[j-1] + (ac === b.charCodeAt(j-1) ? 0 : 1)
+            if (prev[j] + 1 < d) d = prev[j] + 1
+            if (cur[j-1] + 1 < d) d = cur[j-1] + 1
+            cur[j] = d
+            if (d < rowMin) rowMin = d
+        }
+        if (rowMin > max) return max + 1
+        row = prev, prev = cur, cur = row
+    }
+    return prev[b.length]
+}
+
+function SearchIndex() {
+    this.onchange = null        // called after every change, e.g. to refresh results
+    this.clear()
+}
+
+/* Forget everything. */
+SearchIndex.prototype.clear = function () {
+    this.docs = new Map()       // key -> {collection, group, title, words: {word: weight}, details}
+    this.groups = new Map()     // collection + group -> Set of keys
+    this.postings = new Map()   // word -> Map of key -> weight
+    this.words = []             // all words in sorted order
+    this.pairs = new Map()      // letter pair + "@" + position -> Set of words
+    this._changed()
+}
+
+SearchIndex.prototype._changed = function () {
+    if (this.onchange) this.onchange()
+}
+
+/* Add an entry. group ends with '/'. */
+SearchIndex.prototype.add = function (collection, group, title) {
+    var key = collection + group + title
+    if (this.docs.has(key)) return
+    var doc = {collection: collection, group: group, title: title, words: {}, details: false}
+    this.docs.set(key, doc)
+    var gkey = collection + group
+    if (! this.groups.has(gkey)) this.groups.set(gkey, new Set())
+    this.groups.get(gkey).add(key)
+    this._addNames(key, doc)
+    this._changed()
+}
+
+/* Index the words of the title and group name of an entry. */
+SearchIndex.prototype._addNames = function (key, doc) {
+    this._addWords(key, doc, searchWords(doc.title), SEARCH_WEIGHTS.title)
+    this._addWords(key, doc, searchWords(doc.group.replace(/\/$/, "")), SEARCH_WEIGHTS.group)
+}
+
+/* Remove an entry. */
+SearchIndex.prototype.remove = function (collection, group, title) {
+    var key = collection + group + title
+    var doc = this.docs.get(key)
+    if (! doc) return
+    for (var word in doc.words) this._removePosting(word, key)
+    this.docs.delete(key)
+    var keys = this.groups.get(collection + group)
+    keys.delete(key)
+    if (keys.size === 0) this.groups.delete(collection + group)
+    this._changed()
+}
+
+/* Replace the entries of a group with a new list of titles. */
+SearchIndex.prototype.setGroup = function (collection, group, titles) {
+    this.removeGroup(collection, group)
+    for (var i=0; i < titles.length; i++) this.add(collection, group, titles[i])
+}
+
+/* Remove all entries of a group. */
+SearchIndex.prototype.removeGroup = function (collection, group) {
+    var keys = this.groups.get(collection + group)
+    if (! keys) return
+    var self = this
+    Array.from(keys).forEach(function (key) {
+        var doc = self.docs.get(key)
+        self.remove(doc.collection, doc.group, doc.title)
+    })
+}
+
+/* Remove all entries of a collection. */
+SearchIndex.prototype.removeCollection = function (collection) {
+    var self = this
+    Array.from(this.groups.keys()).forEach(function (gkey) {
+        if (gkey.indexOf(collection) === 0)
+            self.removeGroup(collection, gkey.slice(collection.length))
+    })
+}
+
+/* Index the URL and userid of an entry from its details. */
+SearchIndex.prototype.addDetails = function (key, data) {
+    var doc = this.docs.get(key)
+    if (! doc) return
+    var words = searchWords(data.userid).concat(searchWords(data.url))
+    doc.details = true
+    this._addWords(key, doc, words, SEARCH_WEIGHTS.details)
+    this._changed()
+}
+
+/* Forget the words taken from entry details. A word can come from the details and
+the title or group name with the weight of only one, so the entries with details
+are indexed again from their title and group name. */
+SearchIndex.prototype.clearDetails = function () {
+    var self = this
+    this.docs.forEach(function (doc, key) {
+        if (! doc.details) return
+        for (var word in doc.words) self._removePosting(word, key)
+        doc.words = {}
+        doc.details = false
+        self._addNames(key, doc)
+    })
+    this._changed()
+}
+
+SearchIndex.prototype._addWords = function (key, doc, words, weight) {
+    for (var i=0; i < words.length; i++) {
+        var word = words[i]
+        if ((doc.words[word] || 0) >= weight) continue
+        doc.words[word] = weight
+        var posting = this.postings.get(word)
+        if (! posting) {
+            posting = new Map()
+            this.postings.set(word, posting)
+            this.words.splice(this._wordIndex(word), 0, word)
+            this._addPairs(word)
+        }
+        posting.set(key, weight)
+    }
+}
+
+SearchIndex.prototype._removePosting = function (word, key) {
+    var posting = this.postings.get(word)
+    if (! posting) return
+    posting.delete(key)
+    if (posting.size > 0) return
+    this.postings.delete(word)
+    this.words.splice(this._wordIndex(word), 1)
+    this._removePairs(word)
+}
+
+SearchIndex.prototype._addPairs = function (word) {
+    var pairs = letterPairs(word)
+    for (var i=0; i < pairs.length; i++) {
+        var pkey = pairs[i][0] +"@"+ pairs[i][1]
+        var words = this.pairs.get(pkey)
+        if (! words) this.pairs.set(pkey, words = new Set())
+        words.add(word)
+    }
+}
+
+SearchIndex.prototype._removePairs = function (word) {
+    var pairs = letterPairs(word)
+    for (var i=0; i < pairs.length; i++) {
+        var pkey = pairs[i][0] +"@"+ pairs[i][1]
+        var words = this.pairs.get(pkey)
+        if (! words) continue
+        words.delete(word)
+        if (words.size === 0) this.pairs.delete(pkey)
+    }
+}
+
+/* Index of word in the sorted word list or where it would be inserted. */
+SearchIndex.prototype._wordIndex = function (word) {
+    var lo = 0, hi = this.words.length
+    while (lo < hi) {
+        var mid = (lo + hi) >> 1
+        if (this.words[mid] < word) lo = mid + 1
+        else hi = mid
+    }
+    return lo
+}
+
+/* Return a Map of key -> score for the entries matching one query word by prefix,
+or by a close spelling when fuzzy is set and no word starts with it. */
+SearchIndex.prototype._match = function (qword, fuzzy) {
+    var scores = new Map()
+    var self = this
+    function addPosting(word, quality) {
+        self.postings.get(word).forEach(function (weight, key) {
+            var score = weight * quality
+            if ((scores.get(key) || 0) < score) scores.set(key, score)
+        })
+    }
+    for (var i=this._wordIndex(qword); i < this.words.length; i++) {
+        var word = this.words[i]
+        if (word.lastIndexOf(qword, 0) !== 0) break
+        addPosting(word, word === qword ? 3 : 2)
+    }
+    // Spelling mistakes in the first letter are not looked for, which keeps the
+    // candidates to the words sharing it
+    if (fuzzy && scores.size === 0 && qword.length >= 3) {
+        var max = qword.length >= 6 ? 2 : 1
+        var candidates = this._fuzzyCandidates(qword, max)
+        for (i=0; i < candidates.length; i++) {
+            word = candidates[i]
+            if (word.charAt(0) !== qword.charAt(0)) continue
+            if (word.length < qword.length - max) continue
+            if (boundedDistance(qword, word.slice(0, qword.length), max) <= max)
+                addPosting(word, 1)
+        }
+    }
+    return scores
+}
+
+/* Return the words whose start may be within max edits of qword. Each edit changes
+at most two letter pairs and moves the ones after it by at most one place, so such
+a word shares all but 2*max of the letter pairs of qword at about the same place.
+The words with fewer are left out, the rest still have to be checked. */
+SearchIndex.prototype._fuzzyCandidates = function (qword, max) {
+    var pairs = letterPairs(qword)
+    var need = Math.max(1, pairs.length - 2*max)
+    // A word is counted once for each query pair, wherever it is found
+    var counts = new Map(), last = new Map(), candidates = []
+    for (var i=0; i < pairs.length; i++) {
+        for (var pos = Math.max(0, pairs[i][1] - max); pos <= pairs[i][1] + max; pos++) {
+            var words = this.pairs.get(pairs[i][0] +"@"+ pos)
+            if (! words) continue
+            words.forEach(function (word) {
+                if (last.get(word) === i) return
+                last.set(word, i)
+                var count = (counts.get(word) || 0) + 1
+                counts.set(word, count)
+                if (count === need) candidates.push(word)
+            })
+        }
+    }
+    return candidates
+}
+
+/* Return up to limit matching entries as {collection, group, title, score} objects,
+best first. */
+SearchIndex.prototype.search = function (query, limit) {
+    var terms = String(query || "").toLowerCase().split(/\s+/).filter(function (t) { return t !== "" })
+    if (terms.length === 0) return []
+    var scores = this._search(terms, false)
+    if (scores.size === 0) scores = this._search(terms, true)
+    // Only the best limit results are kept in order, a short query can match
+    // most of the entries
+    var ranked = []
+    scores.forEach(function (score, key) {
+        var r = [score, key]
+        if (ranked.length && ranked.length >= limit && byRank(r, ranked[ranked.length-1]) >= 0) return
+        var lo = 0, hi = ranked.length
+        while (lo < hi) {
+            var mid = (lo + hi) >> 1
+            if (byRank(ranked[mid], r) < 0) lo = mid + 1
+            else hi = mid
+        }
+        ranked.splice(lo, 0, r)
+        if (ranked.length > limit) ranked.pop()
+    })
+    var docs = this.docs
+    return ranked.map(function (r) {
+        var doc = docs.get(r[1])
+        return {collection: doc.collection, group: doc.group, title: doc.title, score: r[0]}
+    })
+}
+
+/* Order of [score, key] results: best score first, then by key. */
+function byRank(a, b) {
+    return b[0] - a[0] || (a[1] < b[1] ? -1 : a[1] > b[1] ? 1 : 0)
+}
+
+/* Intersection of two score maps, adding the scores. */
+function intersectScores(a, b) {
+    var result = new Map()
+    a.forEach(function (score, key) {
+        if (b.has(key)) result.set(key, score + b.get(key))
+    })
+    return result
+}
+
+/* Map of key -> score of the entries matching every query term. A term with
+punctuation matches either as typed or, with a lower score, by all of its word
+parts, so "web|x" finds the titles "web|x|2018" and "x web" alike. */
+SearchIndex.prototype._search = function (terms, fuzzy) {
+    var total = null
+    for (var i=0; i < terms.length; i++) {
+        var words = searchWords(terms[i])
+        var scores = this._match(terms[i], fuzzy)
+        if (words.length > 1) {
+            var parts = null
+            for (var j=0; j < words.length; j++) {
+                if (words[j] === terms[i]) continue
+                var match = this._match(words[j], fuzzy)
+                parts = parts === null ? match : intersectScores(parts, match)
+            }
+            parts.forEach(function (score, key) {
+                score = score / 2
+                if ((scores.get(key) || 0) < score) scores.set(key, score)
+            })
+        }
+        total = total === null ? scores : intersectScores(total, scores)
+    }
+    return total
+}
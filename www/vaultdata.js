@@ -0,0 +1,392 @@
+/*
+Vault data layer of the password manager: asynchronous Vault requests and the listing
+of collections, groups and entry names for the navigation tree.
+
+This file is loaded by the page and by the data worker (dataworker.js). When the
+worker runs, the page calls these functions through dataCall() in pwmgr.js, so that
+the requests, JSON parsing and tree building happen off the UI thread. Everything
+here works on plain objects and may only use what a Web Worker offers (no document,
+no Vue), with window standing for the global scope.
+*/
+
+// Name of the special group for historical entries. Deleted entries are stored here,
+// in a sub-group per period (see ARCHIVE_SHARD in config.js), e.g. "Archive/2018-01".
+var HISTGROUP="Archive"
+
+/* Vault requests waiting for a free connection slot and the number in flight.
+See MAXREQUESTS in config.js. */
+var requestQueue = []
+var requestsActive = 0
+
+/* Called, when set, each time the last request in flight has completed. The page
+uses it to tell when rendering has settled, see renderSettled() in pwmgr.js. */
+var requestsDone = null
+
+/* Make an asynchronous request to the Vault server. Returns a promise for an object
+with the HTTP status and the parsed JSON response body (null when there is none).
+The promise is always resolved, a network failure shows up as status 0. At most
+MAXREQUESTS requests are sent at once, the rest wait in requestQueue.
+*/
+function vaultRequest(method, relURL, dataobj) {
+    return new Promise(function (resolve) {
+        requestQueue.push({method: method, relURL: relURL, dataobj: dataobj, resolve: resolve})
+        runRequestQueue()
+    })
+}
+
+/* Start queued requests while there are free slots. */
+function runRequestQueue() {
+    while (requestsActive < MAXREQUESTS && requestQueue.length > 0) {
+        var req = requestQueue.shift()
+        requestsActive += 1
+        sendRequest(req)
+    }
+}
+
+/* Send one queued request and resolve its promise when the response is complete. */
+function sendRequest(req) {
+    var xhttp = new XMLHttpRequest();
+    var start = timeNow()
+    xhttp.open(req.method, BASEURL + encodeURI(req.relURL), true);
+    xhttp.setRequestHeader("Content-type", "application/json");
+    xhttp.setRequestHeader("X-Vault-Token",window.userToken);
+    xhttp.onloadend = function () {
+        recordTiming(requestOp(req.method, req.relURL), timeNow() - start)
+        requestsActive -= 1
+        var body = null
+        if (xhttp.responseText) {
+            try { body = JSON.parse(xhttp.responseText) }
+            catch (e) { body = null }
+        }
+        req.resolve({status: xhttp.status, body: body})
+        runRequestQueue()
+        if (requestsActive === 0 && requestsDone) requestsDone()
+    }
+    xhttp.send(req.dataobj === undefined ? null : JSON.stringify(req.dataobj));
+}
+
+/* Round trip times in milliseconds of Vault requests by operation (see requestOp),
+with the request count and the last TIMING_SAMPLES times of each. */
+var requestTimings = {}
+
+/* Set in the data worker, where timings are also kept in pendingTimings as
+[operation, time] pairs until they are passed on to the page. */
+var forwardTimings = false
+var pendingTimings = []
+
+/* Milliseconds from an arbitrary start, for timing */
+function timeNow() {
+    return typeof performance !== "undefined" ? performance.now() : Date.now()
+}
+
+/* The operation a Vault request is timed under */
+function requestOp(method, relURL) {
+    if (relURL.indexOf("v1/auth/") === 0) return "login"
+    if (relURL.indexOf("pwmgr/tree") === 0) return "tree"
+    if (relURL.indexOf("v1/sys/") === 0) return "capabilities"
+    if (relURL.indexOf("?list=true") >= 0) return relURL === kvList("team/") ? "list team" : "list group"
+    if (method === "GET") return "read entry"
+    if (method === "DELETE") return "delete"
+    return relURL.indexOf("/"+ HISTGROUP +"/") >= 0 ? "archive" : "write"
+}
+
+/* Record the time a request took */
+function recordTiming(op, ms) {
+    var timing = requestTimings[op]
+    if (! timing) timing = requestTimings[op] = {count: 0, samples: []}
+    timing.count += 1
+    timing.samples.push(ms)
+    if (timing.samples.length > TIMING_SAMPLES) timing.samples.shift()
+    if (forwardTimings) pendingTimings.push([op, ms])
+}
+
+/* Return the timings as a list of {op, count, p50, p95, p99, max} sorted by operation.
+The percentiles are over the kept samples, in whole milliseconds. */
+function timingSummary() {
+    return Object.keys(requestTimings).sort().map(function (op) {
+        var samples = requestTimings[op].samples.slice().sort(function (a, b) { return a - b })
+        function percentile(p) {
+            return Math.round(samples[Math.max(0, Math.ceil(p / 100 * samples.length) - 1)])
+        }
+        return {op: op, count: requestTimings[op].count, p50: percentile(50), p95: percentile(95),
+                p99: percentile(99), max: Math.round(samples[samples.length - 1])}
+    })
+}
+
+/* Vault API path for a path below VPWMGR. A KV version 2 secrets engine serves each
+path under several endpoints (data, metadata, delete, undelete), which go after the
+mount point. See KV_VERSION in config.js.
+*/
+function kvPath(endpoint, path) {
+    if (KV_VERSION !== 2) return VPWMGR + path
+    return KV_MOUNT + endpoint +"/"+ VPWMGR.slice(KV_MOUNT.length) + path
+}
+
+/* Vault API path for listing a collection or group below VPWMGR */
+function kvList(path) {
+    return kvPath("metadata", path) +"?list=true"
+}
+
+/* The secret data in the body of a read response */
+function kvData(body) {
+    return KV_VERSION === 2 ? body.data.data : body.data
+}
+
+/* Message for a failed Vault request */
+function requestError(status) {
+    if (status === 0) return "Vault not reachable"
+    return "Vault error "+ status
+}
+
+/* Return a promise for the list of collection names of form "(user|team)/<collectionname>/".
+The user's own collection is first followed by the teams the user can access in sorted order.
+*/
+function getCollectionNames(vaultid) {
+    return vaultRequest("GET", kvList("team/")).then(function (response) {
+        if (response.status !== 200) return []
+        var teamnames = response.body.data.keys.sort();
+        return accessibleTeams(teamnames.map(function (name) { return "team/"+ name }))
+    }).then(function (teams) {
+        var clist = [ "user/"+ vaultid +"/"].concat(teams)
+        console.log('collection list:%s', clist.join(" "))
+        return clist
+    })
+}
+
+/* Which team collections the current token can list, keyed by collection name. Filled
+in from sys/capabilities-self and kept for the life of the token. */
+var teamAccess = {token: "", teams: {}}
+
+/* Return a promise for the team collection names that the current token can list.
+Teams not seen before are looked up together in one sys/capabilities-self request.
+If Vault cannot answer that, all names are returned and teams without access are
+dropped when listing them fails.
+*/
+function accessibleTeams(names) {
+    if (teamAccess.token !== window.userToken) teamAccess = {token: window.userToken, teams: {}}
+    var vaultPrefix = kvPath("metadata", "").replace(/^v1\//, "")
+    var unknown = names.filter(function (name) { return !(name in teamAccess.teams) })
+    var lookup = Promise.resolve(true)
+    if (unknown.length > 0) {
+        var paths = unknown.map(function (name) { return vaultPrefix + name })
+        lookup = vaultRequest("POST", "v1/sys/capabilities-self", {paths: paths}).then(function (response) {
+            if (response.status !== 200 || ! response.body) return false
+            var answers = response.body.data || response.body
+            for (var i=0; i < paths.length; i++) {
+                var caps = answers[paths[i]]
+                if (! caps) return false
+                teamAccess.teams[unknown[i]] = caps.indexOf("list") >= 0 || caps.indexOf("root") >= 0
+            }
+            return true
+        })
+    }
+    return lookup.then(function (known) {
+        if (! known) return names
+        return names.filter(function (name) { return teamAccess.teams[name] })
+    })
+}
+
+/* False once the server has answered that it does not offer the tree endpoint */
+var treeEndpoint = true
+
+/* Return a promise for the whole navigation tree from the server's pwmgr/tree endpoint
+(see httpd.py). It is an array of {name, entries, error} collection objects holding
+group objects. Resolves to null if the endpoint is not available. When the server
+does not know the endpoint (404 or 501) it is not tried again; other failures, such
+as Vault restarting behind the server, only make this one listing go per path.
+*/
+function getTree(vaultid) {
+    // The server builds the tree from KV version 1 listings
+    if (! treeEndpoint || KV_VERSION === 2) return Promise.resolve(null)
+    return vaultRequest("GET", "pwmgr/tree?vaultid="+ vaultid).then(function (response) {
+        if (response.status === 200 && response.body && response.body.collections)
+            return response.body.collections.map(treeCollection)
+        console.log('Tree endpoint failed (%s), listing per path', response.status)
+        if (response.status === 404 || response.status === 501) treeEndpoint = false
+        return null
+    })
+}
+
+/* Turn a collection of the tree endpoint into a plain collection object with group
+objects. Archive periods come without entries, they are loaded when opened. */
+function treeCollection(c) {
+    var groups = (c.entries || []).map(function (g) {
+        var group = newGroup(decodeURI(g.name))
+        group.entries = (g.entries || []).map(decodeURI)
+        group.loaded = g.entries !== null
+        return group
+    })
+    return {name: c.name, entries: groups, error: c.error || ""}
+}
+
+/* Create an empty collection object for the navigation tree. titles maps the name
+of each loaded group to a Set of its entry titles, see indexCollection in pwmgr.js.
+Vue does not watch a Map, so titlesVersion is bumped whenever it changes. */
+function newCollection(name) {
+    return {name: name, entries: [], loaded: false, loading: false, error: "",
+            titles: new Map(), titlesVersion: 0}
+}
+
+/* Create an empty group object for a collection */
+function newGroup(name) {
+    return {name: name, entries: [], loaded: false, loading: false, error: ""}
+}
+
+/* Return a promise for an array of group objects for a collection without their
+entries, except for entries archived before ARCHIVE_SHARD was in use, which come
+with the archive group. A collectionpath format is either "user/<vaultid>/" or "team/<teamid>/"
+Resolves to null if a collection cannot be retrieved as in the case for teams which the 
+user does not have access to. Other failures reject the promise.
+
+Vault list groups response looks similar to the following (groups=network, web)
+/ {"request_id":"5eec889b-4bd2-e309-a7be-e4a1265e37f4","lease_id":"","renewable":false,"lease_duration":0,"data":{"keys":["network/","web/"]},"wrap_info":null,"warnings":null,"auth":null}
+*/
+function getGroupNames(collectionpath) {
+    console.log('getGroupNames for %s',collectionpath);
+    var requests = [vaultRequest("GET", kvList(collectionpath)), loadDeleted(collectionpath)]
+    return Promise.all(requests).then(function (results) {
+        var response = results[0]
+        if (response.status === 403 || response.status === 404) return null
+        if (response.status !== 200) throw new Error(requestError(response.status))
+        var keys = response.body.data.keys.filter(function (key) { return key !== DELETED_SECRET })
+        var groups = keys.map(function (groupname) {
+            return newGroup(decodeURI(groupname))
+        })
+        return expandArchive(collectionpath, groups)
+    })
+}
+
+/* True for the archive group and its per-period sub-groups. */
+function isArchive(groupid) {
+    return groupid === HISTGROUP || groupid.indexOf(HISTGROUP +"/") === 0
+}
+
+/* True for the group name (ending with '/') of an archive period */
+function isArchivePeriod(groupname) {
+    return groupname.indexOf(HISTGROUP +"/") === 0 && groupname !== HISTGROUP +"/"
+}
+
+/* Return the archive group for an entry archived at a YYYYMMDDhhmmss timestamp. */
+function archiveGroup(timestamp) {
+    if (ARCHIVE_SHARD === "month") return HISTGROUP +"/"+ timestamp.slice(0,4) +"-"+ timestamp.slice(4,6)
+    if (ARCHIVE_SHARD === "year") return HISTGROUP +"/"+ timestamp.slice(0,4)
+    return HISTGROUP
+}
+
+/* Archived entries are kept in a sub-group of the archive group per period. Replace
+the archive group in an array of group objects by one group per period, named e.g.
+"Archive/2018-01/", which are loaded when opened. The archive group itself is kept
+with its entries if it holds any from before the archive was split up.
+With KV_VERSION 2 the archive group lists the deleted entries instead.
+In LAZYLOAD mode the archive group is left as it is, it is listed when opened like
+any other group (see addArchivePeriods in pwmgr.js). Returns a promise for the array.
+*/
+function expandArchive(collectionpath, groups) {
+    if (KV_VERSION === 2) return Promise.resolve(deletedArchive(collectionpath, groups))
+    if (LAZYLOAD) return Promise.resolve(groups)
+    var archive = HISTGROUP +"/"
+    var i = groups.map(function (g) { return g.name }).indexOf(archive)
+    if (i < 0) return Promise.resolve(groups)
+    return getGroupEntries(collectionpath, archive).then(function (keys) {
+        var group = groups[i]
+        group.entries = keys.filter(function (key) { return key.slice(-1) !== "/" })
+        group.loaded = true
+        var periods = keys.filter(function (key) { return key.slice(-1) === "/" })
+        var replace = group.entries.length > 0 ? [group] : []
+        for (var j=0; j < periods.length; j++) replace.push(newGroup(archive + periods[j]))
+        groups.splice.apply(groups, [i, 1].concat(replace))
+        return groups
+    })
+}
+
+/* Return a promise for an array of password group objects consisting of names (with
+ending '/') and an array of entry names for the given collection id. Resolves to null
+when the collection cannot be retrieved, see getGroupNames.
+*/
+function getCollection(collectionpath) {
+    console.log('getCollection for %s',collectionpath);
+    return getGroupNames(collectionpath).then(function (groups) {
+        if (! groups) return null
+        return Promise.all(groups.map(function (group) {
+            if (group.loaded || isArchivePeriod(group.name)) return group
+            return getGroupEntries(collectionpath, group.name).then(function (entries) {
+                group.entries = entries
+                group.loaded = true
+                return group
+            })
+        }))
+    })
+}
+
+/* Return a promise for the array of entry names in a group. The groupname ends with '/'. */
+function getGroupEntries(collectionpath, groupname) {
+    return vaultRequest("GET", kvList(collectionpath + groupname)).then(function (response) {
+        if (response.status === 404) return []
+        if (response.status !== 200) throw new Error(requestError(response.status))
+        var deleted = deletedEntries[collectionpath] || {}
+        return response.body.data.keys.map(decodeURI).filter(function (key) {
+            return !((groupname + key) in deleted)
+        })
+    })
+}
+
+/* With KV_VERSION 2 an update is a new version of the entry's secret, and a deleted
+entry is soft deleted so that it can be undeleted. The deleted entries of a collection
+are recorded in a secret of the collection named DELETED_SECRET, keyed by
+"<group>/<title>". A record is {deleted: <time>, title: <title in the archive group>}
+for a deleted entry and {deleted: <time>, moved_to: "<group>/<title>"} for the old
+name of a moved or renamed entry. Vault keeps listing soft deleted entries, so they
+are left out of the navigation tree and deleted ones are shown in the archive group.
+*/
+var DELETED_SECRET = ".deleted"
+
+/* The DELETED_SECRET records of collections as last read or written */
+var deletedEntries = {}
+
+/* Return a promise for the DELETED_SECRET records of a collection */
+function loadDeleted(collectionpath) {
+    if (KV_VERSION !== 2) return Promise.resolve({})
+    return vaultRequest("GET", kvPath("data", collectionpath + DELETED_SECRET)).then(function (response) {
+        var entries = response.status === 200 ? kvData(response.body) : {}
+        deletedEntries[collectionpath] = entries
+        return entries
+    })
+}
+
+/* Add the archive group with the deleted entries of a collection to its groups */
+function deletedArchive(collectionpath, groups) {
+    var deleted = deletedEntries[collectionpath] || {}
+    var titles = []
+    for (var key in deleted) {
+        if (deleted[key].title) titles.push(deleted[key].title)
+    }
+    if (titles.length === 0) return groups
+    var group = newGroup(HISTGROUP +"/")
+    group.entries = titles.sort()
+    group.loaded = true
+    groups.splice(sortedIndex(groups.map(function (g) { return g.name }), group.name), 0, group)
+    return groups
+}
+
+/* Return the index of name in a sorted array or where it would be inserted. */
+function sortedIndex(names, name) {
+    var lo = 0, hi = names.length
+    while (lo < hi) {
+        var mid = (lo + hi) >> 1
+        if (names[mid] < name) lo = mid + 1
+        else hi = mid
+    }
+    return lo
+}
+
+/* The functions dataCall() may run in the data worker. Each returns a promise for a
+result that can be posted between threads. vaultRequest is among them so that the
+page's own requests wait in the same requestQueue, see dataRequest() in pwmgr.js. */
+var dataCalls = {
+    vaultRequest: vaultRequest,
+    getTree: getTree,
+    getCollectionNames: getCollectionNames,
+    getGroupNames: getGroupNames,
+    getCollection: getCollection,
+    getGroupEntries: getGroupEntries,
+}